@@ -1,6 +1,6 @@
 import os
-import datetime
 import asyncio
+import logging
 import discord
 from dotenv import load_dotenv
 from discord.ext import commands
@@ -8,6 +8,9 @@ from discord.ext import commands
 # 核心引擎載入
 from ai_engine import GeminiEngine
 from music_engine import SparkMusicEngine
+from edit_scheduler import EditScheduler
+from log_sink import LogSink
+import storage
 
 load_dotenv()
 
@@ -22,8 +25,15 @@ MODEL_ID = 'gemma3:4b'
 LOG_CHANNEL_ID = 1474497872258138337
 # ===============================================
 
-ai = GeminiEngine(MODEL_ID)
-music = SparkMusicEngine(client_id=SPOTIFY_ID, client_secret=SPOTIFY_SECRET)
+# 引擎在啟動區建立 (ai / music)：yt-dlp 子行程會以 __mp_main__ 重新載入這個檔案，
+# 放在模組層級的話每個子行程都會再建一套引擎
+ai = None
+music = None
+
+def _log_level(name):
+    """SPARK_LOG_LEVEL 轉成數字等級：大小寫都接受，看不懂的值退回 INFO"""
+    level = logging.getLevelName(name.strip().upper())
+    return level if isinstance(level, int) else logging.INFO
 
 class SparkBot(commands.Bot):
     def __init__(self):
@@ -36,28 +46,50 @@ class SparkBot(commands.Bot):
             intents=intents,
             help_command=None
         )
+        # ✏️ 所有面板編輯與 Log 共用的速率額度 (每頻道 N 次 / 秒數，全域每秒上限)
+        self.editor = EditScheduler(
+            per_channel=int(os.getenv("SPARK_EDIT_PER_CHANNEL", "5")),
+            per_seconds=float(os.getenv("SPARK_EDIT_WINDOW", "5")),
+            global_rate=int(os.getenv("SPARK_EDIT_GLOBAL", "40"))
+        )
+        # 📜 Log 頻道改成批次送出，dispatch_log 不再等網路
+        self.log_sink = LogSink(
+            self, LOG_CHANNEL_ID,
+            interval=float(os.getenv("SPARK_LOG_INTERVAL", "3")),
+            capacity=int(os.getenv("SPARK_LOG_CAPACITY", "500")),
+            min_level=_log_level(os.getenv("SPARK_LOG_LEVEL", "INFO"))
+        )
 
-    async def dispatch_log(self, content: str):
-        """✨ 核心 Log 轉發：同時發送到終端機與 Discord 頻道"""
-        now = datetime.datetime.now().strftime("%H:%M:%S")
-        print(f"[{now}] {content}")
-
-        try:
-            channel = self.get_channel(LOG_CHANNEL_ID)
-            if channel:
-                await channel.send(f"`[{now}]` {content}")
-        except Exception as e:
-            print(f"❌ Log 頻道發送失敗: {e}")
+    async def dispatch_log(self, content: str, level=logging.INFO, **fields):
+        """✨ 核心 Log 轉發：終端機立刻印出，Discord 頻道由背景批次送出 (不會卡住呼叫端)"""
+        self.log_sink.emit(content, level, **fields)
 
     async def setup_hook(self):
         """初始化 Cog 擴充功能與同步指令"""
         try:
+            self.loop.create_task(self.log_sink.run())
             from commands import setup as setup_commands
             await setup_commands(self, ai, music)
+            # 💾 播放狀態在背景還原，不擋住啟動
+            self.loop.create_task(self.get_cog("AskCommand").restore_players())
             await self.tree.sync()
             await self.dispatch_log(f"✅ 系統初始化完成 | 模型: {MODEL_ID} | 模型位址: {OLLAMA_URL}")
         except Exception as e:
-            await self.dispatch_log(f"❌ 初始化失敗: {e}")
+            await self.dispatch_log(f"❌ 初始化失敗: {e}", logging.ERROR)
+
+    async def close(self):
+        """關機前把還沒寫進存檔的播放狀態與快取寫完"""
+        cog = self.get_cog("AskCommand")
+        if cog:
+            for player in cog.players.values():
+                if player.vc:
+                    cog.player_store.save_position(player.guild_id, player.position())
+            await asyncio.to_thread(cog.player_store.close)
+            await cog.lyrics_engine.close()
+        # 快取排隊中的背景寫入也寫完
+        await asyncio.to_thread(storage.flush_all)
+        await self.log_sink.flush()
+        await super().close()
 
 bot = SparkBot()
 
@@ -98,7 +130,7 @@ async def on_message(message):
                     )
                     await message.reply(answer, allowed_mentions=discord.AllowedMentions.none())
                 except Exception as e:
-                    await bot.dispatch_log(f"❌ AI 錯誤: {e}")
+                    await bot.dispatch_log(f"❌ AI 錯誤: {e}", logging.ERROR)
                     await message.reply("🌸 嗚...大腦連線好像有點不穩。")
             return # 處理完畢就結束
 
@@ -116,6 +148,8 @@ async def main():
             print("❌ 錯誤：找不到 DISCORD_TOKEN，請檢查 .env 檔案！")
 
 if __name__ == "__main__":
+    ai = GeminiEngine(MODEL_ID)
+    music = SparkMusicEngine(client_id=SPOTIFY_ID, client_secret=SPOTIFY_SECRET)
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -1,4 +1,5 @@
 import os
+import time
 import datetime
 from ollama import AsyncClient # 🌸 非同步連線，確保 AI 思考時音樂不卡頓
 
@@ -7,6 +8,7 @@ class GeminiEngine:
         """初始化 AI 大腦：連線設定與人格載入"""
         self.model_id = model_id
         self.chat_history = {}
+        self.last_seen = {}  # user_id -> 最後一次對話的時間 (清道夫用來丟掉太久沒說話的記憶)
 
         # ✨ 環境變數自動偵測
         # Docker 環境會讀取 .env 中的 OLLAMA_HOST_URL
@@ -36,6 +38,7 @@ class GeminiEngine:
         """處理對話並記錄 Log"""
         try:
             # 建立使用者專屬記憶
+            self.last_seen[user_id] = time.monotonic()
             if user_id not in self.chat_history:
                 self.chat_history[user_id] = [
                     {'role': 'system', 'content': self.system_prompt}
@@ -62,4 +65,13 @@ class GeminiEngine:
             # 異常 Log 紀錄
             now = datetime.datetime.now().strftime("%H:%M:%S")
             print(f"[{now}] ❌ AI 引擎錯誤: {e}")
-            return "🌸 嗚...連不上 Ollama 了呢...有開啟 Ollama 並設定 OLLAMA_HOST 嗎？✨"
\ No newline at end of file
+            return "🌸 嗚...連不上 Ollama 了呢...有開啟 Ollama 並設定 OLLAMA_HOST 嗎？✨"
+
+    def forget_idle(self, max_age):
+        """丟掉超過 max_age 秒沒說話的使用者記憶，回傳丟掉幾位"""
+        cutoff = time.monotonic() - max_age
+        stale = [uid for uid, seen in self.last_seen.items() if seen < cutoff]
+        for uid in stale:
+            del self.last_seen[uid]
+            self.chat_history.pop(uid, None)
+        return len(stale)
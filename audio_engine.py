@@ -0,0 +1,613 @@
+import os
+import time
+import shutil
+import asyncio
+import hashlib
+import threading
+import discord
+from array import array
+from collections import OrderedDict, deque
+from discord.oggparse import OggStream
+from storage import SQLiteStore, DATA_DIR
+
+FFMPEG_EXE = shutil.which("ffmpeg") or "ffmpeg"
+
+# 強化的重連參數，確保網路波動時不會斷掉
+# --- ✨ 針對 FFmpeg 8.0.1 的相容性優化版 ---
+FFMPEG_BEFORE_OPTIONS = (
+    '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 '
+    '-nostats -loglevel panic' # 💡 移除 probesize 與 analyzeduration，降低解析報錯率
+)
+PCM_OPTIONS = '-vn -af "volume=1.0,aresample=async=1"'
+# codec copy 不能掛濾鏡，只保留 -vn
+OPUS_OPTIONS = '-vn'
+
+class LocalOpusAudio(discord.AudioSource):
+    def __init__(self, path):
+        """💿 直接讀本機 .opus (Ogg) 檔的封包，不需要再開 FFmpeg"""
+        self._file = open(path, 'rb')
+        self._packets = OggStream(self._file).iter_packets()
+
+    def read(self):
+        for packet in self._packets:
+            # 跳過 Ogg 檔頭的 OpusHead / OpusTags，只送真正的音訊 frame
+            if packet.startswith((b'OpusHead', b'OpusTags')):
+                continue
+            return packet
+        return b''
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._file.close()
+
+class PreBufferedSource(discord.AudioSource):
+    def __init__(self, source):
+        """⏩ 先把開頭幾個 frame 讀進記憶體，FFmpeg 啟動與連線時間提早在背景吃掉"""
+        self.source = source
+        self.buffer = deque()
+
+    def fill(self, frames):
+        """在背景執行緒呼叫：預讀 frames 個 20ms frame"""
+        for _ in range(frames):
+            data = self.source.read()
+            if not data: break
+            self.buffer.append(data)
+
+    def read(self):
+        return self.buffer.popleft() if self.buffer else self.source.read()
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+class TimedSource(discord.AudioSource):
+    def __init__(self, source, start=0):
+        """⏱️ 一般模式的計時外殼：只數送出去的 20ms frame，暫停時 Discord 不讀，進度自然停住"""
+        self.source = source
+        self.frames = int(start * 50)
+
+    @property
+    def elapsed(self):
+        return self.frames / 50
+
+    def read(self):
+        data = self.source.read()
+        if data: self.frames += 1
+        return data
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+def _mix_pcm(current, upcoming, gain):
+    """線性淡入淡出：current 乘 (1 - gain)、upcoming 乘 gain (16-bit 立體聲 PCM)"""
+    a = array('h', current)
+    b = array('h', upcoming)
+    keep = 1.0 - gain
+    for i in range(min(len(a), len(b))):
+        a[i] = int(a[i] * keep + b[i] * gain)
+    return a.tobytes()
+
+class GaplessSource(discord.AudioSource):
+    def __init__(self, source, item, on_switch, crossfade_frames=0, start=0):
+        """🎼 無縫播放外殼：這首播完的同一個 frame 就接上預先準備好的下一首
+
+        on_switch(old_item, new_item, gap) 會在語音執行緒被呼叫，呼叫端要自己把工作丟回事件迴圈。
+        排好的下一首還算不算數由事件迴圈透過 expect() 決定，語音執行緒只看 armed 旗標，
+        不會去碰佇列。交叉淡化只在兩首都是 PCM 時生效。
+
+        current / next 只有語音執行緒會動；事件迴圈 arm() 只把下一首放進 _handoff，
+        鎖只保護這個指標交換，讀音訊 (可能卡在 FFmpeg / 網路) 時不持有鎖，不會卡住事件迴圈。
+        """
+        self.current = source
+        self.item = item
+        self.on_switch = on_switch
+        self.crossfade_frames = crossfade_frames
+        self.frames = int(start * 50)  # 從中間開始播 (還原進度) 時的起點
+        self.next = None
+        self.next_item = None
+        self.armed = False
+        self.armed_item = None  # 事件迴圈最後一次交出去的下一首
+        self._handoff = None    # (source, item)：等語音執行緒接手
+        self._closed = False
+        self._mixed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        return self.frames / 50
+
+    def arm(self, source, item):
+        """排好下一首 (已預讀的 AudioSource)，語音執行緒下一次 read() 時接手"""
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                old, self._handoff = self._handoff, (source, item)
+        if closed:
+            # 外殼已經收掉了，交過來的也一起關掉
+            source.cleanup()
+            return
+        if old: old[0].cleanup()
+        self.armed_item = item
+        self.armed = True
+
+    def expect(self, item):
+        """事件迴圈告知接下來應該播哪一首：和排好的不同就先解除，改回來了就重新生效"""
+        self.armed = item is not None and self.armed_item is item
+
+    def _adopt(self):
+        """語音執行緒：接手事件迴圈交過來的下一首 (換掉還沒用到的舊的)"""
+        with self._lock:
+            handoff, self._handoff = self._handoff, None
+        if handoff:
+            if self.next: self.next.cleanup()
+            self.next, self.next_item = handoff
+            self._mixed = 0
+
+    def _should_mix(self):
+        if not self.crossfade_frames or not self.next or not self.armed: return False
+        if self.current.is_opus() or self.next.is_opus(): return False
+        total = int(self.item.duration * 50)
+        return total and self.frames >= total - self.crossfade_frames
+
+    def read(self):
+        if self._handoff is not None:
+            self._adopt()
+        data = self.current.read()
+        if data:
+            if self._should_mix():
+                upcoming = self.next.read()
+                if upcoming:
+                    self._mixed += 1
+                    data = _mix_pcm(data, upcoming, min(1.0, self._mixed / self.crossfade_frames))
+            self.frames += 1
+            return data
+
+        # 這首播完了：有排好而且仍然有效的下一首就直接接上
+        if not self.next:
+            return b''
+        if not self.armed or self.next_item is not self.armed_item:
+            self.next.cleanup()
+            self.next = self.next_item = None
+            return b''
+
+        ended = time.perf_counter()
+        old_item = self.item
+        self.current.cleanup()
+        self.current, self.item = self.next, self.next_item
+        self.next = self.next_item = None
+        self.frames, self._mixed = self._mixed, 0
+        data = self.current.read()
+        self.on_switch(old_item, self.item, time.perf_counter() - ended)
+        if data: self.frames += 1
+        return data
+
+    def is_opus(self):
+        return self.current.is_opus()
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            handoff, self._handoff = self._handoff, None
+        self.current.cleanup()
+        if self.next:
+            self.next.cleanup()
+            self.next = self.next_item = None
+        if handoff:
+            handoff[0].cleanup()
+
+class SharedStream:
+    def __init__(self, hub, key, source, fallback):
+        """📡 一個共用的解碼器：背景執行緒把 opus frame 寫進環狀緩衝，各伺服器各讀各的位置"""
+        self.hub = hub
+        self.key = key
+        self.source = source
+        self.fallback = fallback
+        self.started = time.monotonic()
+        self.ring = [None] * hub.capacity
+        self.produced = 0
+        self.readers = set()
+        self.eof = False
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._decode, name=f"spark-hub-{key}", daemon=True)
+
+    def joinable(self):
+        """還在加入時間窗內、而且第一個 frame 還沒被覆蓋"""
+        with self.cond:
+            return (
+                not self.closed and self.produced < self.hub.capacity
+                and time.monotonic() - self.started <= self.hub.window
+            )
+
+    def attach(self):
+        reader = SharedReader(self)
+        with self.cond:
+            if self.closed: return None
+            self.readers.add(reader)
+        return reader
+
+    def release(self, reader):
+        """引用計數歸零就停掉解碼器"""
+        with self.cond:
+            self.readers.discard(reader)
+            if not self.readers:
+                self.closed = True
+            self.cond.notify_all()
+
+    def _decode(self):
+        hub = self.hub
+        try:
+            while True:
+                with self.cond:
+                    # 最快的聽眾前面已經預讀夠了就等一下
+                    while not self.closed and self.readers and self.produced - max(r.pos for r in self.readers) >= hub.lead:
+                        self.cond.wait(1)
+                    if self.closed: break
+                data = self.source.read()
+                with self.cond:
+                    if not data:
+                        self.eof = True
+                        self.cond.notify_all()
+                        break
+                    self.ring[self.produced % hub.capacity] = data
+                    self.produced += 1
+                    self.cond.notify_all()
+        except Exception as e:
+            print(f"⚠️ 共用解碼器出錯 ({self.key}): {e}")
+            with self.cond:
+                self.eof = True
+                self.cond.notify_all()
+        finally:
+            self.source.cleanup()
+            hub._forget(self)
+
+class SharedReader(discord.AudioSource):
+    def __init__(self, stream):
+        """共用串流的讀取端：每個語音連線各一個，自己記播放位置"""
+        self.stream = stream
+        self.pos = 0
+        self.own = None
+        self.released = False
+
+    def read(self):
+        if self.own:
+            return self.own.read()
+        stream = self.stream
+        with stream.cond:
+            while self.pos >= stream.produced and not stream.eof and not self.released:
+                stream.cond.wait(1)
+            if self.released: return b''
+            if self.pos >= stream.produced:
+                return b''
+            # 暫停太久被環狀緩衝甩在後面：改用自己的解碼器從目前位置接著播
+            if self.pos < stream.produced - stream.hub.capacity:
+                behind = True
+            else:
+                behind = False
+                data = stream.ring[self.pos % stream.hub.capacity]
+                self.pos += 1
+                stream.cond.notify_all()
+        if behind:
+            return self._detach()
+        return data
+
+    def _detach(self):
+        stream = self.stream
+        stream.hub.count('fallbacks')
+        print(f"⏪ 共用串流落後太多，改用獨立解碼器 ({stream.key} @ {self.pos / 50:.1f}s)")
+        self._release()
+        try:
+            self.own = stream.fallback(self.pos / 50)
+        except Exception as e:
+            print(f"⚠️ 獨立解碼器建立失敗: {e}")
+            return b''
+        return self.own.read()
+
+    def _release(self):
+        if not self.released:
+            self.released = True
+            self.stream.release(self)
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._release()
+        if self.own:
+            self.own.cleanup()
+
+class SharedSourceHub:
+    def __init__(self, window=15, capacity_frames=3000, lead_frames=500):
+        """🔀 同一首歌在時間窗內被多個伺服器點播時，只開一個解碼器
+
+        window 秒內加入的聽眾都從頭開始讀；環狀緩衝最多保留 capacity_frames 個 frame，
+        解碼器最多領先最快的聽眾 lead_frames 個 frame。
+        """
+        self.window = window
+        self.capacity = capacity_frames
+        self.lead = min(lead_frames, capacity_frames)
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.counters = {'decoders': 0, 'saved': 0, 'fallbacks': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def attach(self, key):
+        """有可加入的共用串流就回傳新的讀取端，否則 None"""
+        with self.lock:
+            stream = self.streams.get(key)
+        if stream and stream.joinable():
+            reader = stream.attach()
+            if reader:
+                self.count('saved')
+                return reader
+        return None
+
+    def publish(self, key, source, fallback):
+        """把剛開好的解碼器登記成共用串流，回傳第一個讀取端"""
+        # 兩個伺服器同時開了同一首：後到的直接收掉自己的解碼器
+        reader = self.attach(key)
+        if reader:
+            source.cleanup()
+            return reader
+        stream = SharedStream(self, key, source, fallback)
+        # 先掛上第一個聽眾再開始解碼，否則解碼器會一口氣衝滿緩衝
+        reader = stream.attach()
+        stream.thread.start()
+        with self.lock:
+            self.streams[key] = stream
+            self.counters['decoders'] += 1
+        return reader
+
+    def _forget(self, stream):
+        with self.lock:
+            if self.streams.get(stream.key) is stream:
+                del self.streams[stream.key]
+
+    def stats(self):
+        with self.lock:
+            streams = list(self.streams.values())
+            counters = dict(self.counters)
+        counters['active'] = len(streams)
+        counters['listeners'] = sum(len(s.readers) for s in streams)
+        return counters
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class AudioCache:
+    def __init__(self, budget_bytes, hot_plays=2, max_downloads=2):
+        """💾 熱門 / 循環中歌曲的本機 opus 快取：有容量上限，依最後播放時間淘汰"""
+        self.dir = os.path.join(DATA_DIR, "audio")
+        os.makedirs(self.dir, exist_ok=True)
+        self.budget = budget_bytes
+        self.hot_plays = hot_plays
+        self.play_counts = OrderedDict()
+        self.downloading = set()
+        # 這次啟動後已經驗過 sha256 的檔案，之後只比對檔案大小
+        self.verified = set()
+        self.semaphore = asyncio.Semaphore(max_downloads)
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.evictions = 0
+        self.corrupted = 0
+        self.store = SQLiteStore("audio_cache.db", """
+            CREATE TABLE IF NOT EXISTS audio (
+                video_id TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                last_used REAL NOT NULL
+            );
+        """)
+
+    async def lookup(self, video_id):
+        """有完整的本機檔就回傳路徑，壞掉的檔案會順便清掉"""
+        if not video_id: return None
+        rows = await self.store.aquery("SELECT path, size, sha256 FROM audio WHERE video_id = ?", (video_id,))
+        if not rows:
+            self.misses += 1
+            return None
+
+        path, size, digest = rows[0]
+        intact = os.path.exists(path) and os.path.getsize(path) == size
+        if intact and video_id not in self.verified:
+            intact = await asyncio.to_thread(_sha256, path) == digest
+            if intact: self.verified.add(video_id)
+        if not intact:
+            self.corrupted += 1
+            await asyncio.to_thread(self._remove, video_id, path)
+            self.misses += 1
+            return None
+
+        self.store.defer("UPDATE audio SET last_used = ? WHERE video_id = ?", (time.time(), video_id))
+        self.hits += 1
+        return path
+
+    def note_play(self, source_data, looping=False):
+        """記錄播放次數；重複播放或單曲循環中的歌就排進背景下載"""
+        video_id = source_data.get('id')
+        # 直播 (沒有長度) 和超長影片不收進快取
+        if not video_id or not 0 < (source_data.get('duration') or 0) <= 1200: return
+        plays = self.play_counts.pop(video_id, 0) + 1
+        self.play_counts[video_id] = plays
+        while len(self.play_counts) > 10000:
+            self.play_counts.popitem(last=False)
+
+        if (plays >= self.hot_plays or looping) and video_id not in self.downloading:
+            self.downloading.add(video_id)
+            asyncio.get_event_loop().create_task(self._download(video_id, source_data))
+
+    async def _download(self, video_id, source_data):
+        """用 FFmpeg 把串流存成 .opus：本來就是 opus 就直接 copy"""
+        path = os.path.join(self.dir, f"{video_id}.opus")
+        tmp_path = path + ".part"
+        codec = ['-c:a', 'copy'] if source_data.get('codec') == 'opus' else ['-c:a', 'libopus', '-b:a', '128k', '-ar', '48000', '-ac', '2']
+        try:
+            # 已經收進快取的就不用再下載 (查詢在執行緒裡跑)
+            if await self.store.aquery("SELECT 1 FROM audio WHERE video_id = ?", (video_id,)):
+                return
+            async with self.semaphore:
+                process = await asyncio.create_subprocess_exec(
+                    FFMPEG_EXE, '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+                    '-nostats', '-loglevel', 'error', '-y', '-i', source_data['url'],
+                    '-vn', '-map_metadata', '-1', *codec, '-f', 'opus', tmp_path,
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+                )
+                if await process.wait() != 0:
+                    raise RuntimeError(f"FFmpeg 結束代碼 {process.returncode}")
+
+            digest = await asyncio.to_thread(_sha256, tmp_path)
+            os.replace(tmp_path, path)
+            self.verified.add(video_id)
+            self.downloads += 1
+            # 寫入索引 + 依容量淘汰都是 SQLite 與檔案操作，放進執行緒
+            await asyncio.to_thread(self._index, video_id, path, digest)
+        except Exception as e:
+            print(f"⚠️ 音訊快取下載失敗 {video_id}: {e}")
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+        finally:
+            self.downloading.discard(video_id)
+
+    def _index(self, video_id, path, digest):
+        self.store.execute(
+            "INSERT OR REPLACE INTO audio (video_id, path, size, sha256, last_used) VALUES (?, ?, ?, ?, ?)",
+            (video_id, path, os.path.getsize(path), digest, time.time())
+        )
+        self._evict()
+
+    def _evict(self):
+        """超過容量就從最久沒播的開始刪 (在執行緒裡跑)"""
+        rows = self.store.query("SELECT video_id, path, size FROM audio ORDER BY last_used DESC")
+        total = 0
+        for video_id, path, size in rows:
+            total += size
+            if total > self.budget:
+                self._remove(video_id, path)
+                self.evictions += 1
+
+    def _remove(self, video_id, path):
+        """刪掉索引與檔案 (在執行緒裡跑)"""
+        self.store.execute("DELETE FROM audio WHERE video_id = ?", (video_id,))
+        self.verified.discard(video_id)
+        if os.path.exists(path): os.remove(path)
+
+    def stats(self):
+        """會查 SQLite，事件迴圈上請用 asyncio.to_thread 呼叫"""
+        lookups = self.hits + self.misses
+        rows = self.store.query("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM audio")
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'files': rows[0][0],
+            'bytes': rows[0][1],
+            'budget': self.budget,
+            'downloads': self.downloads,
+            'evictions': self.evictions,
+            'corrupted': self.corrupted,
+        }
+
+class SparkAudioEngine:
+    def __init__(self, mode="opus", bitrate=128, cache_budget_mb=2048, share_window=15):
+        """🔊 音訊來源工廠：opus 模式直接把 webm/opus 串流 copy 給 Discord，省掉解碼再編碼"""
+        self.mode = mode
+        self.bitrate = bitrate
+        self.counters = {'passthrough': 0, 'probed': 0, 'transcoded': 0, 'pcm': 0, 'local': 0}
+        self.cache = AudioCache(cache_budget_mb * 1024 * 1024) if cache_budget_mb > 0 else None
+        # 多個伺服器同時播同一首時共用解碼器 (只對 opus 來源)
+        self.hub = SharedSourceHub(window=share_window) if share_window > 0 else None
+        # ⏱️ 換歌空檔統計：上一首結束到下一首出聲的時間
+        self.gaps = {'gapless': [0, 0.0, 0.0], 'restart': [0, 0.0, 0.0]}
+        print(f"--- 🔊 音訊引擎模式: {mode} ---")
+
+    def record_gap(self, seconds, gapless):
+        """記錄一次換歌空檔 (次數, 總和, 最大值)"""
+        entry = self.gaps['gapless' if gapless else 'restart']
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+    def gap_stats(self):
+        return {
+            kind: {'count': n, 'avg': total / n if n else 0.0, 'max': worst}
+            for kind, (n, total, worst) in self.gaps.items()
+        }
+
+    async def create_source(self, source_data, start=0):
+        """依串流編碼建立 AudioSource：本機快取 > opus 直通 > 探測後決定 > FFmpeg 轉 opus > PCM
+
+        start > 0 (從中間接著播) 時一律開新的 FFmpeg 串流並用 -ss 跳轉。
+        """
+        if start:
+            return await self._open_stream(source_data, start)
+        if self.cache:
+            path = await self.cache.lookup(source_data.get('id'))
+            if path:
+                self.counters['local'] += 1
+                return LocalOpusAudio(path)
+
+        key = source_data.get('id')
+        if self.hub and key:
+            reader = self.hub.attach(key)
+            if reader:
+                return reader
+
+        source = await self._open_stream(source_data)
+        if self.hub and key and source.is_opus():
+            # 只有確定是 opus 才能 copy；不確定 (探測來的) 一律重新編碼，比較保險
+            codec = 'opus' if source_data.get('codec') == 'opus' else None
+            return self.hub.publish(key, source, lambda start: self._opus_source(source_data['url'], codec, start))
+        return source
+
+    async def _open_stream(self, source_data, start=0):
+        """為網路串流開一個 FFmpeg 解碼器"""
+        url = source_data['url']
+        before_options = f"-ss {start:.2f} {FFMPEG_BEFORE_OPTIONS}" if start else FFMPEG_BEFORE_OPTIONS
+        if self.mode != "opus":
+            self.counters['pcm'] += 1
+            return discord.FFmpegPCMAudio(url, executable=FFMPEG_EXE, before_options=before_options, options=PCM_OPTIONS)
+
+        codec = source_data.get('codec')
+        if codec == 'opus':
+            # discord.py 的 codec='opus' 代表 -c:a copy
+            self.counters['passthrough'] += 1
+            return self._opus_source(url, 'opus', start)
+
+        if codec is None:
+            # 舊快取或非 YouTube 來源不知道編碼，先探測一次
+            try:
+                source = await discord.FFmpegOpusAudio.from_probe(
+                    url, executable=FFMPEG_EXE, before_options=before_options, options=OPUS_OPTIONS
+                )
+                self.counters['probed'] += 1
+                return source
+            except Exception as e:
+                print(f"⚠️ 音訊探測失敗，改用轉碼: {e}")
+
+        # 不是 opus：讓 FFmpeg 直接編成 opus，仍然省下 Python 端的編碼
+        # (codec 不能傳 'libopus'，discord.py 會把 'opus' / 'libopus' 都當成 -c:a copy)
+        self.counters['transcoded'] += 1
+        return self._opus_source(url, None, start)
+
+    def _opus_source(self, url, codec, start=0):
+        """codec='opus' 直接 copy；None 讓 FFmpeg 用 libopus 編碼"""
+        before_options = f"-ss {start:.2f} {FFMPEG_BEFORE_OPTIONS}" if start else FFMPEG_BEFORE_OPTIONS
+        return discord.FFmpegOpusAudio(
+            url, codec=codec, bitrate=self.bitrate, executable=FFMPEG_EXE,
+            before_options=before_options, options=OPUS_OPTIONS
+        )
@@ -0,0 +1,205 @@
+"""📏 艾瑪的效能量測腳本
+
+用法：
+    python benchmark.py audio <音檔路徑或串流網址> [--seconds 60]
+    python benchmark.py queue [--sizes 10000 100000]
+    python benchmark.py lrc [--lines 2000 50000] [--rounds 20]
+"""
+import re
+import sys
+import time
+import bisect
+import random
+import argparse
+import resource
+
+def _cpu_seconds():
+    """本行程 + 已結束子行程 (FFmpeg) 的 CPU 時間"""
+    me = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return me.ru_utime + me.ru_stime, children.ru_utime + children.ru_stime
+
+# ======================================================
+# --- 音訊路徑：PCM 重新編碼 vs opus 直通 ---
+# ======================================================
+def bench_audio(args):
+    import discord
+    from discord.opus import Encoder
+    from audio_engine import FFMPEG_EXE, PCM_OPTIONS, OPUS_OPTIONS
+
+    if not discord.opus.is_loaded():
+        discord.opus._load_default()
+    frames_wanted = int(args.seconds * 50)  # 每個 frame 20ms
+
+    def run(label, make_source, encode):
+        encoder = Encoder() if encode else None
+        py_before, ff_before = _cpu_seconds()
+        started = time.perf_counter()
+        source = make_source()
+        frames = 0
+        try:
+            while frames < frames_wanted:
+                data = source.read()
+                if not data: break
+                # PCM 路線在 Discord 的語音執行緒裡還要再做一次 opus 編碼
+                if encoder: encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+                frames += 1
+        finally:
+            source.cleanup()
+        wall = time.perf_counter() - started
+        py_after, ff_after = _cpu_seconds()
+        audio_seconds = frames / 50 or 1
+        py_cpu, ff_cpu = py_after - py_before, ff_after - ff_before
+        print(
+            f"{label:<8} 音訊 {audio_seconds:6.1f}s | Python CPU {py_cpu:6.2f}s | FFmpeg CPU {ff_cpu:6.2f}s | "
+            f"每分鐘音訊 CPU {(py_cpu + ff_cpu) / audio_seconds * 60:6.2f}s | 實際耗時 {wall:6.2f}s"
+        )
+
+    run("pcm", lambda: discord.FFmpegPCMAudio(args.source, executable=FFMPEG_EXE, options=PCM_OPTIONS), True)
+    run("opus", lambda: discord.FFmpegOpusAudio(args.source, codec='opus', executable=FFMPEG_EXE, options=OPUS_OPTIONS), False)
+
+# ======================================================
+# --- 播放佇列：list vs TrackQueue ---
+# ======================================================
+def bench_queue(args):
+    from track_queue import Track, TrackQueue
+
+    def timed(fn):
+        started = time.perf_counter()
+        fn()
+        return time.perf_counter() - started
+
+    for n in args.sizes:
+        tracks = [Track(f"track {i}", duration=random.randint(120, 300)) for i in range(n)]
+        ops = min(n // 2, 2000)
+        picks = [random.randrange(n // 2) for _ in range(ops)]
+
+        def build_list():
+            return list(tracks)
+
+        def build_queue():
+            return TrackQueue(tracks)
+
+        cases = {
+            "取出第一首 (全部)": (
+                lambda q: [q.pop(0) for _ in range(n)],
+                lambda q: [q.popleft() for _ in range(n)],
+            ),
+            f"跳到中間 x{ops}": (
+                lambda q: [q[n // 2] for _ in range(ops)],
+                lambda q: [q[n // 2] for _ in range(ops)],
+            ),
+            f"刪除任意一首 x{ops}": (
+                lambda q: [q.pop(i) for i in picks],
+                lambda q: [q.pop(i) for i in picks],
+            ),
+            f"插到最前面 x{ops}": (
+                lambda q: [q.insert(0, t) for t in tracks[:ops]],
+                lambda q: [q.appendleft(t) for t in tracks[:ops]],
+            ),
+            f"預計開播時間 x{ops}": (
+                lambda q: [sum(x.duration for x in q[:i]) for i in picks],
+                lambda q: [q.time_before(i) for i in picks],
+            ),
+            "打亂": (
+                lambda q: random.shuffle(q),
+                lambda q: q.shuffle(),
+            ),
+            f"移動 x{ops}": (
+                lambda q: [q.insert(0, q.pop(i)) for i in picks],
+                lambda q: [q.move(i, 0) for i in picks],
+            ),
+        }
+        print(f"--- {n} 首 ---")
+        for label, (with_list, with_queue) in cases.items():
+            lst, tq = build_list(), build_queue()
+            t_list = timed(lambda: with_list(lst))
+            t_queue = timed(lambda: with_queue(tq))
+            print(f"{label:<16} list {t_list * 1000:9.2f} ms | TrackQueue {t_queue * 1000:9.2f} ms")
+
+# ======================================================
+# --- LRC 解析：逐行 re.search + dict vs 預先編譯的單趟解析 ---
+# ======================================================
+def _legacy_parse_lrc(lrc_content):
+    """舊版解析 (每行未編譯 re.search、只認第一個時間標籤、回傳 dict)"""
+    lyric_dict = {}
+    for line in lrc_content.split('\n'):
+        match = re.search(r'\[(\d{2}):(\d{2})(?:\.(\d{2,3}))?\](.*)', line)
+        if match:
+            m, s = int(match.group(1)), int(match.group(2))
+            ms_val = match.group(3)
+            ms = int(ms_val) if ms_val else 0
+            if ms_val and len(ms_val) == 2: ms *= 10
+            text = match.group(4).strip()
+            if text: lyric_dict[m * 60 + s + ms / 1000.0] = text
+    return lyric_dict
+
+def _fake_lrc(n, enhanced):
+    """產生 n 行的假歌詞；enhanced 時兩成是重複副歌 (兩個時間標籤)、兩成是逐字時間
+    (行距依行數縮短，讓時間都落在 100 分鐘內，舊版解析也認得)"""
+    rows = ["[ti:benchmark]", "[ar:spark]", "[offset:+120]"]
+    t = 0.0
+    gap = min(3.0, 5000 / n)
+    for i in range(n):
+        t += random.uniform(gap * 0.5, gap * 1.5)
+        tag = f"[{int(t // 60):02d}:{t % 60:05.2f}]"
+        kind = i % 5 if enhanced else None
+        if kind == 0:
+            later = t + 60
+            rows.append(f"{tag}[{int(later // 60):02d}:{later % 60:05.2f}]副歌 第 {i} 行")
+        elif kind == 1:
+            rows.append(tag + "".join(f"<{int((t + j * gap / 8) // 60):02d}:{(t + j * gap / 8) % 60:05.2f}>字{j} " for j in range(6)))
+        else:
+            rows.append(f"{tag}歌詞 第 {i} 行 lyric line")
+    return "\n".join(rows)
+
+def bench_lrc(args):
+    from lyrics_engine import parse_lrc
+
+    def timed(fn):
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            result = fn()
+        return (time.perf_counter() - started) / args.rounds, result
+
+    for n in args.lines:
+        print(f"--- {n} 行 ---")
+        for label, enhanced in (("一般 LRC", False), ("副歌 + 逐字", True)):
+            content = _fake_lrc(n, enhanced)
+            # 舊流程：解析成 dict 之後，使用端還要自己排序才能 bisect
+            t_old, old = timed(lambda: sorted(_legacy_parse_lrc(content).items()))
+            t_new, new = timed(lambda: parse_lrc(content))
+            print(
+                f"{label:<8} ({len(content) / 1024:5.0f} KB) 舊版 {t_old * 1000:8.2f} ms / {len(old)} 句 | "
+                f"新版 {t_new * 1000:8.2f} ms / {len(new[0])} 句 (逐字 {sum(1 for w in new[2] if w)} 句)"
+            )
+        times = new[0]
+        probes = [random.uniform(0, times[-1]) for _ in range(10000)]
+        started = time.perf_counter()
+        for p in probes:
+            bisect.bisect_right(times, p)
+        print(f"bisect 找目前那句 {(time.perf_counter() - started) / len(probes) * 1e6:.2f} µs / 次")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="艾瑪的效能量測")
+    sub = parser.add_subparsers(dest="target", required=True)
+
+    audio = sub.add_parser("audio", help="比較 PCM 重新編碼與 opus 直通每條串流的 CPU 成本")
+    audio.add_argument("source", help="webm/opus 音檔路徑或串流網址")
+    audio.add_argument("--seconds", type=float, default=60, help="每條路徑量測的音訊長度")
+    audio.set_defaults(func=bench_audio)
+
+    q = sub.add_parser("queue", help="比較 list 與 TrackQueue 在大型佇列上的操作耗時")
+    q.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="佇列長度")
+    q.set_defaults(func=bench_queue)
+
+    lrc = sub.add_parser("lrc", help="比較舊版與新版 LRC 解析在大型歌詞檔上的耗時")
+    lrc.add_argument("--lines", type=int, nargs="+", default=[2000, 50000], help="歌詞行數")
+    lrc.add_argument("--rounds", type=int, default=20, help="每種解析重複幾次取平均")
+    lrc.set_defaults(func=bench_lrc)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
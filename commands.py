@@ -2,12 +2,19 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import asyncio
+import bisect
 import time
-import random
 import os
 import datetime
 import logging
-from lyrics_engine import LyricsEngine
+from lyrics_engine import LyricsEngine, LyricsCache
+from audio_engine import SparkAudioEngine
+from prefetch_engine import QueuePrefetcher
+from track_queue import Track
+from player_store import PlayerStore
+from guild_player import GuildPlayer
+from idle_reaper import IdleReaper
+from extractor_pool import PRIORITY_PREFETCH
 
 # ======================================================
 # --- 1. 音樂控制面板 (MusicControlView) ---
@@ -18,10 +25,16 @@ class MusicControlView(discord.ui.View):
         self.bot = bot
         self.vc = vc
         self.cog = cog
-
-        # --- [狀態初始化] 讓按鈕外觀與後端數據同步 ---
-        guild_id = vc.guild.id
-        mode = self.cog.loop_mode.get(guild_id, 0)
+        self.state = None
+        self.refresh()
+
+    def refresh(self):
+        """讓按鈕外觀與後端數據同步，有變動才回傳 True (歌詞面板靠這個決定要不要連按鈕一起更新)"""
+        mode = self.cog.get_player(self.vc.guild.id).loop_mode
+        state = (mode, self.vc.is_paused())
+        if state == self.state:
+            return False
+        self.state = state
         loop_labels = {0: "🔁 循環: 關閉", 1: "🔂 單曲循環", 2: "🔁 清單循環"}
 
         # 遍歷組件，動態調整初始 Label 與顏色
@@ -39,24 +52,19 @@ class MusicControlView(discord.ui.View):
                     else:
                         child.label = "⏸️ 暫停"
                         child.style = discord.ButtonStyle.primary
+        return True
 
     @discord.ui.button(label="⏮️ 上一首", style=discord.ButtonStyle.secondary, custom_id="emma_music_prev")
     async def prev_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
         """按下按鈕：回溯播放歷史紀錄"""
-        guild_id = interaction.guild_id
-        last_song = self.cog.last_played.get(guild_id)
+        player = self.cog.get_player(interaction.guild_id)
 
-        if last_song:
+        if player.rewind():
             await self.bot.dispatch_log(f"⏮️ [控制面板] 使用者 {interaction.user.name} 請求回放上一首歌")
-            current = self.cog.current_song.get(guild_id)
-            if current:
-                self.cog.queues[guild_id].insert(0, current)
-
-            self.cog.queues[guild_id].insert(0, last_song)
-            self.vc.stop() # 停止當前播放，藉此觸發 check_queue
+            self.vc.stop() # 停止當前播放，由播放器接著播排回來的上一首
             await interaction.response.send_message("⏮️ 好的！艾瑪正在幫妳找回剛才的旋律...", ephemeral=True)
         else:
-            await self.bot.dispatch_log(f"⚠️ [控制面板] {interaction.user.name} 嘗試按上一首，但歷史紀錄為空")
+            await self.bot.dispatch_log(f"⚠️ [控制面板] {interaction.user.name} 嘗試按上一首，但歷史紀錄為空", logging.WARNING)
             await interaction.response.send_message("🌸 艾瑪的記憶體裡找不到上一首歌的紀錄...", ephemeral=True)
 
     @discord.ui.button(label="⏯️ 暫停/繼續", style=discord.ButtonStyle.primary, custom_id="emma_music_toggle")
@@ -64,15 +72,13 @@ class MusicControlView(discord.ui.View):
         """按下按鈕：切換語音客戶端的播放或暫停狀態"""
         if self.vc.is_playing():
             self.vc.pause()
-            button.label = "▶️ 繼續播放"
-            button.style = discord.ButtonStyle.danger
+            self.refresh()
             await self.bot.dispatch_log(f"⏸️ [控制面板] 使用者 {interaction.user.name} 暫停了播放")
             await interaction.response.edit_message(view=self)
             await interaction.followup.send("⏸️ 已經幫妳按下暫停鍵囉！", ephemeral=True)
         elif self.vc.is_paused():
             self.vc.resume()
-            button.label = "⏸️ 暫停"
-            button.style = discord.ButtonStyle.primary
+            self.refresh()
             await self.bot.dispatch_log(f"▶️ [控制面板] 使用者 {interaction.user.name} 恢復了播放")
             await interaction.response.edit_message(view=self)
             await interaction.followup.send("▶️ 音樂繼續響起！讓旋律再次流動吧 ✨", ephemeral=True)
@@ -91,10 +97,10 @@ class MusicControlView(discord.ui.View):
 
     @discord.ui.button(label="🔀 打亂", style=discord.ButtonStyle.secondary, custom_id="emma_music_shuffle")
     async def shuffle_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
-        guild_id = interaction.guild_id
-        queue = self.cog.queues.get(guild_id, [])
-        if len(queue) > 1:
-            random.shuffle(queue)
+        player = self.cog.get_player(interaction.guild_id)
+        if len(player.queue) > 1:
+            player.queue.shuffle()
+            player.changed()
             await self.bot.dispatch_log(f"🔀 [控制面板] {interaction.user.name} 打亂了隊列")
             await interaction.response.send_message("🔀 隊列已重新洗牌！", ephemeral=True)
         else:
@@ -103,13 +109,13 @@ class MusicControlView(discord.ui.View):
     @discord.ui.button(label="🔁 循環模式", style=discord.ButtonStyle.success, custom_id="emma_music_loop")
     async def toggle_loop_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
         """按下按鈕：循環切換 (0:關閉, 1:單曲, 2:清單)"""
-        guild_id = interaction.guild_id
-        current_mode = self.cog.loop_mode.get(guild_id, 0)
-        new_mode = (current_mode + 1) % 3
-        self.cog.loop_mode[guild_id] = new_mode
+        player = self.cog.get_player(interaction.guild_id)
+        new_mode = player.loop_mode = (player.loop_mode + 1) % 3
+        # 循環模式會改變下一首是誰
+        player.changed()
 
         labels = {0: "🔁 循環: 關閉", 1: "🔂 單曲循環", 2: "🔁 清單循環"}
-        button.label = labels[new_mode]
+        self.refresh()
 
         await self.bot.dispatch_log(f"🔄 [控制面板] 使用者 {interaction.user.name} 切換循環模式為: {labels[new_mode]}")
         await interaction.response.edit_message(view=self)
@@ -117,9 +123,10 @@ class MusicControlView(discord.ui.View):
     @discord.ui.button(label="🗑️ 清空", style=discord.ButtonStyle.danger, custom_id="emma_music_clear")
     async def clear_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
         """按下按鈕：清除所有後續等待播放的曲目"""
-        guild_id = interaction.guild_id
-        queue_count = len(self.cog.queues.get(guild_id, []))
-        self.cog.queues[guild_id] = []
+        player = self.cog.get_player(interaction.guild_id)
+        queue_count = len(player.queue)
+        player.clear()
+        player.changed()
 
         await self.bot.dispatch_log(f"🗑️ [控制面板] 使用者 {interaction.user.name} 清空了佇列 (共 {queue_count} 首)")
         await interaction.response.send_message(f"🗑️ 已經幫妳把後面的 {queue_count} 首歌都清理掉囉！", ephemeral=True)
@@ -127,14 +134,30 @@ class MusicControlView(discord.ui.View):
     @discord.ui.button(label="⏹️ 停止並離開", style=discord.ButtonStyle.danger, row=1, custom_id="emma_music_stop")
     async def stop_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
         """按下按鈕：徹底結束播放、清空佇列並中斷語音連線"""
-        guild_id = interaction.guild_id
         await self.bot.dispatch_log(f"⏹️ [控制面板] 使用者 {interaction.user.name} 請求讓艾瑪離開語音頻道")
 
-        self.cog.queues[guild_id] = []
+        self.cog.get_player(interaction.guild_id).reset()
         if self.vc:
             await self.vc.disconnect()
         await interaction.response.send_message("🚪 好的，艾瑪先去休息休息，期待下次再唱歌給妳聽！🌸", ephemeral=True)
 
+# ======================================================
+# --- 1.5 匯入進度面板 (ImportProgressView) ---
+# ======================================================
+class ImportProgressView(discord.ui.View):
+    def __init__(self, cog):
+        super().__init__(timeout=None)
+        self.cog = cog
+
+    @discord.ui.button(label="⏹️ 取消匯入", style=discord.ButtonStyle.danger, custom_id="emma_import_cancel")
+    async def cancel_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """按下按鈕：停止背景匯入，已加入的歌曲保留"""
+        if self.cog.get_player(interaction.guild_id).cancel_import():
+            await self.cog.bot.dispatch_log(f"⏹️ [匯入] 使用者 {interaction.user.name} 取消了 Spotify 匯入")
+            await interaction.response.send_message("⏹️ 好的，艾瑪不再繼續匯入了～", ephemeral=True)
+        else:
+            await interaction.response.send_message("🌸 目前沒有正在匯入的清單呢~", ephemeral=True)
+
 # ======================================================
 # --- 2. 指令核心模組 (AskCommand Cog) ---
 # ======================================================
@@ -143,22 +166,124 @@ class AskCommand(commands.Cog):
         self.bot = bot
         self.ai = ai_engine
         self.music = music_engine
-        self.lyrics_engine = LyricsEngine()
-        self.last_message = {}
-
-        self.queues = {}
-        self.last_played = {}
-        self.current_song = {}
-        self.loop_mode = {}
+        # 🏁 歌詞來源競速 (關掉就照順序一個一個試)
+        self.lyrics_engine = LyricsEngine(
+            race=os.getenv("SPARK_LYRICS_RACE", "1") == "1",
+            stagger=float(os.getenv("SPARK_LYRICS_STAGGER", "0.3")),
+            # 📖 歌詞快取：記憶體保留幾首，找不到歌詞的標題隔幾小時才重查
+            cache=LyricsCache(
+                max_entries=int(os.getenv("SPARK_LYRICS_CACHE_SIZE", "500")),
+                miss_ttl=float(os.getenv("SPARK_LYRICS_MISS_HOURS", "12")) * 3600
+            ),
+            romaji_memo=int(os.getenv("SPARK_ROMAJI_MEMO", "5000"))
+        )
+        # 🔊 opus 模式直接轉送 webm/opus 串流；設成 pcm 則沿用舊的解碼 + 重新編碼路線
+        self.audio = SparkAudioEngine(
+            mode=os.getenv("SPARK_AUDIO_MODE", "opus"),
+            cache_budget_mb=int(os.getenv("SPARK_AUDIO_CACHE_MB", "2048")),
+            share_window=float(os.getenv("SPARK_SHARED_WINDOW", "15"))
+        )
+        # 🚀 背景預先解析接下來的 N 首，換歌時直接拿現成的串流網址
+        # 🈁 SPARK_LYRICS_PRECOMPUTE=1 時連歌詞與拼音也預先準備好
+        self.prefetcher = QueuePrefetcher(
+            music_engine, depth=int(os.getenv("SPARK_PREFETCH_DEPTH", "3")),
+            lyrics_engine=self.lyrics_engine if os.getenv("SPARK_LYRICS_PRECOMPUTE", "0") == "1" else None
+        )
+        # 🎛️ 每個伺服器一個播放器 (佇列、目前播放、循環模式、面板都在裡面)
+        self.players = {}
+        # 🎵 YouTube 歌單分段載入 (播到快沒歌時才載入下一段)
+        self.playlist_window = int(os.getenv("SPARK_PLAYLIST_WINDOW", "100"))
+        # 下一段載入失敗時最多退避重試幾次 (15 秒起跳、每次加倍)
+        self.playlist_retries = int(os.getenv("SPARK_PLAYLIST_RETRIES", "5"))
+        # 🎼 無縫播放：這首結束前幾秒先開好下一首的音訊來源，可選交叉淡化 (秒，僅 PCM)
+        self.gapless = os.getenv("SPARK_GAPLESS", "1") == "1"
+        self.gapless_lead = float(os.getenv("SPARK_GAPLESS_LEAD", "5"))
+        self.crossfade = float(os.getenv("SPARK_CROSSFADE", "0"))
+        # 💾 播放狀態存檔：重開機後可以接著播 (啟動時只讀摘要，用到哪個伺服器才還原)
+        self.player_store = PlayerStore(flush_interval=float(os.getenv("SPARK_STATE_FLUSH", "3")))
+        self.saved_players = {}
+        # 🧹 定期清掉閒置的語音連線、過期的伺服器狀態與對話記憶 (分鐘，0 = 停用)
+        self.reaper = IdleReaper(
+            self,
+            interval=float(os.getenv("SPARK_REAP_INTERVAL", "60")),
+            alone_minutes=float(os.getenv("SPARK_ALONE_MINUTES", "5")),
+            idle_minutes=float(os.getenv("SPARK_IDLE_MINUTES", "15")),
+            paused_minutes=float(os.getenv("SPARK_PAUSED_MINUTES", "120")),
+            state_minutes=float(os.getenv("SPARK_STATE_MINUTES", "60")),
+            chat_minutes=float(os.getenv("SPARK_CHAT_MINUTES", "180"))
+        )
 
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger("EmmaMusic")
 
 
+    def get_player(self, guild_id):
+        """取得 (必要時建立) 伺服器的播放器，有存檔就先還原"""
+        player = self.players.get(guild_id)
+        if player is None:
+            player = self.players[guild_id] = GuildPlayer(self, guild_id)
+            if self.saved_players.pop(guild_id, None):
+                player.restore(self.player_store.load(guild_id))
+        return player
+
+    async def restore_players(self):
+        """setup_hook 時啟動：先讀存檔摘要，連線就緒後在背景逐一恢復原本還在播歌的伺服器"""
+        self.bot.loop.create_task(self.position_saver_task())
+        self.bot.loop.create_task(self.reaper.run())
+        try:
+            saved = await asyncio.to_thread(self.player_store.saved_guilds)
+        except Exception as e:
+            print(f"⚠️ 讀取播放狀態存檔失敗: {e}")
+            return
+        for info in saved:
+            if info['guild_id'] not in self.players:
+                self.saved_players[info['guild_id']] = info
+        if not saved:
+            return
+        await self.bot.dispatch_log(f"💾 [狀態還原] 找到 {len(saved)} 個伺服器的播放存檔")
+
+        await self.bot.wait_until_ready()
+        for guild_id, info in list(self.saved_players.items()):
+            if not info['playing'] or not info['voice_channel_id']:
+                continue
+            guild = self.bot.get_guild(guild_id)
+            channel = guild.get_channel(info['voice_channel_id']) if guild else None
+            text = guild.get_channel(info['text_channel_id']) if guild and info['text_channel_id'] else None
+            # 頻道不見了、已經有人重新點歌、或語音頻道裡沒有人，就等有人用到再還原
+            if not channel or not text or guild.voice_client or guild_id in self.players:
+                continue
+            if not any(not m.bot for m in channel.members):
+                continue
+            try:
+                state = await asyncio.to_thread(self.player_store.load, guild_id)
+                if guild_id in self.players:
+                    continue
+                self.saved_players.pop(guild_id, None)
+                player = self.get_player(guild_id)
+                player.restore(state)
+                player.channel_id = text.id
+                await channel.connect()
+                await self.bot.dispatch_log(f"💾 [狀態還原] {guild.name} 接著播放 ({len(player.queue)} 首)")
+                await player.post('kick')
+            except Exception as e:
+                await self.bot.dispatch_log(f"⚠️ [狀態還原] {guild.name} 恢復失敗: {e}", logging.WARNING)
+            # 一個一個來，避免同時開一堆語音連線
+            await asyncio.sleep(1)
+
+    async def position_saver_task(self):
+        """定期記下播放進度 (只更新一個欄位，不重寫整個佇列)"""
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            await asyncio.sleep(15)
+            for player in list(self.players.values()):
+                position = player.position()
+                if position:
+                    self.player_store.save_position(player.guild_id, position)
+
     def get_loop_status(self, guild_id):
         """根據 guild_id 獲取目前的循環模式文字描述"""
         # 0: 正常, 1: 單曲, 2: 清單
-        mode = self.loop_mode.get(guild_id, 0)
+        mode = self.get_player(guild_id).loop_mode
         mode_map = {
             0: "正常播放",
             1: "單曲循環中 🔂",
@@ -168,6 +293,9 @@ class AskCommand(commands.Cog):
 
     def format_time(self, seconds):
         m, s = divmod(int(max(0, seconds)), 60)
+        if m >= 60:
+            h, m = divmod(m, 60)
+            return f"{h}:{m:02d}:{s:02d}"
         return f"{m:02d}:{s:02d}"
 
     async def get_ai_response(self, user_id, user_name, question, source="Slash"):
@@ -176,209 +304,304 @@ class AskCommand(commands.Cog):
             answer = await self.ai.get_chat_response(str(user_id), question)
             return answer
         except Exception as e:
-            await self.bot.dispatch_log(f"💥 [AI 故障] 無法回應 {user_name}: {e}")
+            await self.bot.dispatch_log(f"💥 [AI 故障] 無法回應 {user_name}: {e}", logging.ERROR)
             return "🌸 嗚嗚...艾瑪頭好痛，暫時沒辦法回答妳..."
 
-    async def lyrics_sync_task(self, vc, spotify_title, youtube_title, message):
-        """確保歌詞載入後立即推送到面板，且即使沒歌詞進度條也要跑"""
+    def render_lyric(self, raw_data):
+        """把一句歌詞 (原文 / 翻譯 / 拼音) 轉成面板上顯示的文字"""
+        if isinstance(raw_data, list):
+            return "\n".join([f"**{str(line).strip()}**" for line in raw_data if line])
+        processed = str(raw_data).replace('|', '\n').replace('\\n', '\n')
+        return f"**{processed}**"
+
+    async def lyrics_sync_task(self, vc, spotify_title, youtube_title, message, view, start=0):
+        """歌詞與進度條面板：只在下一句歌詞或進度條前進一格時醒來，畫面有變才編輯訊息"""
         guild_id = message.guild.id
-        if not self.current_song.get(guild_id):
+        current = self.get_player(guild_id).current
+        if not current:
             return
 
-        guild_data = self.current_song.get(guild_id, {})
-        duration = guild_data.get('duration', 0)
+        duration = current.duration
 
+        # 歌詞載入後預先排好兩個平行陣列：時間 (給 bisect 找目前那句) 與顯示文字
         data_container = {
-            'lyrics': {},
             'times': [],
+            'lines': [],
             'ready': False,
             'failed': False
         }
+        wake = asyncio.Event()
+
+        def load_lyrics(data):
+            times, lines = data
+            data_container['lines'] = [self.render_lyric(line) for line in lines]
+            data_container['times'] = times
+            data_container['ready'] = True
 
         async def fetch_lyrics_background():
             try:
+                # 這次查詢在下面的 cached_lyrics 已經算過命中率了
                 data, search_logs = await self.lyrics_engine.get_dynamic_lyrics(
                     spotify_title=spotify_title,
-                    youtube_title=youtube_title
+                    youtube_title=youtube_title,
+                    count=False
                 )
-                if data and len(data) > 0:
-                    data_container['lyrics'] = data
-                    data_container['times'] = sorted(data.keys())
-                    data_container['ready'] = True
-                    await self.bot.dispatch_log(f"✅ [同步任務] 歌詞成功載入，共 {len(data)} 句")
+                if data:
+                    load_lyrics(data)
+                    await self.bot.dispatch_log(f"✅ [同步任務] 歌詞成功載入，共 {len(data[0])} 句", logging.DEBUG)
                 else:
                     data_container['failed'] = True
-                    await self.bot.dispatch_log(f"❌ [同步任務] 找不到動態歌詞：{spotify_title}")
+                    await self.bot.dispatch_log(f"❌ [同步任務] 找不到動態歌詞：{spotify_title}", logging.WARNING)
             except Exception as e:
                 data_container['failed'] = True
-                await self.bot.dispatch_log(f"⚠️ [同步任務崩潰] {e}")
-
-        self.bot.loop.create_task(fetch_lyrics_background())
-
-        # ✨ 重點修正 1：使用字典來儲存 start_time，避開 UnboundLocalError
-        tracker = {'start_time': time.time()}
-        last_second = -1
+                await self.bot.dispatch_log(f"⚠️ [同步任務崩潰] {e}", logging.WARNING)
+            wake.set()  # 馬上把結果畫上去，不用等下一個刻度
+
+        # 快取裡有 (或確定找不到) 就直接用，第一個畫面就帶著歌詞
+        cached = await self.lyrics_engine.cached_lyrics(spotify_title, youtube_title)
+        if cached:
+            load_lyrics(cached)
+        elif cached is not None:
+            data_container['failed'] = True
+        fetch_task = None if cached is not None else self.bot.loop.create_task(fetch_lyrics_background())
+
+        # 無縫模式的音訊外殼直接知道播到第幾個 frame；其他來源用時鐘推算 (暫停時往後推)
+        start_time = time.monotonic() - start
+        bar_len = 14
         display_duration = duration if duration > 0 else 240
+        step = display_duration / bar_len
+        shown = None
+        pending = None
 
-        while vc.is_connected() and (vc.is_playing() or vc.is_paused()):
-            if vc.is_paused():
-                # ✨ 重點修正 2：更新字典內的值
-                tracker['start_time'] += 0.5
-                await asyncio.sleep(0.5)
-                continue
-
-            # ✨ 重點修正 3：計算經過時間
-            elapsed = (time.time() - tracker['start_time'])
-            current_second = int(elapsed)
-
-            if current_second != last_second:
-                last_second = current_second
-                status_text = self.get_loop_status(guild_id)
+        try:
+            while vc.is_connected() and (vc.is_playing() or vc.is_paused()):
+                # 訊息被刪除 (或一直送不出去) 時停止更新
+                if pending and pending.done() and pending.result() is None:
+                    break
+                if vc.is_paused():
+                    start_time += 0.5
+                    await asyncio.sleep(0.5)
+                    continue
+
+                elapsed = getattr(vc.source, 'elapsed', None)
+                if elapsed is None:
+                    elapsed = time.monotonic() - start_time
+                next_event = elapsed + 5  # 循環模式 / 按鈕狀態的變動最慢 5 秒內反映
 
                 # --- 歌詞顯示邏輯 ---
                 if data_container['ready']:
-                    current_sentence = "🎵 **(間奏中)** 🎵"
-                    for t in reversed(data_container['times']):
-                        if elapsed >= t:
-                            raw_data = data_container['lyrics'][t]
-                            if isinstance(raw_data, list):
-                                current_sentence = "\n".join([f"**{str(line).strip()}**" for line in raw_data if line])
-                            else:
-                                processed = str(raw_data).replace('|', '\n').replace('\\n', '\n')
-                                current_sentence = f"**{processed}**"
-                            break
+                    times = data_container['times']
+                    i = bisect.bisect_right(times, elapsed) - 1
+                    current_sentence = data_container['lines'][i] if i >= 0 else "🎵 **(間奏中)** 🎵"
+                    if i + 1 < len(times):
+                        next_event = min(next_event, times[i + 1])
                 elif data_container['failed']:
                     current_sentence = "🌸 **艾瑪找不到這首歌的動態歌詞呢...**"
                 else:
                     current_sentence = "🌸 **艾瑪正在努力同步歌詞與翻譯中...**"
 
                 # --- 進度條渲染 (不論有沒有歌詞都會執行) ---
-                bar_len = 14
-                prog = min(elapsed / display_duration, 1.0)
-                filled = int(prog * bar_len)
-                bar_ui = "▬" * filled + "🔘" + "─" * (max(0, bar_len - filled))
-                time_label = f"{self.format_time(elapsed)} / {self.format_time(duration)}"
-
-                embed = discord.Embed(
-                    title=f"🌸 伴唱中 | {status_text}",
-                    description=f"**『 {spotify_title} 』**\n\n{current_sentence}\n\n{bar_ui}\n`{time_label}`",
-                    color=0xffb6c1,
-                    timestamp=datetime.datetime.now()
-                )
-                embed.set_footer(text="享受這段旋律吧！ ✨")
-
-                try:
-                    view = MusicControlView(self.bot, vc, self)
-                    await message.edit(embed=embed, view=view)
-                except:
-                    break # 訊息被刪除時停止更新
-
-                # ✨ 重點修正 4：移除原本在這裡的 if data_container['failed']: break
-                # 這樣即便失敗了，while 循環還是會為了進度條繼續跑
-
-            await asyncio.sleep(0.8)
-
-    async def check_queue(self, interaction, vc):
-            """音樂排程管理邏輯 (Music Dispatcher)"""
-            # --- 以下內容全部都要縮排 ---
-            guild_id = interaction.guild_id
-            mode = self.loop_mode.get(guild_id, 0)
-            current = self.current_song.get(guild_id)
-            queue = self.queues.get(guild_id, [])
-
-            next_item = None
-
-            # 處理循環邏輯
-            if mode == 1 and current:
-                next_item = current
-                await self.bot.dispatch_log(f"🔂 [循環] 單曲循環啟動: {current.get('query')}")
-            elif mode == 2 and current:
-                queue.append(current)
-                if queue:
-                    next_item = queue.pop(0)
-                await self.bot.dispatch_log(f"🔁 [循環] 清單循環運作中")
-            else:
-                if queue:
-                    next_item = queue.pop(0)
+                filled = min(int(elapsed / step), bar_len)
+                if filled < bar_len:
+                    next_event = min(next_event, (filled + 1) * step)
+                bar_ui = "▬" * filled + "🔘" + "─" * (bar_len - filled)
+                status_text = self.get_loop_status(guild_id)
 
-            if next_item:
-                # 啟動非同步播放任務
-                self.bot.loop.create_task(self.play_music_task(interaction, vc, next_item))
-            else:
-                self.current_song[guild_id] = None
-                await self.bot.dispatch_log(f"🏁 [播放結束] {interaction.guild.name} 的隊列已播放完畢。")
+                # 秒數只跟著其他內容一起更新，單純秒數跳動不值得一次 API 呼叫
+                view_changed = view.refresh()
+                frame = (status_text, current_sentence, filled)
+                if frame != shown or view_changed:
+                    time_label = f"{self.format_time(elapsed)} / {self.format_time(duration)}"
+                    embed = discord.Embed(
+                        title=f"🌸 伴唱中 | {status_text}",
+                        description=f"**『 {spotify_title} 』**\n\n{current_sentence}\n\n{bar_ui}\n`{time_label}`",
+                        color=0xffb6c1,
+                        timestamp=datetime.datetime.now()
+                    )
+                    embed.set_footer(text="享受這段旋律吧！ ✨")
+                    # 交給全域排程器：同一則訊息只送最新的畫面，並遵守頻道的速率額度
+                    if view_changed:
+                        pending = self.bot.editor.submit(message, embed=embed, view=view)
+                    else:
+                        pending = self.bot.editor.submit(message, embed=embed)
+                    shown = frame
 
-    async def play_music_task(self, interaction, vc, item):
-        """音樂播放主執行任務 - 已修正 FFmpeg 參數與面板清理"""
-        guild_id = interaction.guild_id
+                # 睡到下一句歌詞 / 進度條下一格 (歌詞載入完成會提早叫醒)
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=max(0.1, next_event - elapsed + 0.05))
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+        finally:
+            if fetch_task:
+                fetch_task.cancel()
+
+    async def spotify_import_task(self, player, pages, loaded, total):
+        """背景繼續匯入 Spotify 剩下的頁面，邊匯入邊更新進度"""
+        status = None
+        last_edit = 0
+        failed_pages = 0
         try:
-            # 1. 取得串流網址
-            source_data = await self.music.get_yt_source(item['query'])
-            if not source_data:
-                await self.bot.dispatch_log(f"❌ [播放異常] 無法獲取音訊來源")
-                self.bot.loop.create_task(self.check_queue(interaction, vc))
+            status = await player.channel.send(
+                f"📥 艾瑪正在匯入 Spotify 清單... `{loaded} / {total}`",
+                view=ImportProgressView(self)
+            )
+            async for tracks, total in pages:
+                vc = player.vc
+                if not vc or not vc.is_connected():
+                    break
+                if tracks is None:
+                    failed_pages += 1
+                    continue
+                queue = player.queue
+                was_empty = not queue
+                window_open = len(queue) < self.prefetcher.depth
+                queue.extend(Track.from_dict(t, clean_title=t['query']) for t in tracks)
+                loaded += len(tracks)
+                if window_open:
+                    self.prefetcher.schedule(player.guild_id, queue)
+
+                # 前面的歌已經全部播完了就直接接上新匯入的歌
+                if was_empty and not player.current:
+                    await player.post('kick')
+
+                if time.time() - last_edit > 2:
+                    last_edit = time.time()
+                    player.save()
+                    skipped = f" (⚠️ {failed_pages} 頁讀取失敗)" if failed_pages else ""
+                    self.bot.editor.submit(status, content=f"📥 艾瑪正在匯入 Spotify 清單... `{loaded} / {total}`{skipped}")
+
+            player.save()
+            if failed_pages:
+                await self.bot.dispatch_log(
+                    f"⚠️ [匯入不完整] {player.guild.name} 的 Spotify 清單加入 {loaded} / {total} 首，{failed_pages} 頁讀取失敗",
+                    logging.WARNING
+                )
+                self.bot.editor.submit(
+                    status,
+                    content=f"⚠️ Spotify 清單只匯入了 `{loaded} / {total}` 首 ({failed_pages} 頁讀取失敗，可以稍後再點一次補上)",
+                    view=None
+                )
+            else:
+                await self.bot.dispatch_log(f"📥 [匯入完成] {player.guild.name} 的 Spotify 清單共加入 {loaded} 首")
+                self.bot.editor.submit(status, content=f"✅ Spotify 清單匯入完成，共 `{loaded}` 首歌！", view=None)
+        except asyncio.CancelledError:
+            if status:
+                self.bot.editor.submit(status, content=f"⏹️ 已取消匯入 (保留已加入的 `{loaded}` 首)", view=None)
+            raise
+        except Exception as e:
+            await self.bot.dispatch_log(f"💥 [匯入崩潰] {e}", logging.ERROR)
+            if status:
+                self.bot.editor.submit(status, content=f"❌ 匯入中斷，只加入了 `{loaded} / {total}` 首", view=None)
+        finally:
+            await pages.aclose()
+            if player.import_task is asyncio.current_task():
+                player.import_task = None
+
+    def maybe_extend_playlist(self, player):
+        """還沒播過的歌快用完時，在背景載入歌單的下一段"""
+        cursor = player.playlist_cursor
+        if not cursor or (cursor.get('task') and not cursor['task'].done()):
+            return
+        low_water = max(5, self.prefetcher.depth * 2)
+        unplayed = sum(1 for x in player.queue[:low_water] if not x.played)
+        if unplayed < low_water:
+            cursor['task'] = self.bot.loop.create_task(self.extend_playlist_task(player, cursor))
+
+    async def extend_playlist_task(self, player, cursor):
+        """載入歌單的下一段，插在還沒播過的歌後面 (清單循環時排在重播的歌之前)
+
+        暫時性的 yt-dlp / 網路錯誤會退避重試，連續失敗太多次才放棄剩下的部分並通知頻道。
+        """
+        failures = 0
+        while True:
+            items = await self.music.get_yt_playlist_window(cursor['url'], cursor['next'], self.playlist_window, PRIORITY_PREFETCH)
+            if player.playlist_cursor is not cursor:
                 return
-
-            item['duration'] = source_data.get('duration', 0)
-            self.current_song[guild_id] = item
-            s_title = item.get('clean_title') or source_data['title']
-
-            # 2. 定義 FFmpeg 參數 (✨ 修正版：解決 Return Code 234)
-            import shutil
-            FFMPEG_EXE = shutil.which("ffmpeg") or "ffmpeg"
-
-            # 強化的重連參數，確保網路波動時不會斷掉
-            # --- ✨ 針對 FFmpeg 8.0.1 的相容性優化版 ---
-            FFMPEG_OPTIONS = {
-                'before_options': (
-                    '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 '
-                    '-nostats -loglevel panic' # 💡 移除 probesize 與 analyzeduration，降低解析報錯率
-                ),
-                'options': '-vn -af "volume=1.0,aresample=async=1"'
-            }
-
-            # 3. 建立音訊來源 (必須在清理舊面板前建立好，確保變數已定義)
-            audio_source = discord.FFmpegPCMAudio(
-                source_data['url'],
-                executable=FFMPEG_EXE,
-                **FFMPEG_OPTIONS
+            if items is not None:
+                break
+            failures += 1
+            if failures >= self.playlist_retries:
+                player.playlist_cursor = None
+                await self.bot.dispatch_log(
+                    f"❌ [歌單分段] {player.guild.name} 連續 {failures} 次載入失敗，放棄第 {cursor['next']} 首以後的部分",
+                    logging.WARNING
+                )
+                if player.channel:
+                    try: await player.channel.send(f"⚠️ 歌單第 {cursor['next']} 首以後一直載入失敗，艾瑪先播到這裡，之後可以再點一次歌單～")
+                    except Exception: pass
+                return
+            delay = min(15 * 2 ** (failures - 1), 240)
+            await self.bot.dispatch_log(
+                f"⚠️ [歌單分段] {player.guild.name} 載入失敗 (第 {failures} 次)，{delay} 秒後重試", logging.WARNING
             )
+            await asyncio.sleep(delay)
+        cursor['next'] += self.playlist_window
+        if len(items) < self.playlist_window:
+            player.playlist_cursor = None
+        if not items:
+            return
 
-            # 4. ✨ 移除舊控制面板 (讓頻道保持整潔)
-            if guild_id in self.last_message:
+        queue = player.queue
+        was_empty = not queue
+        # 從尾端往回數，跳過清單循環排回來的已播歌曲
+        insert_at = len(queue)
+        for x in reversed(queue):
+            if not x.played:
+                break
+            insert_at -= 1
+        queue.insert(insert_at, [Track.from_dict(x) for x in items])
+        player.changed()
+        await self.bot.dispatch_log(f"🎵 [歌單分段] {player.guild.name} 再載入了 {len(items)} 首")
+
+        # 前面的歌已經播完了就直接接上新載入的歌
+        if was_empty and not player.current:
+            await player.post('kick')
+
+    async def resolve_track(self, item):
+        """取得串流網址 (優先使用預先解析好的來源)，結果記在佇列項目上"""
+        source_data = await self.prefetcher.take(item) or await self.music.get_item_source(item)
+        if source_data:
+            item.source = source_data
+            item.duration = source_data.get('duration') or item.duration
+        return source_data
+
+    async def announce_track(self, player, item, source_data, reuse_panel=False, start=0):
+        """發送控制面板 (無縫換歌時直接改寫原本的面板)，並重新啟動歌詞同步"""
+        vc = player.vc
+        s_title = item.clean_title or source_data['title']
+        view = MusicControlView(self.bot, vc, self)
+        embed = discord.Embed(
+            title=f"🌸 伴唱中 | {self.get_loop_status(player.guild_id)}",
+            description=f"**『 {s_title} 』**\n\n🌸 **艾瑪正在準備歌詞，請稍候...**",
+            color=0xffb6c1
+        )
+        embed.set_footer(text="享受這段旋律吧！ ✨")
+
+        # 先停掉上一首的歌詞同步，它排隊中的舊畫面會被這次的編輯取代
+        old_task = player.lyrics_task
+        if old_task and not old_task.done():
+            old_task.cancel()
+
+        msg = player.panel if reuse_panel else None
+        if msg and not await self.bot.editor.submit(msg, embed=embed, view=view):
+            msg = None
+        if not msg:
+            # ✨ 移除舊控制面板 (讓頻道保持整潔)
+            if player.panel:
                 try:
-                    await self.last_message[guild_id].delete()
+                    await player.panel.delete()
                 except:
                     pass # 訊息已被刪除或過期則忽略
 
-            # 5. 開始播放
-            vc.play(
-                audio_source,
-                after=lambda e: self.bot.loop.create_task(self.check_queue(interaction, vc))
-            )
+            # 傳送新訊息並記在播放器上
+            msg = await player.channel.send(embed=embed, view=view)
+            player.panel = msg
 
-            # 6. 發送新面板並記錄
-            view = MusicControlView(self.bot, vc, self)
-            embed = discord.Embed(
-                title=f"🌸 伴唱中 | {self.get_loop_status(guild_id)}",
-                description=f"**『 {s_title} 』**\n\n🌸 **艾瑪正在準備歌詞，請稍候...**",
-                color=0xffb6c1
-            )
-            embed.set_footer(text="享受這段旋律吧！ ✨")
-
-            # 傳送新訊息並存入字典
-            msg = await interaction.channel.send(embed=embed, view=view)
-            self.last_message[guild_id] = msg
-
-            # 7. 啟動同步歌詞任務
-            if msg:
-                self.bot.loop.create_task(self.lyrics_sync_task(vc, s_title, source_data['title'], msg))
-
-        except Exception as e:
-            await self.bot.dispatch_log(f"💥 [播放任務崩潰] {e}")
-            # 發生錯誤時稍微等待，避免光速跳過整個歌單
-            await asyncio.sleep(2)
-            self.bot.loop.create_task(self.check_queue(interaction, vc))
+        # 啟動同步歌詞任務 (面板沿用同一個 view)
+        player.lyrics_task = self.bot.loop.create_task(
+            self.lyrics_sync_task(vc, s_title, source_data['title'], msg, view, start)
+        )
 
     # --- 斜線指令部分 ---
     @app_commands.command(name="ask", description="向艾瑪提問任何事 ✨")
@@ -397,45 +620,52 @@ class AskCommand(commands.Cog):
             else:
                 return await interaction.followup.send("🌸 妳得先進去語音頻道，我才找得到妳呀！")
 
-        guild_id = interaction.guild_id
-        if guild_id not in self.queues: self.queues[guild_id] = []
+        player = self.get_player(interaction.guild_id)
+        queue = player.queue
+        player.channel_id = interaction.channel_id
 
         added_count = 0
         if "spotify.com" in input_str:
-            tracks = await self.music.get_spotify_tracks_async(input_str)
-            for t in tracks: self.queues[guild_id].append({'query': t, 'clean_title': t})
+            # 第一頁到手就先播，剩下的頁面交給背景匯入
+            pages = self.music.iter_spotify_tracks(input_str)
+            tracks, total = await anext(pages, ([], 0))
+            tracks = tracks or []
+            queue.extend(Track.from_dict(t, clean_title=t['query']) for t in tracks)
             added_count = len(tracks)
+            if total > added_count:
+                player.cancel_import()
+                player.import_task = self.bot.loop.create_task(
+                    self.spotify_import_task(player, pages, added_count, total)
+                )
+            else:
+                await pages.aclose()
         elif "list=" in input_str:
-            urls = await self.music.get_yt_playlist_urls(input_str)
-            for u in urls: self.queues[guild_id].append({'query': u, 'clean_title': None})
-            added_count = len(urls)
+            # 大型歌單只先載入第一段，其餘等快播完時再分段載入
+            items = await self.music.get_yt_playlist_window(input_str, 1, self.playlist_window) or []
+            queue.extend(Track.from_dict(x) for x in items)
+            added_count = len(items)
+            player.drop_playlist_cursor()
+            if len(items) == self.playlist_window:
+                player.playlist_cursor = {'url': input_str, 'next': 1 + self.playlist_window}
         else:
-            self.queues[guild_id].append({'query': input_str, 'clean_title': None})
+            queue.append(Track(input_str))
             added_count = 1
 
         await self.bot.dispatch_log(f"📥 [清單更新] {interaction.user.name} 加入了 {added_count} 首歌")
 
         if not vc.is_playing() and not vc.is_paused():
-            if self.queues[guild_id]:
-                target = self.queues[guild_id].pop(0)
-                await self.play_music_task(interaction, vc, target)
-                await interaction.followup.send(f"🌸 音樂啟動！成功將 {added_count} 首歌加入清單 ✨")
+            # 開播交給播放器，同時有好幾個人點歌也只會開播一次
+            await player.post('kick')
+            await interaction.followup.send(f"🌸 音樂啟動！成功將 {added_count} 首歌加入清單 ✨")
         else:
+            player.changed()
             await interaction.followup.send(f"✅ 好的！已幫妳把 {added_count} 首歌加入排隊囉！")
 
     @app_commands.command(name="previous", description="⏮️ 播放上一首歌曲")
     async def previous(self, interaction: discord.Interaction):
         """回到上一首歌的指令版本"""
-        guild_id = interaction.guild_id
-        last_song = self.last_played.get(guild_id)
-
-        if last_song:
+        if self.get_player(interaction.guild_id).rewind():
             await self.bot.dispatch_log(f"⏮️ [指令回放] {interaction.user.name} 請求回放上一首歌")
-            current = self.current_song.get(guild_id)
-            if current:
-                self.queues[guild_id].insert(0, current)
-            self.queues[guild_id].insert(0, last_song)
-
             vc = interaction.guild.voice_client
             if vc: vc.stop()
             await interaction.response.send_message("⏮️ 正在為妳找回剛才的旋律...", ephemeral=True)
@@ -445,12 +675,13 @@ class AskCommand(commands.Cog):
     @app_commands.command(name="skip", description="跳過這首歌 ⏭️")
     async def skip(self, interaction: discord.Interaction, target: int = None):
         vc = interaction.guild.voice_client
-        guild_id = interaction.guild_id
         if not vc: return await interaction.response.send_message("🌸 艾瑪不在頻道裡唷。", ephemeral=True)
 
         if target is not None:
-            if guild_id in self.queues and 1 <= target <= len(self.queues[guild_id]):
-                for _ in range(target - 1): self.queues[guild_id].pop(0)
+            player = self.get_player(interaction.guild_id)
+            if 1 <= target <= len(player.queue):
+                player.queue.skip(target - 1)
+                player.changed()
                 vc.stop()
                 await self.bot.dispatch_log(f"🚀 [跳轉] {interaction.user.name} 強制跳轉至第 {target} 首")
                 await interaction.response.send_message(f"🚀 收到！直接為妳跳轉到第 {target} 首歌！")
@@ -463,21 +694,47 @@ class AskCommand(commands.Cog):
     @app_commands.command(name="shuffle", description="🔀 打亂目前的播放隊列")
     async def shuffle(self, interaction: discord.Interaction):
         """指令版：隨機洗牌"""
-        guild_id = interaction.guild_id
-        if guild_id in self.queues and len(self.queues[guild_id]) > 1:
-            random.shuffle(self.queues[guild_id])
+        player = self.get_player(interaction.guild_id)
+        queue = player.queue
+        if len(queue) > 1:
+            queue.shuffle()
+            player.changed()
             await self.bot.dispatch_log(f"🔀 [指令打亂] {interaction.user.name} 打亂了隊列")
-            await interaction.response.send_message(f"🔀 已打亂目前的 **{len(self.queues[guild_id])}** 首歌囉！")
+            await interaction.response.send_message(f"🔀 已打亂目前的 **{len(queue)}** 首歌囉！")
         else:
             await interaction.response.send_message("🌸 隊列裡沒什麼歌可以打亂了~", ephemeral=True)
 
+    @app_commands.command(name="move", description="↕️ 調整佇列裡歌曲的順序")
+    async def move(self, interaction: discord.Interaction, source: int, target: int):
+        """把第 source 首移到第 target 首的位置 (序號同 /queue)"""
+        player = self.get_player(interaction.guild_id)
+        queue = player.queue
+        if not (1 <= source <= len(queue) and 1 <= target <= len(queue)):
+            return await interaction.response.send_message("🌸 找不到那個序號呢~", ephemeral=True)
+        queue.move(source - 1, target - 1)
+        player.changed()
+        await self.bot.dispatch_log(f"↕️ [調整順序] {interaction.user.name} 把第 {source} 首移到第 {target} 首")
+        await interaction.response.send_message(f"↕️ 好的！**{queue[target - 1].label[:45]}** 現在排在第 {target} 首～")
+
+    @app_commands.command(name="remove", description="🗑️ 從佇列移除一首歌")
+    async def remove(self, interaction: discord.Interaction, index: int):
+        """移除第 index 首 (序號同 /queue)"""
+        player = self.get_player(interaction.guild_id)
+        queue = player.queue
+        if not 1 <= index <= len(queue):
+            return await interaction.response.send_message("🌸 找不到那個序號呢~", ephemeral=True)
+        removed = queue.pop(index - 1)
+        player.changed()
+        await self.bot.dispatch_log(f"🗑️ [移除歌曲] {interaction.user.name} 移除了第 {index} 首")
+        await interaction.response.send_message(f"🗑️ 已經把 **{removed.label[:45]}** 從清單拿掉囉！")
+
     @app_commands.command(name="loop", description="🔁 切換循環模式 (關閉/單曲/清單)")
     async def loop_mode_cmd(self, interaction: discord.Interaction):
         """指令版：循環模式切換"""
-        guild_id = interaction.guild_id
-        current = self.loop_mode.get(guild_id, 0)
-        new_mode = (current + 1) % 3
-        self.loop_mode[guild_id] = new_mode
+        player = self.get_player(interaction.guild_id)
+        new_mode = player.loop_mode = (player.loop_mode + 1) % 3
+        # 循環模式會改變下一首是誰
+        player.changed()
 
         modes = {0: "❌ 關閉", 1: "🔂 單曲循環", 2: "🔁 清單循環"}
         await self.bot.dispatch_log(f"🔄 [指令循環] {interaction.user.name} 將模式設定為 {modes[new_mode]}")
@@ -485,24 +742,181 @@ class AskCommand(commands.Cog):
 
     @app_commands.command(name="queue", description="查看當前的點歌清單 🎵")
     async def queue(self, interaction: discord.Interaction):
-        q = self.queues.get(interaction.guild_id, [])
+        player = self.get_player(interaction.guild_id)
+        q = player.queue
         if not q: return await interaction.response.send_message("🌸 目前排隊清單空蕩蕩的。")
-        display = "\n".join([f"**{i+1}.** {(x['clean_title'] or x['query'])[:45]}..." for i, x in enumerate(q[:10])])
+
+        # 目前這首還剩多久
+        now_left = 0
+        current = player.current
+        vc = interaction.guild.voice_client
+        if current and vc and (vc.is_playing() or vc.is_paused()):
+            now_left = max(0, current.duration - player.position())
+
+        lines = []
+        for i, x in enumerate(q[:10]):
+            before, unknown = q.time_before(i)
+            eta = f"{'≥' if unknown else ''}{self.format_time(now_left + before)} 後"
+            lines.append(
+                f"**{i+1}.** {x.label[:45]}..."
+                + (f" `{self.format_time(x.duration)}`" if x.duration else "")
+                + f" ⏳ {eta}"
+            )
+        display = "\n".join(lines)
+
+        total, unknown = q.total_duration()
+        display += f"\n\n🕒 共 {len(q)} 首，剩餘約 **{self.format_time(now_left + total)}**"
+        if unknown:
+            display += f" (另有 {unknown} 首長度未知)"
+        if player.playlist_cursor:
+            display += "\n🎵 *歌單後面的歌會在快播完時自動載入*"
         embed = discord.Embed(title="🎵 待播放清單 (前 10 首)", description=display, color=0xffb6c1)
         await interaction.response.send_message(embed=embed)
 
+    @app_commands.command(name="stats", description="查看音樂引擎的快取統計 📊")
+    async def stats(self, interaction: discord.Interaction):
+        cache = self.music.source_cache.stats()
+        embed = discord.Embed(title="📊 艾瑪的音樂引擎狀態", color=0xffb6c1)
+        embed.add_field(
+            name="🎧 串流快取",
+            value=f"命中 {cache['hits']} / 未命中 {cache['misses']} ({cache['hit_rate']:.0%})\n記憶體中 {cache['memory_entries']} 筆",
+            inline=False
+        )
+        meta = self.music.spotify_meta.stats()
+        embed.add_field(
+            name="🌿 Spotify 清單快取",
+            value=f"命中 {meta['hits']} / 未命中 {meta['misses']} ({meta['hit_rate']:.0%})",
+            inline=False
+        )
+        matches = self.music.youtube_matches.stats()
+        embed.add_field(
+            name="🔗 Spotify → YouTube 對照表",
+            value=f"命中 {matches['hits']} / 需搜尋 {matches['misses']} ({matches['hit_rate']:.0%})",
+            inline=False
+        )
+        audio = self.audio.counters
+        embed.add_field(
+            name=f"🔊 音訊路徑 ({self.audio.mode})",
+            value=f"本機 {audio['local']} / 直通 {audio['passthrough']} / 探測 {audio['probed']} / FFmpeg 轉碼 {audio['transcoded']} / PCM {audio['pcm']}",
+            inline=False
+        )
+        if self.audio.hub:
+            hub = self.audio.hub.stats()
+            embed.add_field(
+                name="🔀 共用解碼器",
+                value=(
+                    f"省下 {hub['saved']} 個 FFmpeg (共開 {hub['decoders']} 個)\n"
+                    f"目前 {hub['active']} 條串流 / {hub['listeners']} 個聽眾，落後改獨立解碼 {hub['fallbacks']} 次"
+                ),
+                inline=False
+            )
+        if self.audio.cache:
+            disk = await asyncio.to_thread(self.audio.cache.stats)
+            embed.add_field(
+                name="💾 本機音訊快取",
+                value=(
+                    f"命中 {disk['hits']} / 未命中 {disk['misses']} ({disk['hit_rate']:.0%})\n"
+                    f"{disk['files']} 首 / {disk['bytes'] / 1048576:.0f} MB (上限 {disk['budget'] / 1048576:.0f} MB)，"
+                    f"下載 {disk['downloads']} / 淘汰 {disk['evictions']} / 損毀 {disk['corrupted']}"
+                ),
+                inline=False
+            )
+        gaps = self.audio.gap_stats()
+        embed.add_field(
+            name=f"🎼 換歌空檔 (無縫模式: {'開' if self.gapless else '關'})",
+            value=(
+                f"無縫 {gaps['gapless']['count']} 次，平均 {gaps['gapless']['avg'] * 1000:.0f} ms / 最長 {gaps['gapless']['max'] * 1000:.0f} ms\n"
+                f"重新啟動 {gaps['restart']['count']} 次，平均 {gaps['restart']['avg']:.2f} s / 最長 {gaps['restart']['max']:.2f} s"
+            ),
+            inline=False
+        )
+        players = list(self.players.values())
+        playing = sum(1 for p in players if p.current)
+        here = self.players.get(interaction.guild_id)
+        embed.add_field(
+            name="🎛️ 播放器",
+            value=(
+                f"{len(players)} 個伺服器 (播放中 {playing}) / 佇列共 {sum(len(p.queue) for p in players)} 首\n"
+                f"約 {sum(p.memory_estimate() for p in players) / 1048576:.1f} MB"
+                + (f"，本伺服器 {here.memory_estimate() / 1024:.0f} KB" if here else "")
+                + f" / 略過過期事件 {sum(p.stale for p in players)} 次"
+            ),
+            inline=False
+        )
+        lyric_sources = self.lyrics_engine.stats()
+        embed.add_field(
+            name=f"🏁 歌詞來源 ({'競速' if self.lyrics_engine.race else '依序'})",
+            value="\n".join(
+                f"{name}: 勝出 {st['wins']} / 查詢 {st['launched']} ({st['win_rate']:.0%})，晚到 {st['late']}，"
+                f"平均 {st['avg_latency']:.2f}s，取消 {st['cancelled']} / 失敗 {st['errors']}"
+                for name, st in lyric_sources.items()
+            ) + "\nHTTP 連線池：請求 {requests} / 失敗 {failures}".format(**self.lyrics_engine.http.stats()),
+            inline=False
+        )
+        lyrics_cache = self.lyrics_engine.cache.stats()
+        embed.add_field(
+            name="📖 歌詞快取",
+            value=(
+                f"命中 {lyrics_cache['hits']} / 已知找不到 {lyrics_cache['negative_hits']} / 未命中 {lyrics_cache['misses']} "
+                f"({lyrics_cache['hit_rate']:.0%})\n記憶體中 {lyrics_cache['memory_entries']} 筆"
+                + "\n拼音：轉換 {converted} 句 / 備忘命中 {hits} 句 ({hit_rate:.0%})，備忘 {memo_entries} 句，預先準備 {precomputed} 首".format(
+                    **self.lyrics_engine.romaji_stats())
+            ),
+            inline=False
+        )
+        edits = self.bot.editor.stats()
+        embed.add_field(
+            name="✏️ 訊息編輯排程",
+            value=(
+                f"送出 {edits['sent']} / 舊畫面作廢 {edits['dropped']} / 429 {edits['rate_limited']} 次 / "
+                f"重送 {edits['retries']} / 放棄 {edits['failed']}\n"
+                f"排隊 {edits['pending']} 則 / 送出中 {edits['channels']} 個頻道"
+            ),
+            inline=False
+        )
+        reaper = self.reaper.stats()
+        summary = reaper['summary']
+        embed.add_field(
+            name=f"🧹 清道夫 (巡邏 {reaper['sweeps']} 次)",
+            value=(
+                f"沒人離開 {reaper['left_alone']} / 閒置離開 {reaper['left_idle']} / 移出播放器 {reaper['dropped_players']} / "
+                f"忘記對話 {reaper['dropped_chats']} / 取消任務 {reaper['cancelled_tasks']}"
+                + (f"\nRSS {summary['rss_mb']:.0f} MB / 對話 {summary['chats']} 人 / 背景任務 {summary['tasks']}" if summary else "")
+            ),
+            inline=False
+        )
+        store = self.player_store.stats()
+        embed.add_field(
+            name="💾 播放狀態存檔",
+            value=(
+                f"存檔請求 {store['saves']} (合併 {store['coalesced']}) / 寫入 {store['flushes']} 批 {store['rows']} 列\n"
+                f"待寫 {store['pending']} / 上次寫入 {store['last_flush_ms']:.1f} ms / 待還原 {len(self.saved_players)} 個伺服器"
+            ),
+            inline=False
+        )
+        pool = self.music.extractor.stats()
+        embed.add_field(
+            name=f"⚙️ yt-dlp 提取池 ({pool['backend']}, 重啟 {pool['restarts']} 次)",
+            value=(
+                f"排隊 {pool['queued']} / 執行中 {pool['running']} / 完成 {pool['completed']} / 失敗 {pool['failed']} / 拒絕 {pool['rejected']}\n"
+                f"平均等待 {pool['avg_wait']:.2f}s / 平均提取 {pool['avg_run']:.2f}s / 最長 {pool['max_run']:.2f}s"
+            ),
+            inline=False
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
     @app_commands.command(name="leave", description="停止播放並讓艾瑪休息 🚪")
     async def leave(self, interaction: discord.Interaction):
-        guild_id = interaction.guild_id
         vc = interaction.guild.voice_client
         if vc:
+            player = self.get_player(interaction.guild_id)
             # 清理舊面板
-            if guild_id in self.last_message:
-                try: await self.last_message[guild_id].delete()
+            if player.panel:
+                try: await player.panel.delete()
                 except: pass
-                del self.last_message[guild_id]
+                player.panel = None
 
-            self.queues[guild_id] = []
+            player.reset()
             await vc.disconnect()
             await interaction.response.send_message("🚪 艾瑪先退下了，期待下次再見！🌸")
 
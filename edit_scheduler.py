@@ -0,0 +1,181 @@
+import time
+import asyncio
+import discord
+from collections import OrderedDict
+
+class _Bucket:
+    """令牌桶：每 per 秒補 rate 個令牌，被 429 時整個桶暫停到 blocked_until"""
+    __slots__ = ('rate', 'per', 'tokens', 'stamp', 'blocked_until', 'failures')
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+        self.failures = 0
+
+    def wait(self, now):
+        """還要等幾秒才能送下一個請求 (不消耗令牌)"""
+        self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate / self.per)
+        self.stamp = now
+        refill = 0.0 if self.tokens >= 1 else (1 - self.tokens) * self.per / self.rate
+        return max(refill, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class EditScheduler:
+    def __init__(self, per_channel=5, per_seconds=5.0, global_rate=40, max_retries=3):
+        """✏️ 全域的訊息編輯排程器
+
+        面板只要丟出「現在想顯示的樣子」：同一則訊息還沒送出的變更會合併成一份 (後來的欄位蓋掉舊的)，
+        每個頻道依自己的額度 (per_seconds 秒 per_channel 次) 依序送出，所有頻道再共用一個全域額度。
+        被 429 或暫時性錯誤擋下就整個頻道退避後重送最新的那份，訊息不見了才放棄。
+        """
+        self.per_channel = per_channel
+        self.per_seconds = per_seconds
+        self.max_retries = max_retries
+        self.global_bucket = _Bucket(global_rate, 1.0)
+        self.buckets = {}   # channel_id -> _Bucket
+        self.pending = {}   # channel_id -> OrderedDict(message_id -> [message, kwargs, future, attempts])
+        self.drainers = {}  # channel_id -> 正在送這個頻道的任務
+        self._pruned = time.monotonic()
+
+        # 📊 統計數據
+        self.submitted = 0
+        self.sent = 0
+        self.dropped = 0       # 還沒送出就被更新的畫面取代
+        self.rate_limited = 0  # 收到 429
+        self.retries = 0
+        self.failed = 0
+
+    def submit(self, message, **kwargs):
+        """排入一則訊息想要的新樣子，回傳 Future：
+        True = 已送出 / False = 被更新的畫面取代 / None = 訊息不見了或一直失敗
+        還沒送出的同一則訊息會合併進去並共用同一個 Future。
+        """
+        loop = asyncio.get_running_loop()
+        channel_id = message.channel.id
+        frames = self.pending.setdefault(channel_id, OrderedDict())
+        self.submitted += 1
+        old = frames.get(message.id)
+        if old:
+            # 合併而不是整份取代：只改 embed 的新畫面不能把排隊中的 view 變更吃掉
+            # (也保留原本的排隊位置，避免一直更新的面板永遠排在最後)
+            self.dropped += 1
+            old[1].update(kwargs)
+            future = old[2]
+        else:
+            future = loop.create_future()
+            frames[message.id] = [message, kwargs, future, 0]
+        if channel_id not in self.drainers:
+            self.drainers[channel_id] = loop.create_task(self._drain(channel_id))
+        self._prune()
+        return future
+
+    async def acquire(self, channel_id, wanted=None):
+        """其他直接送訊息的路線 (例如 Log) 也先拿同一套額度
+
+        有給 wanted (等待中的畫面) 時，輪到之前它就空了的話不拿令牌，回傳 False。
+        """
+        bucket = self._bucket(channel_id)
+        while True:
+            if wanted is not None and not wanted:
+                return False
+            now = time.monotonic()
+            wait = max(bucket.wait(now), self.global_bucket.wait(now))
+            if wait <= 0:
+                bucket.take()
+                self.global_bucket.take()
+                return True
+            await asyncio.sleep(wait)
+
+    def _prune(self):
+        """每分鐘清一次閒置的頻道額度 (閒置超過一個週期的桶早就回滿，重新建立也一樣)"""
+        now = time.monotonic()
+        if now - self._pruned < 60:
+            return
+        self._pruned = now
+        idle = [
+            cid for cid, b in self.buckets.items()
+            if cid not in self.drainers and now - b.stamp > b.per and b.blocked_until < now
+        ]
+        for cid in idle:
+            del self.buckets[cid]
+
+    def _bucket(self, channel_id):
+        bucket = self.buckets.get(channel_id)
+        if bucket is None:
+            bucket = self.buckets[channel_id] = _Bucket(self.per_channel, self.per_seconds)
+        return bucket
+
+    async def _drain(self, channel_id):
+        """依序送出一個頻道裡等待中的畫面，送完就結束"""
+        frames = self.pending[channel_id]
+        bucket = self._bucket(channel_id)
+        try:
+            while frames:
+                if not await self.acquire(channel_id, frames):
+                    break
+                message_id, frame = frames.popitem(last=False)
+                message, kwargs, future, attempts = frame
+                try:
+                    await message.edit(**kwargs)
+                except discord.NotFound:
+                    self._finish(future, None)
+                    self.failed += 1
+                    continue
+                except Exception as e:
+                    status = getattr(e, 'status', None)
+                    if status == 403:
+                        self._finish(future, None)
+                        self.failed += 1
+                        continue
+                    retry_after = getattr(e, 'retry_after', None)
+                    if status == 429 or retry_after is not None:
+                        self.rate_limited += 1
+                    bucket.failures += 1
+                    bucket.block(retry_after or min(2 ** bucket.failures, 60))
+                    # 等待期間有更新的畫面就把這份沒送成的變更併進去 (新的欄位優先)，沒有才放回最前面重送
+                    newer = frames.get(message_id)
+                    if newer is None:
+                        if attempts >= self.max_retries:
+                            self._finish(future, None)
+                            self.failed += 1
+                            print(f"⚠️ 訊息編輯放棄 ({channel_id}): {e}")
+                            continue
+                        self.retries += 1
+                        frame[3] = attempts + 1
+                        frames[message_id] = frame
+                        frames.move_to_end(message_id, last=False)
+                    else:
+                        newer[1] = {**kwargs, **newer[1]}
+                        self._finish(future, False)
+                    continue
+                bucket.failures = 0
+                self.sent += 1
+                self._finish(future, True)
+        finally:
+            del self.drainers[channel_id]
+            if not frames:
+                self.pending.pop(channel_id, None)
+
+    def _finish(self, future, result):
+        if not future.done():
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'rate_limited': self.rate_limited,
+            'retries': self.retries,
+            'failed': self.failed,
+            'pending': sum(len(f) for f in self.pending.values()),
+            'channels': len(self.drainers),
+        }
@@ -0,0 +1,311 @@
+import time
+import queue
+import asyncio
+import itertools
+import threading
+import contextvars
+import multiprocessing
+import yt_dlp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# 🎚️ 提取優先度 (數字越小越先做)
+PRIORITY_NOW = 0          # 馬上要播的歌
+PRIORITY_INTERACTIVE = 1  # 使用者正在等結果的指令 (例如展開歌單)
+PRIORITY_PREFETCH = 2     # 背景預先解析
+PRIORITY_BACKGROUND = 3   # 其他不急的工作
+
+# 🎫 號碼牌：同一個 asyncio 任務裡送出的提取工作都記在上面，
+# 背景預先解析的歌輪到要播時，用 ExtractorPool.promote() 整張提到 PRIORITY_NOW
+_ticket = contextvars.ContextVar('spark_extract_ticket', default=None)
+
+class ExtractTicket:
+    __slots__ = ('futures', 'urgent')
+
+    def __init__(self):
+        self.futures = []
+        self.urgent = False
+
+    def bind(self):
+        """掛在目前的 asyncio 任務上，之後這個任務 submit 的工作都記在這張號碼牌"""
+        _ticket.set(self)
+
+# ======================================================
+# --- 提取工作 (每個都收一個 YoutubeDL，回傳精簡的 dict) ---
+# ======================================================
+def extract_stream_info(ydl, query):
+    """同步提取邏輯，確保回傳的是真正的串流 URL"""
+    info = ydl.extract_info(query, download=False)
+    if 'entries' in info:
+        if not info['entries']: return None
+        entry = info['entries'][0]
+    else:
+        entry = info
+
+    # 🔍 終極網址抓取：排除網頁網址，尋找 googlevideo 連結
+    stream_url = None
+    codec = None
+
+    # 嘗試 0: 優先挑 webm/opus 純音軌，播放時可以直接 codec copy 給 Discord
+    opus_audio = [
+        f for f in entry.get('formats') or []
+        if f.get('vcodec') == 'none' and f.get('acodec') == 'opus' and f.get('url')
+    ]
+    if opus_audio:
+        stream_url = max(opus_audio, key=lambda f: f.get('abr') or 0)['url']
+        codec = 'opus'
+
+    # 嘗試 1: 直接找 url 欄位
+    raw_url = entry.get('url')
+    if not stream_url and raw_url and 'youtube.com' not in raw_url:
+        stream_url = raw_url
+        codec = entry.get('acodec')
+
+    # 嘗試 2: 從 formats 裡挑選最好的純音軌
+    if not stream_url and 'formats' in entry:
+        # 篩選沒有影片(vcodec='none')且有網址的格式，取最後一個(通常品質最高)
+        best_audio = [f for f in entry['formats'] if f.get('vcodec') == 'none' and f.get('url')]
+        if best_audio:
+            stream_url = best_audio[-1]['url']
+            codec = best_audio[-1].get('acodec')
+
+    if not stream_url:
+        print(f"⚠️ 艾瑪警告：無法解析有效串流網址: {entry.get('title')}")
+        return None
+
+    return {
+        'id': entry.get('id'),
+        'url': stream_url,
+        'title': entry.get('title', 'Unknown Title'),
+        'duration': entry.get('duration', 0),
+        # opus 以外的編碼統一記成 'other'，None 表示不知道 (播放時再探測)
+        'codec': 'opus' if codec == 'opus' else ('other' if codec and codec != 'none' else None)
+    }
+
+def search_candidates(ydl, query, count):
+    """flat 模式搜尋，只拿影片 ID / 標題 / 長度 / 頻道"""
+    info = ydl.extract_info(f"ytsearch{count}:{query}", download=False)
+    return [
+        {'id': e['id'], 'title': e.get('title') or '', 'duration': e.get('duration') or 0, 'channel': e.get('channel') or ''}
+        for e in info.get('entries', []) if e and e.get('id')
+    ]
+
+def extract_playlist_window(ydl, playlist_url, start, end):
+    """flat 模式展開歌單的第 start~end 首，保留影片 ID / 標題 / 長度"""
+    # YoutubeDL 是共用的常駐實例，只在這次工作中暫時指定範圍
+    ydl.params['playlist_items'] = f"{start}-{end}"
+    try:
+        info = ydl.extract_info(playlist_url, download=False)
+    finally:
+        ydl.params.pop('playlist_items', None)
+    return [
+        {'id': e['id'], 'title': e.get('title'), 'duration': e.get('duration') or 0}
+        for e in info.get('entries', []) if e and e.get('id')
+    ]
+
+# ======================================================
+# --- 子行程端 (process 模式) ---
+# ======================================================
+_process_opts = None
+_process_ydl = {}
+
+def _init_process_worker(ydl_opts):
+    global _process_opts
+    _process_opts = ydl_opts
+
+def _process_ping():
+    return True
+
+def _process_job(kind, func, args):
+    """在子行程裡跑提取工作：YoutubeDL 常駐在子行程中重複使用"""
+    ydl = _process_ydl.get(kind)
+    if ydl is None:
+        ydl = _process_ydl[kind] = yt_dlp.YoutubeDL(_process_opts[kind])
+    try:
+        return func(ydl, *args)
+    except Exception as e:
+        _process_ydl.pop(kind, None)
+        # yt-dlp 的例外不一定能 pickle 回主行程，統一轉成字串
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+# ======================================================
+# --- 常駐提取池 ---
+# ======================================================
+class ExtractorPool:
+    def __init__(self, ydl_opts, workers=4, max_pending=64, backend="thread"):
+        """⚙️ 常駐的 yt-dlp 提取池：每條執行緒各自保留暖機好的 YoutubeDL，依優先度排隊
+
+        backend="process" 時改由常駐子行程執行提取，避免 yt-dlp 佔住 GIL 讓語音傳送卡頓；
+        排隊與優先度仍由主行程的執行緒負責。
+        """
+        self.ydl_opts = {
+            'stream': dict(ydl_opts),
+            'flat': dict(ydl_opts, extract_flat=True),
+        }
+        self.workers = workers
+        self.max_pending = max_pending
+        self.backend = backend
+        self.jobs = queue.PriorityQueue()
+        self._order = itertools.count()
+        # 還沒開始的工作 (future -> job)；被 promote 過的工作在佇列裡有兩份，先拿到的那份才會執行
+        self._waiting = {}
+        self._queue_lock = threading.Lock()
+        self._local = threading.local()
+
+        # 📊 統計數據
+        self._stats_lock = threading.Lock()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_run = 0.0
+        self.restarts = 0
+
+        # 子行程一律從 forkserver 分出來：forkserver 是全新的單執行緒行程，
+        # 事件迴圈 / 語音 / SQLite 寫入執行緒都跑起來之後重建池子，也不會繼承到別人持有的鎖
+        self.processes = None
+        self._process_lock = threading.Lock()
+        self._mp_context = None
+        if backend == "process":
+            self._mp_context = multiprocessing.get_context("forkserver")
+            # forkserver 先載入 yt-dlp，之後分出來的子行程不用各自重新 import
+            self._mp_context.set_forkserver_preload(['yt_dlp', 'extractor_pool'])
+            self._start_processes()
+
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"spark-extract-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, kind, func, *args, priority=PRIORITY_NOW):
+        """排入一個提取工作，回傳可 await 的 Future；排隊太長時拒絕背景工作"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        ticket = _ticket.get()
+        if ticket is not None and ticket.urgent:
+            priority = PRIORITY_NOW
+        if priority > PRIORITY_INTERACTIVE and len(self._waiting) >= self.max_pending:
+            with self._stats_lock: self.rejected += 1
+            future.set_exception(RuntimeError("提取佇列已滿，略過背景工作"))
+            return future
+        if ticket is not None:
+            ticket.futures.append(future)
+        job = (loop, future, kind, func, args, time.monotonic())
+        with self._queue_lock:
+            self._waiting[future] = job
+            self.jobs.put((priority, next(self._order), job))
+        return future
+
+    def promote(self, ticket):
+        """這張號碼牌的結果馬上要用：還在排隊的工作以 PRIORITY_NOW 再排一份，之後送出的也一律 PRIORITY_NOW"""
+        ticket.urgent = True
+        with self._queue_lock:
+            for future in ticket.futures:
+                job = self._waiting.get(future)
+                if job:
+                    self.jobs.put((PRIORITY_NOW, next(self._order), job))
+
+    def _ydl(self, kind):
+        """取得這條執行緒專屬的 YoutubeDL (第一次用到才建立)"""
+        instances = getattr(self._local, 'instances', None)
+        if instances is None:
+            instances = self._local.instances = {}
+        if kind not in instances:
+            instances[kind] = yt_dlp.YoutubeDL(self.ydl_opts[kind])
+        return instances[kind]
+
+    def _start_processes(self):
+        """建立常駐子行程並等它們就緒 (第一次會順便啟動 forkserver，崩潰重建時沿用同一個)"""
+        self.processes = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._mp_context,
+            initializer=_init_process_worker,
+            initargs=(self.ydl_opts,)
+        )
+        self.processes.submit(_process_ping).result()
+
+    def _restart_processes(self, broken):
+        with self._process_lock:
+            # 可能已經被其他執行緒重建過了
+            if self.processes is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.restarts += 1
+            print(f"💥 yt-dlp 子行程崩潰，第 {self.restarts} 次重新啟動...")
+            self._start_processes()
+
+    def _run_in_process(self, kind, func, args):
+        """交給子行程執行；子行程崩潰就重建整個池子再試一次"""
+        for attempt in range(2):
+            pool = self.processes
+            try:
+                return pool.submit(_process_job, kind, func, args).result()
+            except BrokenProcessPool:
+                if attempt: raise
+                self._restart_processes(pool)
+
+    def _run_in_thread(self, kind, func, args):
+        try:
+            return func(self._ydl(kind), *args)
+        except Exception:
+            # 出錯的實例可能狀態不乾淨，丟掉下次重建
+            self._local.instances.pop(kind, None)
+            raise
+
+    def _worker(self):
+        while True:
+            _, _, job = self.jobs.get()
+            loop, future, kind, func, args, submitted = job
+            with self._queue_lock:
+                # 已經由另一份 (被 promote 的) 拿去做了
+                if self._waiting.pop(future, None) is None:
+                    continue
+            # 等待期間已逾時或被取消的工作就不用做了
+            if future.cancelled():
+                continue
+            started = time.monotonic()
+            with self._stats_lock: self.running += 1
+            try:
+                if self.backend == "process":
+                    result = self._run_in_process(kind, func, args)
+                else:
+                    result = self._run_in_thread(kind, func, args)
+                loop.call_soon_threadsafe(_resolve_future, future, result, None)
+                ok = True
+            except Exception as e:
+                loop.call_soon_threadsafe(_resolve_future, future, None, e)
+                ok = False
+            finished = time.monotonic()
+            with self._stats_lock:
+                self.running -= 1
+                if ok: self.completed += 1
+                else: self.failed += 1
+                self.total_wait += started - submitted
+                self.total_run += finished - started
+                self.max_run = max(self.max_run, finished - started)
+
+    def stats(self):
+        with self._stats_lock:
+            done = self.completed + self.failed
+            return {
+                'backend': self.backend,
+                'restarts': self.restarts,
+                'queued': len(self._waiting),
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'avg_wait': self.total_wait / done if done else 0.0,
+                'avg_run': self.total_run / done if done else 0.0,
+                'max_run': self.max_run,
+            }
+
+def _resolve_future(future, result, error):
+    if future.done(): return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
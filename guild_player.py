@@ -0,0 +1,390 @@
+import sys
+import time
+import asyncio
+import logging
+from track_queue import TrackQueue
+from audio_engine import GaplessSource, PreBufferedSource, TimedSource
+
+class GuildPlayer:
+    """🎛️ 一個伺服器的播放器
+
+    佇列 / 目前播放 / 上一首 / 循環模式 / 面板都掛在這個物件上。
+    換歌 (播完、無縫切換、有人點歌時開播) 一律丟進 mailbox，由單一個 actor 任務依序處理，
+    語音執行緒的 after 回呼、按鈕與指令不會同時推進佇列，也不會重複開播。
+    """
+    __slots__ = (
+        'cog', 'bot', 'guild_id', 'queue', 'current', 'last_played', 'loop_mode',
+        'channel_id', 'panel', 'lyrics_task', 'import_task', 'playlist_cursor',
+        'ended_at', 'generation', 'stale', 'mailbox', 'actor', 'saved_body'
+    )
+
+    def __init__(self, cog, guild_id):
+        self.cog = cog
+        self.bot = cog.bot
+        self.guild_id = guild_id
+        self.queue = TrackQueue()
+        self.current = None
+        self.last_played = None
+        self.loop_mode = 0           # 0: 關閉, 1: 單曲, 2: 清單
+        self.channel_id = None       # 面板所在的文字頻道
+        self.panel = None            # 目前的控制面板訊息
+        self.lyrics_task = None
+        self.import_task = None      # 📥 背景進行中的 Spotify 匯入
+        self.playlist_cursor = None  # 🎵 分段載入中的 YouTube 歌單
+        self.ended_at = None         # 上一首結束的時間 (量換歌空檔用)
+        self.generation = 0          # 每次 vc.play 加一，舊的 after 回呼就認得出來
+        self.stale = 0               # 略過的過期事件數
+        self.mailbox = asyncio.Queue()
+        self.actor = None
+        self.saved_body = None       # 上次存進去的佇列本體 (revision, 當時的 popped)
+
+    # --- 方便取用的屬性 ---
+    @property
+    def guild(self):
+        return self.bot.get_guild(self.guild_id)
+
+    @property
+    def vc(self):
+        guild = self.guild
+        return guild.voice_client if guild else None
+
+    @property
+    def channel(self):
+        return self.bot.get_channel(self.channel_id) if self.channel_id else None
+
+    def position(self):
+        """目前這首播到第幾秒 (由外層的 GaplessSource / TimedSource 計算)"""
+        vc = self.vc
+        if not vc or not (vc.is_playing() or vc.is_paused()):
+            return 0
+        return getattr(vc.source, 'elapsed', 0)
+
+    def peek_next(self):
+        """不動佇列，只看接下來會播哪一首"""
+        if self.loop_mode == 1 and self.current: return self.current
+        if self.queue: return self.queue[0]
+        if self.loop_mode == 2: return self.current
+        return None
+
+    # --- mailbox ---
+    def post(self, kind, *args):
+        """丟一則訊息給 actor，回傳處理完才完成的 Future"""
+        future = self.bot.loop.create_future()
+        self.mailbox.put_nowait((kind, args, future))
+        if self.actor is None or self.actor.done():
+            self.actor = self.bot.loop.create_task(self._run())
+        return future
+
+    def post_threadsafe(self, kind, *args):
+        """給語音執行緒用的版本 (after 回呼 / 無縫切換)"""
+        self.bot.loop.call_soon_threadsafe(self.post, kind, *args)
+
+    async def _run(self):
+        while True:
+            kind, args, future = await self.mailbox.get()
+            try:
+                await getattr(self, f"_on_{kind}")(*args)
+            except Exception as e:
+                await self.bot.dispatch_log(f"💥 [播放器崩潰] {e}", logging.ERROR, guild=self.guild_id, message=kind)
+            finally:
+                if not future.done():
+                    future.set_result(None)
+
+    def stop(self):
+        """停掉 actor (清理播放器時用)，還在排隊的訊息直接放行"""
+        if self.actor and not self.actor.done():
+            self.actor.cancel()
+        self.actor = None
+        while not self.mailbox.empty():
+            _, _, future = self.mailbox.get_nowait()
+            if not future.done():
+                future.set_result(None)
+
+    # --- actor 訊息處理 ---
+    async def _on_kick(self):
+        """有人點歌 / 匯入了新歌 / 重開機還原：閒置中才開播"""
+        vc = self.vc
+        if vc and vc.is_connected() and not vc.is_playing() and not vc.is_paused():
+            await self._advance()
+
+    async def _on_ended(self, generation, ended_at):
+        """after 回呼：只處理最新那次 vc.play 的結束"""
+        if generation != self.generation:
+            self.stale += 1
+            return
+        self.ended_at = ended_at
+        await self._advance()
+
+    async def _on_switch(self, generation, old_item, new_item, gap):
+        """無縫換歌後補做佇列推進，並更新面板"""
+        if generation != self.generation:
+            self.stale += 1
+            return
+        mode = self.loop_mode
+        if mode == 2 and old_item:
+            self.queue.append(old_item)
+        if mode != 1:
+            try: self.queue.remove(new_item)
+            except ValueError: pass
+        if old_item is not new_item:
+            self.last_played = old_item
+
+        new_item.played = True
+        self.current = new_item
+        audio = self.cog.audio
+        audio.record_gap(gap, gapless=True)
+        self.changed()
+        self.cog.maybe_extend_playlist(self)
+        if audio.cache:
+            audio.cache.note_play(new_item.source, looping=mode == 1)
+
+        s_title = new_item.clean_title or new_item.source['title']
+        await self.bot.dispatch_log(f"🎼 [無縫換歌] {s_title} (空檔 {gap * 1000:.0f} ms)", logging.DEBUG)
+        await self.cog.announce_track(self, new_item, new_item.source, reuse_panel=True)
+
+    # --- 換歌流程 ---
+    def _take_next(self):
+        """依循環模式取出下一首，目前這首記成上一首"""
+        current = self.current
+        if self.loop_mode == 1 and current:
+            next_item = current
+        elif self.loop_mode == 2 and current:
+            self.queue.append(current)
+            next_item = self.queue.popleft()
+        else:
+            next_item = self.queue.popleft() if self.queue else None
+        if current and next_item is not current:
+            self.last_played = current
+        # 下一首播起來之前沒有「目前播放」，解析失敗時不會一直重播同一首
+        self.current = None
+        return next_item
+
+    async def _advance(self):
+        """播下一首；解析失敗就繼續往下找，直到播起來或佇列見底"""
+        while True:
+            vc = self.vc
+            if not vc or not vc.is_connected():
+                return
+            current = self.current
+            item = self._take_next()
+            self.changed()
+            self.cog.maybe_extend_playlist(self)
+            if item is None:
+                self.ended_at = None
+                guild = self.guild
+                await self.bot.dispatch_log(f"🏁 [播放結束] {guild.name if guild else self.guild_id} 的隊列已播放完畢。")
+                return
+            if current and self.loop_mode == 1:
+                await self.bot.dispatch_log(f"🔂 [循環] 單曲循環啟動: {item.query}", logging.DEBUG)
+            elif current and self.loop_mode == 2:
+                await self.bot.dispatch_log(f"🔁 [循環] 清單循環運作中", logging.DEBUG)
+            try:
+                if await self._play(item):
+                    return
+            except Exception as e:
+                await self.bot.dispatch_log(f"💥 [播放任務崩潰] {e}", logging.ERROR, guild=self.guild_id, track=item.query)
+                # 發生錯誤時稍微等待，避免光速跳過整個歌單
+                await asyncio.sleep(2)
+
+    async def _play(self, item):
+        """建立音訊來源並開播，成功回傳 True"""
+        cog = self.cog
+        source_data = await cog.resolve_track(item)
+        if not source_data:
+            await self.bot.dispatch_log(f"❌ [播放異常] 無法獲取音訊來源", logging.WARNING, guild=self.guild_id, track=item.query)
+            return False
+        vc = self.vc
+        if not vc or not vc.is_connected():
+            # 解析途中被請出頻道，留著下次再播
+            self.queue.appendleft(item)
+            self.save()
+            return True
+
+        # 外面再包一層計時：無縫模式順便讓下一首可以直接接上
+        generation = self.generation + 1
+        start, item.resume_at = item.resume_at, 0
+        audio_source = await cog.audio.create_source(source_data, start=start)
+        if cog.gapless:
+            audio_source = GaplessSource(
+                audio_source, item,
+                on_switch=lambda old, new, gap: self.post_threadsafe('switch', generation, old, new, gap),
+                crossfade_frames=int(cog.crossfade * 50),
+                start=start
+            )
+        else:
+            audio_source = TimedSource(audio_source, start=start)
+
+        self.generation = generation
+        try:
+            vc.play(audio_source, after=lambda e: self.post_threadsafe('ended', generation, time.perf_counter()))
+        except Exception:
+            audio_source.cleanup()
+            raise
+        # 真的播起來才算「目前播放」：開音訊失敗時單曲循環不會一直重試同一首壞掉的歌
+        item.played = True
+        self.current = item
+        self.save()
+        if self.ended_at:
+            cog.audio.record_gap(time.perf_counter() - self.ended_at, gapless=False)
+            self.ended_at = None
+        if cog.audio.cache:
+            cog.audio.cache.note_play(source_data, looping=self.loop_mode == 1)
+        if cog.gapless:
+            self.bot.loop.create_task(self.gapless_prepare_task(vc, audio_source))
+
+        # 發送新面板並啟動歌詞同步 (面板失敗不影響已經開始的播放)
+        try:
+            await cog.announce_track(self, item, source_data, start=start)
+        except Exception as e:
+            await self.bot.dispatch_log(f"⚠️ [面板] 發送失敗: {e}", logging.WARNING)
+        return True
+
+    async def gapless_prepare_task(self, vc, wrapper):
+        """目前這首快結束時，先解析並預讀下一首，交給 GaplessSource 在邊界切換"""
+        cog = self.cog
+        lead = cog.gapless_lead + cog.crossfade
+        prepared_for = None
+        while vc.is_connected() and vc.source is wrapper:
+            item = wrapper.item
+            duration = item.duration
+            # 排好之後佇列又被打亂或跳轉，就重新準備
+            if prepared_for is item and wrapper.armed_item is not None and wrapper.armed_item is not self.peek_next():
+                prepared_for = None
+            if not duration or prepared_for is item:
+                await asyncio.sleep(1)
+                continue
+            remaining = duration - wrapper.elapsed
+            if remaining > lead:
+                await asyncio.sleep(min(remaining - lead, 5))
+                continue
+
+            next_item = self.peek_next()
+            if not next_item:
+                await asyncio.sleep(1)
+                continue
+            prepared_for = item
+            try:
+                source_data = await cog.resolve_track(next_item)
+                if not source_data:
+                    continue
+                upcoming = PreBufferedSource(await cog.audio.create_source(source_data))
+                await asyncio.to_thread(upcoming.fill, 25)
+            except Exception as e:
+                await self.bot.dispatch_log(f"⚠️ [無縫播放] 預先開啟下一首失敗: {e}", logging.WARNING)
+                continue
+            if vc.source is wrapper and wrapper.item is item and self.peek_next() is next_item:
+                wrapper.arm(upcoming, next_item)
+            else:
+                upcoming.cleanup()
+
+    # --- 佇列與背景任務 ---
+    def rewind(self):
+        """上一首：把上一首與目前這首排回最前面，有上一首才回傳 True"""
+        if not self.last_played:
+            return False
+        if self.current:
+            self.queue.appendleft(self.current)
+        self.queue.appendleft(self.last_played)
+        # 目前這首已經排回佇列，換歌時不要再依循環模式重播或重排一次
+        self.current = None
+        self.last_played = None
+        self.changed()
+        return True
+
+    def cancel_import(self):
+        """取消正在進行的背景匯入，有取消到回傳 True"""
+        task, self.import_task = self.import_task, None
+        if task and not task.done():
+            task.cancel()
+            return True
+        return False
+
+    def drop_playlist_cursor(self):
+        """清空或離開時停止分段載入歌單"""
+        cursor, self.playlist_cursor = self.playlist_cursor, None
+        if cursor and cursor.get('task') and not cursor['task'].done():
+            cursor['task'].cancel()
+
+    def clear(self):
+        """清空後面的歌，連同預先解析、匯入與歌單分段一起停掉"""
+        self.queue.clear()
+        self.cog.prefetcher.cancel(self.guild_id)
+        self.cancel_import()
+        self.drop_playlist_cursor()
+
+    def park(self):
+        """閒置斷線前：目前這首排回最前面並記下播到哪，之後有人點歌就從這裡接著播"""
+        if self.current:
+            self.current.resume_at = self.position()
+            self.queue.appendleft(self.current)
+            self.current = None
+        self.generation += 1
+
+    def reset(self):
+        """停止並離開：清空一切並刪掉存檔，還沒送達的結束事件一律視為過期"""
+        self.clear()
+        self.current = None
+        self.generation += 1
+        self.saved_body = None
+        self.cog.player_store.drop(self.guild_id)
+
+    # --- 存檔 ---
+    def changed(self):
+        """佇列有變動 (加歌/換歌/打亂/跳轉/循環模式)：重新排程預先解析、重新確認無縫接歌並存檔"""
+        self.cog.prefetcher.schedule(self.guild_id, self.queue)
+        vc = self.vc
+        if vc and isinstance(vc.source, GaplessSource):
+            # 在事件迴圈這邊比對，語音執行緒只看旗標，不會和佇列整理搶著讀
+            vc.source.expect(self.peek_next())
+        self.save()
+
+    def save(self):
+        """把目前的播放狀態交給背景存檔 (合併寫入，不阻塞事件迴圈)
+
+        佇列結構沒變 (只是從前面播掉幾首) 時不複製整個佇列，只存 queue_head。
+        """
+        store = self.cog.player_store
+        queue = self.queue
+        if not queue and not self.current:
+            self.saved_body = None
+            store.drop(self.guild_id)
+            return
+        if self.saved_body and self.saved_body[0] == queue.revision:
+            body, head = None, queue.popped - self.saved_body[1]
+        else:
+            body, head = list(queue), 0
+            self.saved_body = (queue.revision, queue.popped)
+        vc = self.vc
+        store.save(self.guild_id, {
+            'text_channel_id': self.channel_id,
+            'voice_channel_id': vc.channel.id if vc and vc.is_connected() else None,
+            'loop_mode': self.loop_mode,
+            'current': self.current,
+            'last_played': self.last_played,
+            'position': self.position(),
+            'queue': body,
+            'queue_head': head,
+            'queue_size': len(queue),
+        })
+
+    def restore(self, state):
+        """把存檔放回來：沒播完的那首排回最前面，從存檔的位置接著播"""
+        if not state:
+            return
+        self.queue.extend(state['queue'])
+        current = state['current']
+        if current:
+            current.resume_at = state['position']
+            self.queue.appendleft(current)
+        self.loop_mode = state['loop_mode']
+        self.last_played = self.last_played or state['last_played']
+        self.channel_id = self.channel_id or state['text_channel_id']
+        print(f"💾 已還原伺服器 {self.guild_id} 的播放狀態 ({len(self.queue)} 首)")
+
+    def memory_estimate(self):
+        """這個伺服器大約佔用的位元組數 (播放器本身 + 佇列 + 不在佇列裡的目前/上一首)"""
+        size = sys.getsizeof(self) + self.queue.memory_estimate()
+        for track in (self.current, self.last_played):
+            if track is not None and track._queue is not self.queue:
+                size += track.memory_estimate()
+        return size
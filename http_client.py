@@ -0,0 +1,61 @@
+import asyncio
+import aiohttp
+
+class HttpTransport:
+    def __init__(self, limit=32, limit_per_host=4, dns_ttl=300, keepalive=30, timeout=3):
+        """🌐 共用的非同步 HTTP 連線池 (aiohttp，discord.py 本來就有裝)
+
+        - 同一台主機的連線保持 keepalive 秒重複使用，不用每次重新 TCP + TLS 握手
+        - 每台主機最多 limit_per_host 條連線，全部最多 limit 條
+        - DNS 查詢結果快取 dns_ttl 秒
+        session 第一次用到才在事件迴圈裡建立。
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.session = None
+        self._lock = asyncio.Lock()
+
+        # 📊 統計數據
+        self.requests = 0
+        self.failures = 0
+
+    async def _session(self):
+        if self.session is None or self.session.closed:
+            async with self._lock:
+                if self.session is None or self.session.closed:
+                    connector = aiohttp.TCPConnector(
+                        limit=self.limit,
+                        limit_per_host=self.limit_per_host,
+                        ttl_dns_cache=self.dns_ttl,
+                        keepalive_timeout=self.keepalive
+                    )
+                    self.session = aiohttp.ClientSession(
+                        connector=connector,
+                        timeout=aiohttp.ClientTimeout(total=self.timeout)
+                    )
+        return self.session
+
+    async def get_json(self, url, params=None, headers=None):
+        """GET 並解析 JSON (不看 Content-Type，QQ 音樂回的是 text/plain)"""
+        session = await self._session()
+        self.requests += 1
+        try:
+            async with session.get(url, params=params, headers=headers) as resp:
+                resp.raise_for_status()
+                return await resp.json(content_type=None)
+        except Exception:
+            self.failures += 1
+            raise
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+        }
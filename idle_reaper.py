@@ -0,0 +1,203 @@
+import os
+import time
+import asyncio
+import resource
+
+def _rss_mb():
+    """目前的常駐記憶體 (Linux 讀 /proc，其他平台退回歷史最高值)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except Exception:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class IdleReaper:
+    def __init__(self, cog, interval=60, alone_minutes=5, idle_minutes=15, paused_minutes=120, state_minutes=60, chat_minutes=180):
+        """🧹 長時間運作的清道夫：定期巡一次所有伺服器
+
+        - 語音頻道只剩機器人 alone_minutes 分鐘 / 沒在播歌 idle_minutes 分鐘就斷線 (佇列留著，下次點歌接著播)
+        - 有人按了暫停不算閒置，另外等 paused_minutes 分鐘才斷線
+        - 斷線超過 state_minutes 分鐘的播放器從記憶體移除 (有歌的先存檔，用到再還原)
+        - 超過 chat_minutes 分鐘沒說話的使用者對話記憶丟掉
+        - 取消已經沒有語音連線的歌詞同步 / 預先解析任務
+        任何一項設成 0 就停用。每一輪都會印出記憶體與狀態大小摘要。
+        """
+        self.cog = cog
+        self.bot = cog.bot
+        self.interval = interval
+        self.alone_after = alone_minutes * 60
+        self.idle_after = idle_minutes * 60
+        self.paused_after = paused_minutes * 60
+        self.state_after = state_minutes * 60
+        self.chat_after = chat_minutes * 60
+        # 各伺服器從什麼時候開始「沒人 / 沒播歌 / 沒連線」(每輪只保留還成立的)
+        self.alone_since = {}
+        self.idle_since = {}
+        self.paused_since = {}
+        self.detached_since = {}
+
+        # 📊 統計數據
+        self.sweeps = 0
+        self.left_alone = 0
+        self.left_idle = 0
+        self.dropped_players = 0
+        self.dropped_chats = 0
+        self.cancelled_tasks = 0
+        self.last_summary = None
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"⚠️ 清道夫巡邏失敗: {e}")
+
+    async def sweep(self):
+        now = time.monotonic()
+        await self._sweep_voice(now)
+        await self._sweep_players(now)
+        self._sweep_tasks()
+        if self.chat_after:
+            self.dropped_chats += self.cog.ai.forget_idle(self.chat_after)
+        self.sweeps += 1
+        self.last_summary = self.summary()
+        s = self.last_summary
+        print(
+            f"🧹 [清道夫] RSS {s['rss_mb']:.0f} MB | 語音 {s['voice']} / 播放器 {s['players']} "
+            f"({s['tracks']} 首) / 待還原 {s['saved']} | "
+            f"對話 {s['chats']} 人 {s['chat_messages']} 則 | 任務 {s['tasks']}"
+        )
+
+    def _since(self, table, guild_id, condition, now):
+        """條件成立就記下 (或沿用) 開始時間並回傳持續了幾秒，不成立就清掉"""
+        if not condition:
+            table.pop(guild_id, None)
+            return 0
+        return now - table.setdefault(guild_id, now)
+
+    async def _sweep_voice(self, now):
+        connected = set()
+        for vc in list(self.bot.voice_clients):
+            guild_id = vc.guild.id
+            connected.add(guild_id)
+            alone = not any(not m.bot for m in vc.channel.members)
+            paused = vc.is_paused()
+            idle = not vc.is_playing() and not paused
+            alone_for = self._since(self.alone_since, guild_id, alone, now)
+            idle_for = self._since(self.idle_since, guild_id, idle, now)
+            paused_for = self._since(self.paused_since, guild_id, paused, now)
+            if self.alone_after and alone_for >= self.alone_after:
+                self.left_alone += 1
+                await self._leave(vc, f"頻道裡沒有人 {alone_for / 60:.0f} 分鐘")
+            elif self.idle_after and idle_for >= self.idle_after:
+                self.left_idle += 1
+                await self._leave(vc, f"閒置 {idle_for / 60:.0f} 分鐘")
+            elif self.paused_after and paused_for >= self.paused_after:
+                self.left_idle += 1
+                await self._leave(vc, f"暫停了 {paused_for / 60:.0f} 分鐘")
+        for table in (self.alone_since, self.idle_since, self.paused_since):
+            for guild_id in [g for g in table if g not in connected]:
+                del table[guild_id]
+
+    async def _leave(self, vc, reason):
+        """斷線但保留佇列：目前這首排回最前面，之後有人點歌就從原本的位置接著播"""
+        guild_id = vc.guild.id
+        player = self.cog.players.get(guild_id)
+        if player:
+            player.park()
+            if player.panel:
+                try: await player.panel.delete()
+                except: pass
+                player.panel = None
+        try:
+            await vc.disconnect()
+        except Exception as e:
+            print(f"⚠️ 清道夫斷線失敗 ({guild_id}): {e}")
+        if player:
+            player.save()
+        self.alone_since.pop(guild_id, None)
+        self.idle_since.pop(guild_id, None)
+        self.paused_since.pop(guild_id, None)
+        await self.bot.dispatch_log(f"🧹 [清道夫] {vc.guild.name} {reason}，艾瑪先離開語音頻道")
+
+    async def _sweep_players(self, now):
+        """斷線太久的播放器移出記憶體，有歌的先寫進存檔，下次用到時再由 get_player 還原"""
+        if not self.state_after:
+            return
+        cog = self.cog
+        dropped = []
+        for guild_id, player in list(cog.players.items()):
+            vc = player.vc
+            detached = not vc or not vc.is_connected()
+            if self._since(self.detached_since, guild_id, detached, now) < self.state_after:
+                continue
+            del cog.players[guild_id]
+            del self.detached_since[guild_id]
+            player.stop()
+            player.cancel_import()
+            player.drop_playlist_cursor()
+            cog.prefetcher.cancel(guild_id)
+            if player.lyrics_task and not player.lyrics_task.done():
+                player.lyrics_task.cancel()
+            if player.queue or player.current:
+                player.save()
+                dropped.append((guild_id, player))
+            self.dropped_players += 1
+        for guild_id in [g for g in self.detached_since if g not in cog.players]:
+            del self.detached_since[guild_id]
+        if not dropped:
+            return
+        # 先寫進資料庫，get_player 讀存檔時才拿得到最新的佇列
+        await asyncio.to_thread(cog.player_store.flush)
+        for guild_id, player in dropped:
+            if guild_id not in cog.players:
+                cog.saved_players[guild_id] = {
+                    'guild_id': guild_id, 'text_channel_id': player.channel_id, 'voice_channel_id': None,
+                    'playing': False, 'queue_size': len(player.queue) + (1 if player.current else 0)
+                }
+
+    def _sweep_tasks(self):
+        """取消沒有語音連線還在跑的背景任務"""
+        cog = self.cog
+        for player in cog.players.values():
+            task = player.lyrics_task
+            vc = player.vc
+            if task and not task.done() and (not vc or not vc.is_connected()):
+                task.cancel()
+                player.lyrics_task = None
+                self.cancelled_tasks += 1
+        for guild_id in list(cog.prefetcher.tasks):
+            player = cog.players.get(guild_id)
+            if not player or not player.vc:
+                cog.prefetcher.cancel(guild_id)
+                self.cancelled_tasks += 1
+
+    def summary(self):
+        """每輪都會跑，只放便宜的計數；逐首估記憶體留給 /stats"""
+        cog = self.cog
+        players = list(cog.players.values())
+        history = cog.ai.chat_history
+        return {
+            'rss_mb': _rss_mb(),
+            'voice': len(self.bot.voice_clients),
+            'players': len(players),
+            'tracks': sum(len(p.queue) for p in players),
+            'saved': len(cog.saved_players),
+            'chats': len(history),
+            'chat_messages': sum(len(h) for h in history.values()),
+            'tasks': len(asyncio.all_tasks()),
+        }
+
+    def stats(self):
+        return {
+            'sweeps': self.sweeps,
+            'left_alone': self.left_alone,
+            'left_idle': self.left_idle,
+            'dropped_players': self.dropped_players,
+            'dropped_chats': self.dropped_chats,
+            'cancelled_tasks': self.cancelled_tasks,
+            'summary': self.last_summary,
+        }
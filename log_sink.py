@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import datetime
+
+DISCORD_LIMIT = 2000
+
+class LogSink:
+    def __init__(self, bot, channel_id, interval=3.0, capacity=500, min_level=logging.INFO):
+        """📜 Log 頻道的批次出口
+
+        dispatch_log 只把紀錄丟進有上限的佇列就返回 (終端機照樣立刻印出)，
+        背景任務每 interval 秒把累積的紀錄合併成一則訊息送到 Log 頻道，超過 2000 字就分段。
+        佇列滿了先丟 WARNING 以下的紀錄，警告以上擠掉佇列裡等級最低的一筆；低於 min_level 的只印在終端機。
+        """
+        self.bot = bot
+        self.channel_id = channel_id
+        self.interval = interval
+        self.min_level = min_level
+        self.queue = asyncio.Queue(maxsize=capacity)
+        self.batch = []  # run() 已經從佇列拿出來、正在等著合併送出的紀錄
+
+        # 📊 統計數據
+        self.emitted = 0
+        self.dropped = 0
+        self.batches = 0
+        self.messages = 0
+        self.failed = 0
+
+    def emit(self, content, level=logging.INFO, **fields):
+        """記一筆紀錄 (不等待任何網路請求)"""
+        stamp = datetime.datetime.now().strftime("%H:%M:%S")
+        tag = "" if level == logging.INFO else f"[{logging.getLevelName(level)}] "
+        extra = "".join(f" {k}={v}" for k, v in fields.items())
+        print(f"[{stamp}] {tag}{content}{extra}")
+        if level < self.min_level:
+            return
+        self.emitted += 1
+        entry = (stamp, level, content, fields)
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            # 滿了：一般紀錄直接丟掉，警告以上擠掉等級最低 (同等級取最舊) 的一筆，不會拿 ERROR 換 WARNING
+            self.dropped += 1
+            if level < logging.WARNING:
+                return
+            entries = self._drain()
+            victim = min(range(len(entries)), key=lambda i: entries[i][1])
+            if entries[victim][1] > level:
+                victim = None
+            for i, queued in enumerate(entries):
+                if i != victim:
+                    self.queue.put_nowait(queued)
+            if victim is not None:
+                self.queue.put_nowait(entry)
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+        while True:
+            self.batch = [await self.queue.get()]
+            # 等一個批次的時間，讓這段期間的紀錄合併成同一則訊息
+            await asyncio.sleep(self.interval)
+            entries, self.batch = self.batch + self._drain(), []
+            if entries:
+                await self._send(entries)
+
+    def _drain(self):
+        entries = []
+        while not self.queue.empty():
+            entries.append(self.queue.get_nowait())
+        return entries
+
+    async def flush(self):
+        """關機前把還沒送出的紀錄送完 (包括 run() 手上等著合併的那批)"""
+        entries, self.batch = self.batch + self._drain(), []
+        if entries:
+            await self._send(entries)
+
+    async def _send(self, entries):
+        channel = self.bot.get_channel(self.channel_id)
+        if not channel:
+            return
+        self.batches += 1
+        for chunk in self._chunks(entries):
+            try:
+                await self.bot.editor.acquire(self.channel_id)
+                await channel.send(chunk)
+                self.messages += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Log 頻道發送失敗: {e}")
+
+    def _chunks(self, entries):
+        """把紀錄排成一行一筆，每則訊息不超過 Discord 的 2000 字"""
+        chunk = ""
+        for stamp, level, content, fields in entries:
+            tag = "" if level == logging.INFO else f"**{logging.getLevelName(level)}** "
+            extra = "".join(f" `{k}={v}`" for k, v in fields.items())
+            line = f"`[{stamp}]` {tag}{content}{extra}"
+            if len(line) > DISCORD_LIMIT:
+                line = line[:DISCORD_LIMIT - 1] + "…"
+            if chunk and len(chunk) + 1 + len(line) > DISCORD_LIMIT:
+                yield chunk
+                chunk = ""
+            chunk = f"{chunk}\n{line}" if chunk else line
+        if chunk:
+            yield chunk
+
+    def stats(self):
+        return {
+            'emitted': self.emitted,
+            'dropped': self.dropped,
+            'queued': self.queue.qsize(),
+            'batches': self.batches,
+            'messages': self.messages,
+            'failed': self.failed,
+        }
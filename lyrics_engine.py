@@ -1,25 +1,227 @@
+import time
+import json
+import zlib
 import asyncio
-import requests
 import re
 import html
 import difflib
+import threading
+from collections import OrderedDict
 from pykakasi import kakasi
 from concurrent.futures import ThreadPoolExecutor
+from http_client import HttpTransport
+from storage import SQLiteStore
+
+# 各歌詞來源的 API 位址 (離線測試時可以整組換成本機的假伺服器)
+DEFAULT_ENDPOINTS = {
+    'qq_search': "https://c.y.qq.com/soso/fcgi-bin/client_search_cp",
+    'qq_lyric': "https://c.y.qq.com/lyric/fcgi-bin/fcg_query_lyric_new.fcg",
+    'netease_search': "https://music.163.com/api/search/get",
+    'netease_lyric': "https://music.163.com/api/song/lyric",
+}
+
+# LRC 解析用的預先編譯正規式 (整份歌詞一次 findall，不再逐行 re.search)：
+# 行首的時間標籤可以連續好幾個 ([00:12.00][01:45.00]副歌)，
+# 逐字歌詞 (enhanced LRC) 的時間寫在 <mm:ss.xx>，[offset:+/-毫秒] 整份歌詞提前 / 延後。
+# 行首容許空白與 BOM，文字不吃進 \r (Windows 換行的 LRC 才不會把 \r 帶進歌詞與逐字片段)
+LRC_LINE = re.compile(r'^[ \t\ufeff]*\[(\d+):(\d+(?:\.\d+)?)\]((?:\[\d+:\d+(?:\.\d+)?\])*)([^\r\n]*)', re.MULTILINE)
+LRC_TIME_TAG = re.compile(r'\[(\d+):(\d+(?:\.\d+)?)\]')
+LRC_WORD = re.compile(r'<(\d+):(\d+(?:\.\d+)?)>([^<\r\n]*)')
+LRC_OFFSET = re.compile(r'^[ \t\ufeff]*\[offset:\s*([+-]?\d+)\s*\]', re.MULTILINE | re.IGNORECASE)
+
+def parse_lrc(lrc_content):
+    """LRC 解析，回傳依時間排好的平行陣列 (times, lines, words)，可以直接拿去 bisect
+
+    - 一行有好幾個時間標籤就在每個時間點各放一句
+    - [offset:] 套用到所有時間 (正值 = 提早顯示)
+    - 逐字時間 <mm:ss.xx> 從文字裡拿掉，放進 words[i] = [(秒, 字), ...] (沒有就是 None)
+    - 同一個時間點出現兩次時保留後面那句；空白行 (間奏標記) 略過
+    """
+    if not lrc_content:
+        return None
+    if '&' in lrc_content:
+        lrc_content = html.unescape(lrc_content)
+    meta = LRC_OFFSET.search(lrc_content)
+    # 偏移在解析時就一起扣掉，不用事後再整份重算
+    base = -int(meta.group(1)) / 1000 if meta else 0.0
+    entries = {}
+    for m, sec, more, text in LRC_LINE.findall(lrc_content):
+        words = None
+        if '<' in text:
+            found = LRC_WORD.findall(text)
+            if found:
+                words = [(int(wm) * 60 + float(ws) + base, w) for wm, ws, w in found]
+                text = text[:text.index('<')] + "".join([w for _, _, w in found])
+        text = text.strip()
+        if not text:
+            continue
+        entries[int(m) * 60 + float(sec) + base] = (text, words)
+        if more:
+            for m, sec in LRC_TIME_TAG.findall(more):
+                entries[int(m) * 60 + float(sec) + base] = (text, words)
+    if not entries:
+        return None
+
+    times = sorted(entries)
+    lines = [entries[t][0] for t in times]
+    words = [entries[t][1] for t in times]
+    # 提早顯示可能讓開頭幾句變成負的，排序後只要修前面那一段
+    i = 0
+    while i < len(times) and times[i] < 0:
+        times[i] = 0.0
+        i += 1
+    return times, lines, words
+
+class LyricsCache:
+    def __init__(self, max_entries=500, max_disk_entries=20000, miss_ttl=12 * 3600):
+        """📖 歌詞快取：記憶體 LRU + SQLite 落地
+
+        key 有兩種：正規化後的標題 (t:...) 與來源的歌曲 ID (qq:songmid / netease:id)。
+        存的是合併好 (原文 + 拼音 + 翻譯) 的時間軸，落地時壓成 zlib(JSON) 省空間。
+        找不到歌詞的標題也記一筆 (data 為空)，miss_ttl 秒內不再重查。
+        """
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.miss_ttl = miss_ttl
+        self.entries = OrderedDict()  # key -> ((times, lines)，空的 () 代表確定找不到, fetched_at)
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._writes = 0
+        self.store = SQLiteStore("lyrics.db", """
+            CREATE TABLE IF NOT EXISTS lyrics (
+                key TEXT PRIMARY KEY,
+                data BLOB,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_lyrics_last_used ON lyrics(last_used);
+        """)
+
+    @staticmethod
+    def _pack(timeline):
+        times, lines = timeline
+        return zlib.compress(json.dumps([times, lines], ensure_ascii=False, separators=(',', ':')).encode())
+
+    @staticmethod
+    def _unpack(blob):
+        times, lines = json.loads(zlib.decompress(blob))
+        return times, lines
+
+    def _alive(self, data, fetched_at):
+        return bool(data) or time.time() - fetched_at < self.miss_ttl
+
+    async def get(self, key, count=True):
+        """回傳時間軸 (times, lines)；() = 確定找不到；None = 沒有快取 (或找不到的紀錄已過期)
+
+        記憶體沒有才到執行緒裡讀 SQLite (不卡事件迴圈)。count=False 只是探查 (歌曲 ID / 多個標題逐一比對)，不算進命中率，由呼叫端用 record() 算一次。
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            rows = await self.store.aquery("SELECT data, fetched_at FROM lyrics WHERE key = ?", (key,))
+            if rows:
+                entry = (self._unpack(rows[0][0]) if rows[0][0] else (), rows[0][1])
+                if self._alive(*entry):
+                    self.store.defer("UPDATE lyrics SET last_used = ? WHERE key = ?", (time.time(), key))
+        if entry and self._alive(*entry):
+            self._remember(key, entry)
+            if count: self.record(entry[0])
+            return entry[0]
+
+        self.entries.pop(key, None)
+        if count: self.record(None)
+        return None
+
+    def record(self, data):
+        """記一次查詢結果 (get 的回傳值) 到命中率統計"""
+        if data:
+            self.hits += 1
+        elif data is not None:
+            self.negative_hits += 1
+        else:
+            self.misses += 1
+
+    def put(self, keys, timeline):
+        """同一份歌詞掛在多個 key 底下 (各種標題 + 歌曲 ID)；timeline 給 None 表示找不到"""
+        keys = [k for k in dict.fromkeys(keys) if k]
+        if not keys:
+            return
+        now = time.time()
+        entry = (timeline or (), now)
+        blob = self._pack(timeline) if timeline else None
+        for key in keys:
+            self._remember(key, entry)
+        self.store.defer_many(
+            "INSERT OR REPLACE INTO lyrics (key, data, fetched_at, last_used) VALUES (?, ?, ?, ?)",
+            [(key, blob, now, now) for key in keys]
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune_disk()
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _prune_disk(self):
+        """刪掉過期的「找不到」紀錄，再依最後使用時間砍到上限以內"""
+        self.store.defer("DELETE FROM lyrics WHERE data IS NULL AND fetched_at < ?", (time.time() - self.miss_ttl,))
+        self.store.defer(
+            "DELETE FROM lyrics WHERE key IN (SELECT key FROM lyrics ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def stats(self):
+        total = self.hits + self.negative_hits + self.misses
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.negative_hits) / total if total else 0.0,
+            'memory_entries': len(self.entries),
+        }
 
 class LyricsEngine:
-    def __init__(self):
+    def __init__(self, race=True, stagger=0.3, transport=None, endpoints=None, cache=None,
+                 romaji_memo=5000, precompute_slots=2):
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
         }
         self._kks = kakasi()
+        # kakasi 不是執行緒安全的：整首歌一次批次轉換，同一時間只有一個執行緒在用
+        self._kks_lock = threading.Lock()
+        # 🈁 整個行程共用的「一句歌詞 → 拼音」備忘 (副歌、別的伺服器點同一首都不用再轉)
+        self.romaji_memo = OrderedDict()
+        self.romaji_memo_size = romaji_memo
+        self.romaji_hits = 0
+        self.romaji_converted = 0
+        # 🌐 所有來源共用一個連線池；transport 只要有 get_json(url, params, headers) / close() / stats() 就能替換
+        self.http = transport or HttpTransport()
+        self.endpoints = dict(DEFAULT_ENDPOINTS, **(endpoints or {}))
+        # 📖 查過的歌詞 (包含找不到的) 記下來，循環播放 / 別的伺服器點同一首就不用再查
+        self.cache = cache or LyricsCache()
         # 🎀 建立執行緒池處理 CPU 密集型運算 (kakasi 和 difflib)
         self.executor = ThreadPoolExecutor(max_workers=4)
+        # 🏁 競速模式：所有來源與標題組合依序錯開 stagger 秒同時查詢，第一個可信的結果勝出
+        self.race = race
+        self.stagger = stagger
+        self.providers = {'qq': self._try_qq, 'netease': self._try_netease}
+        # 同一首歌正在查的話直接等那一份結果 (預先查詢 / 多個伺服器同時點)
+        self.inflight = {}
+        # 🎯 替佇列接下來的歌預先查歌詞 + 轉拼音，同時最多 precompute_slots 首
+        self._precompute_slots = asyncio.Semaphore(precompute_slots)
+        self.precomputed = 0
+        self.provider_stats = {name: {
+            'launched': 0, 'found': 0, 'wins': 0, 'misses': 0, 'errors': 0, 'cancelled': 0, 'completed': 0, 'latency': 0.0
+        } for name in self.providers}
 
     def _has_japanese(self, text):
         return bool(re.search(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', text))
 
     def _to_romaji_sync(self, text):
-        """同步的羅馬拼音轉換 (在 executor 裡跑)"""
+        """同步的羅馬拼音轉換 (在 executor 裡跑，呼叫端要拿著 _kks_lock)"""
         if not text or not self._has_japanese(text): return None
         try:
             result = self._kks.convert(text)
@@ -28,6 +230,26 @@ class LyricsEngine:
             return f"-# {romaji}" if romaji else None
         except: return None
 
+    def _to_romaji_batch_sync(self, texts):
+        """一首歌的所有句子一次轉完：相同的句子只轉一次，轉過的從備忘裡拿"""
+        memo = self.romaji_memo
+        out = {}
+        with self._kks_lock:
+            for text in dict.fromkeys(texts):
+                if not self._has_japanese(text):
+                    out[text] = None
+                    continue
+                if text in memo:
+                    memo.move_to_end(text)
+                    out[text] = memo[text]
+                    self.romaji_hits += 1
+                    continue
+                out[text] = memo[text] = self._to_romaji_sync(text)
+                self.romaji_converted += 1
+            while len(memo) > self.romaji_memo_size:
+                memo.popitem(last=False)
+        return [out[text] for text in texts]
+
     def clean_search_query(self, query):
         if not query: return ""
         query = re.sub(r'\(.*?\)|\[.*?\]|【.*?】', '', query)
@@ -46,125 +268,279 @@ class LyricsEngine:
         logs.append(f"📊 標題比對: {ratio:.2f} (門檻: {threshold}) -> `{candidate}`")
         return ratio >= threshold
 
-    def parse_lrc(self, lrc_content):
-        lyric_dict = {}
-        if not lrc_content: return None
-        clean_content = html.unescape(lrc_content)
-        for line in clean_content.split('\n'):
-            match = re.search(r'\[(\d{2}):(\d{2})(?:\.(\d{2,3}))?\](.*)', line)
-            if match:
-                m, s = int(match.group(1)), int(match.group(2))
-                ms_val = match.group(3)
-                ms = int(ms_val) if ms_val else 0
-                if ms_val and len(ms_val) == 2: ms *= 10
-                total_sec = m * 60 + s + (ms / 1000.0)
-                text = match.group(4).strip()
-                if text: lyric_dict[total_sec] = text
-        return lyric_dict if lyric_dict else None
+    parse_lrc = staticmethod(parse_lrc)
 
     async def _merge_lyrics_async(self, original, translated):
-        """✨ 核心改動：將羅馬拼音轉換丟到執行緒池，不卡住主迴圈"""
+        """✨ 核心改動：將羅馬拼音轉換丟到執行緒池，不卡住主迴圈
+        回傳合併後的 (times, lines)，翻譯依相同的時間點對上原文"""
         if not original: return None
         loop = asyncio.get_event_loop()
-        merged = {}
-
-        # 收集所有的轉換任務
-        tasks = []
-        timestamps = list(original.keys())
-
-        for timestamp in timestamps:
-            text = original[timestamp]
-            # 將 CPU 運算丟進 ThreadPool
-            tasks.append(loop.run_in_executor(self.executor, self._to_romaji_sync, text))
+        times, texts, _ = original
+        trans_by_time = dict(zip(translated[0], translated[1])) if translated else {}
 
-        # 等待所有轉換完成
-        romajis = await asyncio.gather(*tasks)
-
-        for i, timestamp in enumerate(timestamps):
-            text = original[timestamp]
-            romaji = romajis[i]
+        # 整首歌丟一個工作進 ThreadPool 批次轉換 (沒有日文就不用排隊)
+        if any(self._has_japanese(text) for text in texts):
+            romajis = await loop.run_in_executor(self.executor, self._to_romaji_batch_sync, texts)
+        else:
+            romajis = [None] * len(texts)
 
+        lines = []
+        for timestamp, text, romaji in zip(times, texts, romajis):
             line_content = f"{text}"
             if romaji: line_content += f"\n{romaji}"
 
-            trans_text = translated.get(timestamp) if translated else None
+            trans_text = trans_by_time.get(timestamp)
             if trans_text and trans_text != text:
                 line_content += f"\n*{trans_text}*"
-            merged[timestamp] = line_content
-        return merged
+            lines.append(line_content)
+        return list(times), lines
+
+    def title_key(self, title):
+        """標題正規化成快取 key (去掉 MV / 括號等雜訊、忽略大小寫與空白)"""
+        cleaned = "".join(self.clean_search_query(title or "").lower().split())
+        return f"t:{cleaned}" if cleaned else None
+
+    async def cached_lyrics(self, spotify_title=None, youtube_title=None, count=True):
+        """只查快取：時間軸 (times, lines) / () = 確定找不到 / None = 還沒查過，要上網找
 
-    async def get_dynamic_lyrics(self, spotify_title=None, youtube_title=None):
-        """✨ 核心改動：改為 async 函式"""
+        兩個標題不管查了幾個 key，命中率只算這一次 (count=False 則完全不算，給預先查詢與重複確認用)。
+        """
+        keys = [self.title_key(spotify_title), self.title_key(youtube_title)]
+        keys = [k for k in dict.fromkeys(keys) if k]
+        negative = 0
+        result = None
+        for key in keys:
+            data = await self.cache.get(key, count=False)
+            if data:
+                result = data
+                break
+            if data is not None:
+                negative += 1
+        else:
+            result = () if keys and negative == len(keys) else None
+        if count and keys:
+            self.cache.record(result)
+        return result
+
+    async def get_dynamic_lyrics(self, spotify_title=None, youtube_title=None, count=True):
+        """✨ 先看快取；沒有再依序 (或競速) 嘗試 QQ / 網易雲 × Spotify 標題 / YT 標題，勝出的那份才做拼音合併
+
+        呼叫端已經用 cached_lyrics 算過這次查詢的話傳 count=False，避免同一次查詢記兩次。
+        """
         current_logs = []
+        cached = await self.cached_lyrics(spotify_title, youtube_title, count=count)
+        if cached:
+            current_logs.append(f"💾 歌詞快取命中 ({len(cached[0])} 句)")
+            return cached, current_logs
+        if cached is not None:
+            current_logs.append("💾 快取記錄這首找不到歌詞，暫時不重查")
+            return None, current_logs
+
+        key = self.title_key(spotify_title) or self.title_key(youtube_title)
+        if not key:
+            return None, current_logs
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.get_running_loop().create_task(
+                self._search(spotify_title, youtube_title, current_logs))
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # shield：聽歌的人切歌時查到一半的結果照樣寫進快取，下次直接用
+        return await asyncio.shield(task)
 
+    async def precompute(self, spotify_title=None, youtube_title=None):
+        """佇列裡的歌先查好歌詞並轉好拼音 (結果進快取，輪到它播時直接顯示)"""
+        # 背景預先查詢不是聽歌的人在查，不算進命中率
+        if await self.cached_lyrics(spotify_title, youtube_title, count=False) is not None:
+            return
+        async with self._precompute_slots:
+            try:
+                data, _ = await self.get_dynamic_lyrics(spotify_title, youtube_title, count=False)
+            except Exception as e:
+                print(f"⚠️ 預先查歌詞失敗 ({spotify_title}): {e}")
+                return
+            if data:
+                self.precomputed += 1
+
+    async def _search(self, spotify_title, youtube_title, current_logs):
+        candidates = []
         if spotify_title:
             current_logs.append(f"🔍 [第一輪] 嘗試 Spotify 標題: `{spotify_title}`")
-            # 這裡需要 await
-            res = await self._try_qq(spotify_title, current_logs) or await self._try_netease(spotify_title, current_logs)
-            if res:
-                current_logs.append("✅ 成功匹配歌詞！")
-                return res, current_logs
-
+            candidates += [(name, spotify_title) for name in self.providers]
         if youtube_title:
             target_yt = self.clean_search_query(youtube_title)
-            current_logs.append(f"🔍 [第二輪] 啟動 YT 備援搜尋: `{target_yt}`")
-            res = await self._try_qq(target_yt, current_logs) or await self._try_netease(target_yt, current_logs)
-            if res:
-                current_logs.append("✅ 成功匹配歌詞！")
-                return res, current_logs
+            if target_yt and target_yt != spotify_title:
+                current_logs.append(f"🔍 [第二輪] 啟動 YT 備援搜尋: `{target_yt}`")
+                candidates += [(name, target_yt) for name in self.providers]
+
+        # 連線失敗 / 被取消的查詢不算「確定找不到」，這種情況不寫負面快取
+        errors = []
+        if self.race:
+            won = await self._race(candidates, current_logs, errors)
+        else:
+            won = None
+            for name, title in candidates:
+                result = await self._attempt(name, title, current_logs, errors)
+                if result:
+                    won = (name, title, result)
+                    break
+
+        title_keys = [self.title_key(spotify_title), self.title_key(youtube_title)]
+        if won:
+            name, title, (parsed, trans, song_key) = won
+            self.provider_stats[name]['wins'] += 1
+            if parsed is None:
+                # 別的標題查過同一首歌，直接沿用合併好的時間軸
+                merged = await self.cache.get(song_key, count=False)
+                current_logs.append(f"✅ 成功匹配歌詞！({name}: `{title}`，沿用快取)")
+            else:
+                merged = await self._merge_lyrics_async(parsed, trans)
+                current_logs.append(f"✅ 成功匹配歌詞！({name}: `{title}`)")
+            if merged:
+                self.cache.put(title_keys + [song_key], merged)
+                return merged, current_logs
 
         current_logs.append("❌ 遺憾...無法找到匹配的動態歌詞。")
+        if not won and not errors and candidates:
+            self.cache.put(title_keys, None)
         return None, current_logs
 
+    async def _attempt(self, name, title, logs, errors):
+        """跑一個來源並記下耗時與結果 (來源回傳 False 代表連線失敗，記進 errors)"""
+        stat = self.provider_stats[name]
+        stat['launched'] += 1
+        started = time.perf_counter()
+        try:
+            result = await self.providers[name](title, logs)
+        except asyncio.CancelledError:
+            stat['cancelled'] += 1
+            raise
+        stat['completed'] += 1
+        stat['latency'] += time.perf_counter() - started
+        # 有結果不代表勝出 (競速時可能比別人晚到)，wins 由 _search 對真正採用的那份記
+        stat['found' if result else 'misses'] += 1
+        if result is False:
+            stat['errors'] += 1
+            errors.append(name)
+        return result
+
+    async def _race(self, candidates, logs, errors):
+        """依優先順序每隔 stagger 秒多開一個查詢，前面的落空就立刻補上下一個；
+        第一個通過標題比對並拿到歌詞的勝出，其餘取消"""
+        loop = asyncio.get_running_loop()
+        waiting = list(enumerate(candidates))
+        running = {}
+        try:
+            while waiting or running:
+                if waiting:
+                    order, (name, title) = waiting.pop(0)
+                    running[loop.create_task(self._attempt(name, title, logs, errors))] = (order, name, title)
+                done, _ = await asyncio.wait(
+                    running, timeout=self.stagger if waiting else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                # 同時完成的話照優先順序挑
+                for task in sorted(done, key=lambda t: running[t][0]):
+                    order, name, title = running.pop(task)
+                    if task.exception():
+                        errors.append(name)
+                        continue
+                    result = task.result()
+                    if result:
+                        return name, title, result
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+
+    def romaji_stats(self):
+        total = self.romaji_hits + self.romaji_converted
+        return {
+            'converted': self.romaji_converted,
+            'hits': self.romaji_hits,
+            'hit_rate': self.romaji_hits / total if total else 0.0,
+            'memo_entries': len(self.romaji_memo),
+            'precomputed': self.precomputed,
+        }
+
+    def stats(self):
+        """各歌詞來源的勝率與平均耗時"""
+        return {name: {
+            'launched': st['launched'],
+            'wins': st['wins'],
+            'late': st['found'] - st['wins'],  # 有找到歌詞但別的來源先勝出
+            'cancelled': st['cancelled'],
+            'errors': st['errors'],
+            'win_rate': st['wins'] / st['launched'] if st['launched'] else 0.0,
+            'avg_latency': st['latency'] / st['completed'] if st['completed'] else 0.0,
+        } for name, st in self.provider_stats.items()}
+
     async def _try_qq(self, target_name, logs):
+        """回傳 (原文, 翻譯, 歌曲 key)；這首已經在快取裡就回傳 (None, None, key) 不再抓歌詞。
+        找不到 / 比對不過回傳 None，連線或格式錯誤回傳 False"""
         loop = asyncio.get_event_loop()
+        headers = dict(self.headers, Referer="https://y.qq.com/")
         try:
             search_query = self.clean_search_query(target_name)
-            # 將同步請求丟進 executor
-            res = await loop.run_in_executor(None, lambda: requests.get(
-                "https://c.y.qq.com/soso/fcgi-bin/client_search_cp",
+            res = await self.http.get_json(
+                self.endpoints['qq_search'],
                 params={"w": search_query, "format": "json", "n": 1},
-                headers={"Referer": "https://y.qq.com/"}, timeout=3).json())
+                headers=headers)
 
-            song = res.get('data', {}).get('song', {}).get('list', [])[0]
+            songs = res.get('data', {}).get('song', {}).get('list', [])
+            if not songs: return None
+            song = songs[0]
             res_title = f"{song.get('singer', [{}])[0].get('name')} {song.get('songname')}"
 
             # 這裡的比對也要丟進 executor，避免長字串比對卡死
             trustworthy = await loop.run_in_executor(self.executor, self._is_trustworthy_sync, target_name, res_title, logs)
             if not trustworthy: return None
 
-            l_res = await loop.run_in_executor(None, lambda: requests.get(
-                "https://c.y.qq.com/lyric/fcgi-bin/fcg_query_lyric_new.fcg",
+            song_key = f"qq:{song.get('songmid')}"
+            if await self.cache.get(song_key, count=False):
+                return None, None, song_key
+
+            l_res = await self.http.get_json(
+                self.endpoints['qq_lyric'],
                 params={"songmid": song.get('songmid'), "format": "json", "nobase64": 1, "platform": "yqq.json"},
-                headers={"Referer": "https://y.qq.com/"}, timeout=3).json())
+                headers=headers)
 
             parsed = self.parse_lrc(l_res.get('lyric'))
             if parsed:
-                return await self._merge_lyrics_async(parsed, self.parse_lrc(l_res.get('trans')))
+                return parsed, self.parse_lrc(l_res.get('trans')), song_key
             return None
-        except: return None
+        except Exception: return False
 
     async def _try_netease(self, target_name, logs):
+        """回傳格式同 _try_qq"""
         loop = asyncio.get_event_loop()
         try:
             search_query = self.clean_search_query(target_name)
-            res = await loop.run_in_executor(None, lambda: requests.get(
-                "https://music.163.com/api/search/get",
-                params={"s": search_query, "type": 1, "limit": 1}, timeout=3).json())
+            res = await self.http.get_json(
+                self.endpoints['netease_search'],
+                params={"s": search_query, "type": 1, "limit": 1},
+                headers=self.headers)
 
-            song = res.get('result', {}).get('songs', [])[0]
+            songs = res.get('result', {}).get('songs', [])
+            if not songs: return None
+            song = songs[0]
             res_title = f"{song.get('artists', [{}])[0].get('name')} {song.get('name')}"
 
             trustworthy = await loop.run_in_executor(self.executor, self._is_trustworthy_sync, target_name, res_title, logs)
             if not trustworthy: return None
 
-            l_res = await loop.run_in_executor(None, lambda: requests.get(
-                "https://music.163.com/api/song/lyric",
-                params={"id": song.get('id'), "lv": -1, "kv": -1, "tv": -1}, timeout=3).json())
+            song_key = f"netease:{song.get('id')}"
+            if await self.cache.get(song_key, count=False):
+                return None, None, song_key
+
+            l_data = await self.http.get_json(
+                self.endpoints['netease_lyric'],
+                params={"id": song.get('id'), "lv": -1, "kv": -1, "tv": -1},
+                headers=self.headers)
 
-            l_data = l_res
             parsed = self.parse_lrc(l_data.get('lrc', {}).get('lyric'))
             if parsed:
-                return await self._merge_lyrics_async(parsed, self.parse_lrc(l_data.get('tlyric', {}).get('lyric')))
+                return parsed, self.parse_lrc(l_data.get('tlyric', {}).get('lyric')), song_key
             return None
-        except: return None
\ No newline at end of file
+        except Exception: return False
+
+    async def close(self):
+        await self.http.close()
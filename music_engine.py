@@ -1,9 +1,230 @@
 import os
-import yt_dlp
+import re
+import json
+import time
+import difflib
 import asyncio
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from email.utils import parsedate_to_datetime
+import requests
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
+from urllib3.util.retry import Retry
 from concurrent.futures import ThreadPoolExecutor
+from storage import SQLiteStore
+from extractor_pool import (
+    ExtractorPool, PRIORITY_NOW, PRIORITY_INTERACTIVE,
+    extract_stream_info, search_candidates, extract_playlist_window
+)
+
+class SourceCache:
+    def __init__(self, max_entries=2000, max_disk_entries=20000, expire_margin=600, default_ttl=6 * 3600):
+        """📦 已解析串流的快取：記憶體 LRU + SQLite 落地，過期時間取自串流網址"""
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        # 剩不到 expire_margin 秒就過期的網址不再發出去，避免播到一半斷線
+        self.expire_margin = expire_margin
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self.store = SQLiteStore("sources.db", """
+            CREATE TABLE IF NOT EXISTS sources (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expire INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sources_last_used ON sources(last_used);
+        """)
+
+    def key_for(self, query):
+        """把查詢字串正規化：YouTube 網址統一成影片 ID，搜尋字串忽略大小寫與多餘空白"""
+        query = query.strip()
+        if query.startswith("http"):
+            parsed = urlparse(query)
+            video_id = parse_qs(parsed.query).get('v', [None])[0]
+            if not video_id and parsed.netloc.endswith("youtu.be"):
+                video_id = parsed.path.lstrip('/')
+            return f"yt:{video_id}" if video_id else f"url:{query}"
+        query = re.sub(r'^ytsearch\d*:', '', query)
+        return "q:" + " ".join(query.lower().split())
+
+    def _alive(self, expire):
+        return expire - time.time() > self.expire_margin
+
+    async def get(self, key):
+        """先看記憶體；沒有才到執行緒裡讀 SQLite (不卡事件迴圈)"""
+        entry = self.entries.get(key)
+        if entry and self._alive(entry[1]):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0])
+
+        self.entries.pop(key, None)
+        rows = await self.store.aquery("SELECT data, expire FROM sources WHERE key = ?", (key,))
+        if rows and self._alive(rows[0][1]):
+            data = json.loads(rows[0][0])
+            self._remember(key, data, rows[0][1])
+            self.store.defer("UPDATE sources SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return dict(data)
+
+        self.misses += 1
+        return None
+
+    def put(self, keys, data):
+        """同一個結果可以掛在多個 key 底下 (搜尋字串 + 影片 ID)"""
+        expire = data.get('expire') or int(time.time() + self.default_ttl)
+        now = time.time()
+        payload = json.dumps(data)
+        for key in keys:
+            self._remember(key, data, expire)
+        # 寫入交給背景執行緒，記憶體裡已經有了，讀得到
+        self.store.defer_many(
+            "INSERT OR REPLACE INTO sources (key, data, expire, last_used) VALUES (?, ?, ?, ?)",
+            [(key, payload, expire, now) for key in keys]
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune_disk()
+
+    def _remember(self, key, data, expire):
+        self.entries[key] = (data, expire)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _prune_disk(self):
+        """刪掉過期的，再依最後使用時間砍到上限以內"""
+        self.store.defer("DELETE FROM sources WHERE expire < ?", (int(time.time()),))
+        self.store.defer(
+            "DELETE FROM sources WHERE key IN (SELECT key FROM sources ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'memory_entries': len(self.entries),
+        }
+
+class SpotifyMetaCache:
+    def __init__(self, ttl=7 * 86400, max_entries=200):
+        """🌿 Spotify 曲目清單快取：歌單用 snapshot_id 驗證版本，專輯/單曲用 TTL"""
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.store = SQLiteStore("spotify_meta.db", """
+            CREATE TABLE IF NOT EXISTS spotify_meta (
+                key TEXT PRIMARY KEY,
+                version TEXT,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+        """)
+
+    def get(self, kind, spotify_id, version=None):
+        """有給 version (snapshot_id) 就比對版本，否則看是否超過 TTL
+        (會讀 SQLite，只在執行緒池裡呼叫)"""
+        key = f"{kind}:{spotify_id}"
+        entry = self.entries.get(key)
+        if not entry:
+            rows = self.store.query("SELECT version, data, fetched_at FROM spotify_meta WHERE key = ?", (key,))
+            if rows:
+                entry = (rows[0][0], json.loads(rows[0][1]), rows[0][2])
+
+        if entry:
+            cached_version, data, fetched_at = entry
+            valid = cached_version == version if version else time.time() - fetched_at < self.ttl
+            if valid:
+                self._remember(key, entry)
+                self.hits += 1
+                return data
+
+        self.misses += 1
+        return None
+
+    def put(self, kind, spotify_id, version, tracks):
+        """整份清單轉成 JSON 很花時間，事件迴圈上請丟進執行緒池呼叫"""
+        key = f"{kind}:{spotify_id}"
+        entry = (version, tracks, time.time())
+        self._remember(key, entry)
+        self.store.defer(
+            "INSERT OR REPLACE INTO spotify_meta (key, version, data, fetched_at) VALUES (?, ?, ?, ?)",
+            (key, version, json.dumps(tracks), entry[2])
+        )
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+class YouTubeMatchTable:
+    def __init__(self, max_entries=5000):
+        """🔗 Spotify 曲目 ID → YouTube 影片 ID 對照表 (比對一次，永久沿用)"""
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.store = SQLiteStore("spotify_youtube.db", """
+            CREATE TABLE IF NOT EXISTS matches (
+                spotify_id TEXT PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                title TEXT,
+                duration REAL,
+                matched_at REAL NOT NULL
+            );
+        """)
+
+    async def get(self, spotify_id):
+        video_id = self.entries.get(spotify_id)
+        if not video_id:
+            rows = await self.store.aquery("SELECT video_id FROM matches WHERE spotify_id = ?", (spotify_id,))
+            video_id = rows[0][0] if rows else None
+        if video_id:
+            self._remember(spotify_id, video_id)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return video_id
+
+    def put(self, spotify_id, candidate):
+        self._remember(spotify_id, candidate['id'])
+        self.store.defer(
+            "INSERT OR REPLACE INTO matches (spotify_id, video_id, title, duration, matched_at) VALUES (?, ?, ?, ?, ?)",
+            (spotify_id, candidate['id'], candidate.get('title'), candidate.get('duration'), time.time())
+        )
+
+    def _remember(self, spotify_id, video_id):
+        self.entries[spotify_id] = video_id
+        self.entries.move_to_end(spotify_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
 
 class SparkMusicEngine:
     def __init__(self, client_id=None, client_secret=None):
@@ -21,19 +242,40 @@ class SparkMusicEngine:
             'external_downloader_args': ['-loglevel', 'panic'],
         }
 
-        # 2. 初始化執行緒池 (確保在 get_spotify_tracks_async 呼叫前存在)
+        # 2. 初始化執行緒池 (確保在 iter_spotify_tracks 呼叫前存在)
         self.executor = ThreadPoolExecutor(max_workers=10)
+        # yt-dlp 專用提取池：常駐暖機的 YoutubeDL，下一首優先於背景工作 (thread / process 兩種後端)
+        self.extractor = ExtractorPool(
+            self.ydl_opts,
+            workers=int(os.getenv("SPARK_EXTRACT_WORKERS", "4")),
+            max_pending=int(os.getenv("SPARK_EXTRACT_QUEUE", "64")),
+            backend=os.getenv("SPARK_EXTRACT_BACKEND", "thread")
+        )
+
+        # 3. 已解析串流快取 (單曲循環、清單循環、跨伺服器熱門歌都不用重新提取)
+        self.source_cache = SourceCache(max_entries=int(os.getenv("SPARK_SOURCE_CACHE_SIZE", "2000")))
+
+        # 4. Spotify 分頁並行抓取設定與曲目清單快取
+        self.spotify_fanout = int(os.getenv("SPARK_SPOTIFY_FANOUT", "4"))
+        self.spotify_meta = SpotifyMetaCache()
+        self._spotify_cooldown = 0.0
+
+        # 5. Spotify → YouTube 對照表 (搜尋一次就記住，之後直接用影片 ID)
+        self.youtube_matches = YouTubeMatchTable()
 
         print(f"--- 🎵 Spotify 引擎初始化中 ---")
 
-        # 3. Spotify 初始化
+        # 6. Spotify 初始化
         if not client_id or not client_secret:
             self.sp = None
             print("⚠️ 警告：Spotify 金鑰缺失！")
         else:
             try:
                 auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
-                self.sp = spotipy.Spotify(auth_manager=auth_manager, requests_timeout=10)
+                # 429 / 5xx 由 _spotify_call 自己處理，才能讓所有執行緒共用 Retry-After 冷卻
+                self.sp = spotipy.Spotify(
+                    auth_manager=auth_manager, requests_timeout=10, requests_session=self._spotify_session()
+                )
                 # 測試連接
                 self.sp.search(q='test', limit=1)
                 print("✅ Spotify 引擎啟動成功！")
@@ -41,121 +283,271 @@ class SparkMusicEngine:
                 self.sp = None
                 print(f"❌ Spotify 認證失敗：{e}")
 
-    def _extract_yt_info(self, query):
-        """同步提取邏輯，確保回傳的是真正的串流 URL"""
-        # 每次提取單曲時，確保不使用 extract_flat，否則拿不到流網址
-        opts = self.ydl_opts.copy()
-
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            try:
-                info = ydl.extract_info(query, download=False)
-                if 'entries' in info:
-                    if not info['entries']: return None
-                    entry = info['entries'][0]
-                else:
-                    entry = info
-
-                # 🔍 終極網址抓取：排除網頁網址，尋找 googlevideo 連結
-                stream_url = None
-
-                # 嘗試 1: 直接找 url 欄位
-                raw_url = entry.get('url')
-                if raw_url and 'youtube.com' not in raw_url:
-                    stream_url = raw_url
-
-                # 嘗試 2: 從 formats 裡挑選最好的純音軌
-                if not stream_url and 'formats' in entry:
-                    # 篩選沒有影片(vcodec='none')且有網址的格式，取最後一個(通常品質最高)
-                    best_audio = [f for f in entry['formats'] if f.get('vcodec') == 'none' and f.get('url')]
-                    if best_audio:
-                        stream_url = best_audio[-1]['url']
-
-                if not stream_url:
-                    print(f"⚠️ 艾瑪警告：無法解析有效串流網址: {entry.get('title')}")
-                    return None
-
-                return {
-                    'url': stream_url,
-                    'title': entry.get('title', 'Unknown Title'),
-                    'duration': entry.get('duration', 0)
-                }
-            except Exception as e:
-                print(f"❌ yt-dlp 內部崩潰: {e}")
-                return None
+    def stream_expiry(self, stream_url):
+        """⏳ 從 googlevideo 網址讀出 expire= 時間戳 (讀不到回傳 0)"""
+        if not stream_url: return 0
+        try:
+            values = parse_qs(urlparse(stream_url).query).get('expire')
+            if values: return int(values[0])
+            # 部分 manifest 網址把參數寫在路徑裡：/expire/1700000000/
+            match = re.search(r'/expire/(\d+)', stream_url)
+            return int(match.group(1)) if match else 0
+        except ValueError:
+            return 0
 
-    async def get_yt_source(self, search_query):
+    async def get_yt_source(self, search_query, priority=PRIORITY_NOW):
         """✨ 取得 YouTube 串流 URL"""
-        loop = asyncio.get_event_loop()
+        cache_key = self.source_cache.key_for(search_query)
+        cached = await self.source_cache.get(cache_key)
+        if cached:
+            return cached
+
         target_query = search_query if search_query.startswith("http") else f"ytsearch1:{search_query}"
         try:
-            return await asyncio.wait_for(
-                loop.run_in_executor(None, self._extract_yt_info, target_query),
+            result = await asyncio.wait_for(
+                self.extractor.submit('stream', extract_stream_info, target_query, priority=priority),
                 timeout=25.0
             )
+            if result:
+                result['expire'] = self.stream_expiry(result['url'])
+                keys = [cache_key]
+                if result.get('id'): keys.append(f"yt:{result['id']}")
+                self.source_cache.put(keys, result)
+            return result
         except Exception as e:
             print(f"❌ YouTube 提取失敗: {e}")
             return None
 
-    async def get_yt_playlist_urls(self, playlist_url):
-        """🎵 解析 YouTube 歌單 (使用 flat 模式提高速度)"""
-        loop = asyncio.get_event_loop()
-        opts = self.ydl_opts.copy()
-        opts['extract_flat'] = True
+    async def get_item_source(self, item, priority=PRIORITY_NOW):
+        """🎯 依佇列項目取得串流：Spotify 曲目先查對照表，找不到才搜尋比對"""
+        query = item.query
+        if item.spotify_id:
+            video_id = await self.resolve_spotify_video(item, priority)
+            if video_id:
+                query = f"https://www.youtube.com/watch?v={video_id}"
+        return await self.get_yt_source(query, priority)
+
+    async def resolve_spotify_video(self, item, priority=PRIORITY_NOW):
+        """把 Spotify 曲目對應到 YouTube 影片 ID (依長度與標題挑選多個搜尋結果)"""
+        spotify_id = item.spotify_id
+        video_id = await self.youtube_matches.get(spotify_id)
+        if video_id:
+            return video_id
+
+        try:
+            candidates = await asyncio.wait_for(
+                self.extractor.submit('flat', search_candidates, item.query, 5, priority=priority),
+                timeout=20.0
+            )
+        except Exception as e:
+            print(f"❌ YouTube 候選搜尋失敗: {e}")
+            return None
+        if not candidates:
+            return None
+
+        duration = item.duration or 0
+        ranked = sorted(candidates, key=lambda c: self._match_score(item.query, duration, c), reverse=True)
+        best = ranked[0]
+        # 長度差距在容許範圍內才寫進對照表，不確定的結果下次再重新比對
+        if not duration or not best.get('duration') or abs(best['duration'] - duration) <= max(5, duration * 0.05):
+            self.youtube_matches.put(spotify_id, best)
+        return best['id']
+
+    def _match_score(self, query, duration, candidate):
+        """候選分數：長度越接近越好，標題越像越好，翻唱/現場版等扣分"""
+        title = candidate['title'].lower()
+        score = difflib.SequenceMatcher(None, query.lower(), title).ratio()
+
+        if duration and candidate['duration']:
+            diff = abs(candidate['duration'] - duration)
+            score += max(0.0, 1.0 - diff / 30.0) * 2
+        for word in ('live', 'cover', 'remix', 'karaoke', 'instrumental', 'nightcore', 'sped up', '8d'):
+            if word in title and word not in query.lower():
+                score -= 1.0
+        # YouTube Music 自動產生的「- Topic」頻道通常是原曲音檔
+        if candidate['channel'].endswith(' - Topic'):
+            score += 0.5
+        return score
+
+    async def get_yt_playlist_window(self, playlist_url, start, size, priority=PRIORITY_INTERACTIVE):
+        """🎵 分段解析 YouTube 歌單 (flat 模式)：回傳第 start 首起最多 size 首，附帶標題與長度
+        (解析失敗回傳 None，和「歌單到底了」的空清單分開，呼叫端才知道要不要重試)"""
         try:
-            info = await asyncio.wait_for(
-                loop.run_in_executor(None, lambda: yt_dlp.YoutubeDL(opts).extract_info(playlist_url, download=False)),
+            entries = await asyncio.wait_for(
+                self.extractor.submit('flat', extract_playlist_window, playlist_url, start, start + size - 1, priority=priority),
                 timeout=30.0
             )
-            if 'entries' in info:
-                return [f"https://www.youtube.com/watch?v={e['id']}" for e in info['entries'] if e]
-            return []
+            return [{
+                'query': f"https://www.youtube.com/watch?v={e['id']}",
+                'clean_title': None,
+                'title': e['title'],
+                'duration': e['duration']
+            } for e in entries]
         except Exception as e:
             print(f"❌ 歌單解析失敗: {e}")
-            return []
+            return None
 
-    async def get_spotify_tracks_async(self, spotify_url):
-        """🌿 非同步 Spotify 解析"""
+    async def iter_spotify_tracks(self, spotify_url):
+        """🌿 逐頁產出 Spotify 歌曲 (tracks, total)：第一頁到手就能先開始播放，其餘分頁並行抓取
+        某一頁抓不到時產出 (None, total) 並繼續下一頁，呼叫端可以據此回報缺了幾頁"""
+        if not self.sp: return
+        match = re.search(r'(track|album|playlist)[/:]([A-Za-z0-9]+)', spotify_url)
+        if not match: return
+        kind, spotify_id = match.groups()
         loop = asyncio.get_event_loop()
+        futures = []
         try:
-            return await asyncio.wait_for(
-                loop.run_in_executor(self.executor, self._get_spotify_tracks_sync, spotify_url),
-                timeout=60.0
+            first = await asyncio.wait_for(
+                loop.run_in_executor(self.executor, self._spotify_first_page_sync, kind, spotify_id),
+                timeout=15.0
+            )
+            total = first['total']
+            yield first['tracks'], total
+            if first['complete']:
+                return
+
+            # 第一頁就知道總數，剩下的 offset 一次排進執行緒池，用 semaphore 限制同時請求數
+            semaphore = asyncio.Semaphore(self.spotify_fanout)
+            async def fetch_page(offset):
+                async with semaphore:
+                    return await loop.run_in_executor(
+                        self.executor, self._spotify_page_sync,
+                        kind, spotify_id, offset, first['limit'], first['artists']
+                    )
+
+            futures = [asyncio.ensure_future(fetch_page(offset)) for offset in range(first['limit'], total, first['limit'])]
+            collected = list(first['tracks'])
+            failed = 0
+            for future in futures:
+                try:
+                    page = await asyncio.wait_for(future, timeout=30.0)
+                except Exception as e:
+                    failed += 1
+                    print(f"⚠️ Spotify 分頁讀取失敗，略過: {e}")
+                    yield None, total
+                    continue
+                collected.extend(page)
+                yield page, total
+
+            if failed:
+                # 缺頁的清單不寫進快取，下次重新抓完整的
+                print(f"⚠️ Spotify 解析完成但缺了 {failed} 頁，取得 {len(collected)} / {total} 首歌曲")
+                return
+            await loop.run_in_executor(
+                self.executor, self.spotify_meta.put, kind, spotify_id, first['version'], collected
             )
+            print(f"✅ Spotify 解析完成，取得 {len(collected)} 首歌曲")
         except Exception as e:
             print(f"❌ Spotify 解析超時或錯誤: {e}")
-            return []
+        finally:
+            for future in futures: future.cancel()
 
-    def _get_spotify_tracks_sync(self, spotify_url):
-        """同步 Spotify 解析邏輯"""
-        if not self.sp: return []
-        tracks = []
+    @staticmethod
+    def _spotify_session():
+        """給 spotipy 用的連線：只重試連線失敗，不依狀態碼重試
+
+        spotipy 內建的 session 會把 429 / 5xx 交給 urllib3 重試，用完次數就變成沒有 headers 的
+        SpotifyException(429)，讀不到 Retry-After (而且 status_forcelist 給空的會被換回預設值)。
+        自己的 session 讓所有錯誤狀態走 HTTPError，例外裡保留原本的 headers。
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(max_retries=Retry(
+            total=3, connect=3, read=False, status=0, status_forcelist=None, backoff_factor=0.3,
+            # urllib3 預設看到 429 + Retry-After 也會自己重試，這裡關掉交給 _spotify_call
+            respect_retry_after_header=False
+        ))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @staticmethod
+    def _retry_after(headers):
+        """Retry-After 可能是秒數或 HTTP 日期，讀不到就當 1 秒"""
+        value = (headers or {}).get('Retry-After')
+        if not value:
+            return 1
         try:
-            if 'track' in spotify_url:
-                track = self.sp.track(spotify_url)
-                artists = ", ".join([a['name'] for a in track['artists']])
-                tracks.append(f"{artists} - {track['name']}")
-            elif 'playlist' in spotify_url:
-                results = self.sp.playlist_tracks(spotify_url)
-                items = results['items']
-                while results['next']:
-                    results = self.sp.next(results)
-                    items.extend(results['items'])
-                for item in items:
-                    if item.get('track'):
-                        t = item['track']
-                        artists = ", ".join([a['name'] for a in t['artists']])
-                        tracks.append(f"{artists} - {t['name']}")
-            elif 'album' in spotify_url:
-                results = self.sp.album_tracks(spotify_url)
-                items = results['items']
-                while results['next']:
-                    results = self.sp.next(results)
-                    items.extend(results['items'])
-                album_info = self.sp.album(spotify_url)
+            return max(1, int(float(value)))
+        except ValueError:
+            try:
+                return max(1, int(parsedate_to_datetime(value).timestamp() - time.time()))
+            except Exception:
+                return 1
+
+    def _spotify_call(self, func, *args, **kwargs):
+        """呼叫 Spotify API：429 依 Retry-After 等待 (所有執行緒共用冷卻時間)，5xx 退避重試"""
+        for attempt in range(5):
+            wait = self._spotify_cooldown - time.time()
+            if wait > 0: time.sleep(wait)
+            try:
+                return func(*args, **kwargs)
+            except spotipy.SpotifyException as e:
+                if attempt == 4: raise
+                if e.http_status == 429:
+                    retry_after = self._retry_after(e.headers)
+                    self._spotify_cooldown = max(self._spotify_cooldown, time.time() + retry_after)
+                    print(f"⏳ Spotify 限流中，等待 {retry_after} 秒後重試")
+                elif e.http_status and e.http_status >= 500:
+                    time.sleep(0.5 * 2 ** attempt)
+                else:
+                    raise
+
+    def _spotify_first_page_sync(self, kind, spotify_id):
+        """同步取得第一頁 (或快取)，回傳後續分頁需要的資訊"""
+        if kind == 'playlist':
+            # 歌單資訊本身就帶著第一頁與 snapshot_id：版本沒變就只花這一個請求
+            info = self._spotify_call(self.sp.playlist, spotify_id)
+            version = info.get('snapshot_id')
+            page, artists = info['tracks'], None
+        else:
+            version = None
+            cached = self.spotify_meta.get(kind, spotify_id)
+            if cached is not None:
+                return {'tracks': cached, 'total': len(cached), 'complete': True}
+            if kind == 'track':
+                track = self._spotify_call(self.sp.track, spotify_id)
+                page, artists = {'items': [track], 'total': 1, 'limit': 1}, None
+            else:
+                # 專輯資訊同時帶有專輯歌手與第一頁曲目，不必再多打一次 album_tracks
+                album_info = self._spotify_call(self.sp.album, spotify_id)
+                page = album_info['tracks']
                 artists = ", ".join([a['name'] for a in album_info['artists']])
-                for t in items:
-                    tracks.append(f"{artists} - {t['name']}")
-            print(f"✅ Spotify 解析完成，取得 {len(tracks)} 首歌曲")
-        except Exception as e:
-            print(f"❌ Spotify 同步解析錯誤: {e}")
-        return tracks
\ No newline at end of file
+
+        cached = self.spotify_meta.get(kind, spotify_id, version) if version else None
+        if cached is not None:
+            return {'tracks': cached, 'total': len(cached), 'complete': True}
+
+        tracks = self._spotify_page_tracks(page, artists)
+        complete = not page.get('next')
+        if complete:
+            self.spotify_meta.put(kind, spotify_id, version, tracks)
+        return {
+            'tracks': tracks,
+            'total': page.get('total', len(tracks)),
+            'limit': page.get('limit') or len(page.get('items', [])) or 50,
+            'version': version,
+            'artists': artists,
+            'complete': complete,
+        }
+
+    def _spotify_page_sync(self, kind, spotify_id, offset, limit, artists):
+        """同步抓取指定 offset 的分頁"""
+        if kind == 'playlist':
+            results = self._spotify_call(self.sp.playlist_items, spotify_id, limit=limit, offset=offset)
+        else:
+            results = self._spotify_call(self.sp.album_tracks, spotify_id, limit=limit, offset=offset)
+        return self._spotify_page_tracks(results, artists)
+
+    def _spotify_page_tracks(self, results, artists=None):
+        """把一頁 Spotify 結果轉成曲目資料 (歌單項目包在 track 欄位裡)"""
+        tracks = []
+        for item in results.get('items', []):
+            t = item['track'] if isinstance(item.get('track'), dict) else item
+            if not t or not t.get('name'): continue
+            names = artists or ", ".join([a['name'] for a in t.get('artists', [])])
+            tracks.append({
+                'query': f"{names} - {t['name']}",
+                'spotify_id': t.get('id'),
+                'duration': (t.get('duration_ms') or 0) / 1000
+            })
+        return tracks
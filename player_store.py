@@ -0,0 +1,205 @@
+import json
+import time
+import zlib
+import threading
+from storage import SQLiteStore
+from track_queue import Track
+
+PLAYER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    guild_id INTEGER PRIMARY KEY,
+    text_channel_id INTEGER,
+    voice_channel_id INTEGER,
+    loop_mode INTEGER NOT NULL DEFAULT 0,
+    current TEXT,
+    last_played TEXT,
+    position REAL NOT NULL DEFAULT 0,
+    queue BLOB,
+    queue_size INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    queue_head INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_UPSERT = (
+    "INSERT OR REPLACE INTO players (guild_id, text_channel_id, voice_channel_id, loop_mode, current, "
+    "last_played, position, queue, queue_size, updated, queue_head) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+# 佇列本體沒變：只更新小欄位與「前面已經播掉幾首」
+_UPDATE_HEAD = (
+    "UPDATE players SET text_channel_id = ?, voice_channel_id = ?, loop_mode = ?, current = ?, "
+    "last_played = ?, position = ?, queue_size = ?, updated = ?, queue_head = ? WHERE guild_id = ?"
+)
+
+def _pack_track(track):
+    if track is None: return None
+    return [track.query, track.clean_title, track.title, track.duration, track.spotify_id]
+
+def _unpack_track(row):
+    if not row: return None
+    query, clean_title, title, duration, spotify_id = row
+    return Track(query, clean_title=clean_title, title=title, duration=duration, spotify_id=spotify_id)
+
+def _merge(old, new):
+    """合併同一個伺服器還沒寫出去的兩份快照：新的只記 queue_head 時沿用舊的佇列本體"""
+    if new is not None and new['queue'] is None and old is not None and old['queue'] is not None:
+        new = dict(new, queue=old['queue'])
+    return new
+
+class PlayerStore:
+    def __init__(self, flush_interval=3.0):
+        """💾 播放器狀態的 write-behind 存檔
+
+        指令只把快照丟進待寫字典 (同一個伺服器只留最新一份)，
+        背景執行緒每 flush_interval 秒把累積的變更寫進 SQLite (WAL) 的同一個交易。
+        快照的 queue 為 None 代表佇列本體跟上次存的一樣，只寫 queue_head (前面播掉幾首)，
+        換歌 / 更新面板不用每次重新編碼整個佇列。
+        """
+        self.db = SQLiteStore("player_state.db", PLAYER_SCHEMA)
+        # 舊版存檔沒有 queue_head 欄位
+        if 'queue_head' not in {row[1] for row in self.db.query("PRAGMA table_info(players)")}:
+            self.db.execute("ALTER TABLE players ADD COLUMN queue_head INTEGER NOT NULL DEFAULT 0")
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = {}    # guild_id -> 快照 (None 代表刪除)
+        self.positions = {}  # guild_id -> 播放秒數 (只更新一個欄位)
+        self.closed = False
+        self.wake = threading.Event()
+
+        # 📊 統計數據
+        self.saves = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_flush_ms = 0.0
+
+        self.thread = threading.Thread(target=self._writer, name="spark-player-store", daemon=True)
+        self.thread.start()
+
+    def save(self, guild_id, snapshot):
+        """排入一份伺服器狀態快照 (不阻塞，真正寫入在背景)"""
+        with self.lock:
+            self.saves += 1
+            if guild_id in self.pending:
+                self.coalesced += 1
+            self.pending[guild_id] = _merge(self.pending.get(guild_id), snapshot)
+            self.positions.pop(guild_id, None)
+
+    def save_position(self, guild_id, seconds):
+        with self.lock:
+            self.positions[guild_id] = seconds
+
+    def drop(self, guild_id):
+        """停止 / 離開：刪掉存檔"""
+        with self.lock:
+            self.pending[guild_id] = None
+            self.positions.pop(guild_id, None)
+
+    def saved_guilds(self):
+        """只讀摘要 (不解開佇列)，啟動時用來決定要還原哪些伺服器"""
+        rows = self.db.query(
+            "SELECT guild_id, text_channel_id, voice_channel_id, current IS NOT NULL, queue_size FROM players"
+        )
+        return [{
+            'guild_id': gid, 'text_channel_id': text_id, 'voice_channel_id': voice_id,
+            'playing': bool(playing), 'queue_size': size
+        } for gid, text_id, voice_id, playing, size in rows]
+
+    def load(self, guild_id):
+        """讀出一個伺服器的完整狀態並還原成 Track"""
+        rows = self.db.query(
+            "SELECT text_channel_id, voice_channel_id, loop_mode, current, last_played, position, queue, queue_head "
+            "FROM players WHERE guild_id = ?", (guild_id,)
+        )
+        if not rows:
+            return None
+        text_id, voice_id, loop_mode, current, last_played, position, queue, head = rows[0]
+        try:
+            entries = json.loads(zlib.decompress(queue))[head:] if queue else []
+            return {
+                'text_channel_id': text_id,
+                'voice_channel_id': voice_id,
+                'loop_mode': loop_mode,
+                'current': _unpack_track(json.loads(current)) if current else None,
+                'last_played': _unpack_track(json.loads(last_played)) if last_played else None,
+                'position': position,
+                'queue': [_unpack_track(e) for e in entries],
+            }
+        except Exception as e:
+            print(f"⚠️ 播放狀態存檔損毀，略過 ({guild_id}): {e}")
+            return None
+
+    def flush(self):
+        """把累積的變更寫進資料庫 (背景執行緒定期呼叫，關機時也會呼叫一次)"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            positions, self.positions = self.positions, {}
+        if not pending and not positions:
+            return
+
+        started = time.perf_counter()
+        now = time.time()
+        upserts, heads, deletes = [], [], []
+        for guild_id, snap in pending.items():
+            if snap is None:
+                deletes.append((guild_id,))
+                continue
+            current, last_played = _pack_track(snap['current']), _pack_track(snap['last_played'])
+            current = json.dumps(current, ensure_ascii=False) if current else None
+            last_played = json.dumps(last_played, ensure_ascii=False) if last_played else None
+            queue = snap['queue']
+            if queue is None:
+                heads.append((
+                    snap['text_channel_id'], snap['voice_channel_id'], snap['loop_mode'], current, last_played,
+                    snap['position'], snap['queue_size'], now, snap['queue_head'], guild_id
+                ))
+                continue
+            upserts.append((
+                guild_id, snap['text_channel_id'], snap['voice_channel_id'], snap['loop_mode'],
+                current, last_played, snap['position'],
+                zlib.compress(json.dumps([_pack_track(t) for t in queue], ensure_ascii=False).encode()),
+                snap['queue_size'], now, snap['queue_head']
+            ))
+        try:
+            self.db.batch([
+                ("DELETE FROM players WHERE guild_id = ?", deletes),
+                (_UPSERT, upserts),
+                (_UPDATE_HEAD, heads),
+                ("UPDATE players SET position = ?, updated = ? WHERE guild_id = ?",
+                 [(pos, now, gid) for gid, pos in positions.items()]),
+            ])
+        except Exception as e:
+            print(f"⚠️ 播放狀態寫入失敗: {e}")
+            # 放回去下次再寫 (期間有更新的快照就以新的為準)，不然之後只記 queue_head 的快照會對不上本體
+            with self.lock:
+                for guild_id, snap in pending.items():
+                    self.pending[guild_id] = _merge(snap, self.pending[guild_id]) if guild_id in self.pending else snap
+                for guild_id, pos in positions.items():
+                    self.positions.setdefault(guild_id, pos)
+            return
+        self.flushes += 1
+        self.rows_written += len(upserts) + len(heads) + len(deletes) + len(positions)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    def _writer(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.flush()
+
+    def close(self):
+        """關機前把還沒寫的變更寫完"""
+        self.closed = True
+        self.wake.set()
+        self.thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'saves': self.saves,
+                'coalesced': self.coalesced,
+                'flushes': self.flushes,
+                'rows': self.rows_written,
+                'pending': len(self.pending) + len(self.positions),
+                'last_flush_ms': self.last_flush_ms,
+            }
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from extractor_pool import PRIORITY_PREFETCH, ExtractTicket
+
+class QueuePrefetcher:
+    def __init__(self, music_engine, depth=3, refresh_margin=300, lyrics_engine=None, retry_after=120):
+        """🚀 預先解析佇列前 N 首的串流網址，換歌時不用再等 yt-dlp
+        (有給 lyrics_engine 的話，解析完順便在背景查好歌詞、轉好拼音)"""
+        self.music = music_engine
+        self.lyrics = lyrics_engine
+        self.depth = depth
+        # googlevideo 網址剩不到 refresh_margin 秒就過期時視為需要重新解析
+        self.refresh_margin = refresh_margin
+        # 解析失敗的歌過 retry_after 秒再試一次 (暫時性的網路 / yt-dlp 錯誤不會讓它永遠不預先解析)
+        self.retry_after = retry_after
+        self.tasks = {}
+        self.tickets = {}  # 解析中的項目 -> ExtractTicket (輪到它播時拿來插隊)
+
+    def is_fresh(self, source):
+        """檢查已解析的來源是否還能安全播放"""
+        if not source: return False
+        expire = source.get('expire', 0)
+        return not expire or expire - time.time() > self.refresh_margin
+
+    async def take(self, item):
+        """取得預先解析好的來源；還在解析中就把它的提取工作提到 PRIORITY_NOW 再等它完成，過期則回傳 None"""
+        if item.pending:
+            ticket = self.tickets.get(item)
+            if ticket:
+                # 不然馬上要播的歌會排在所有伺服器的背景工作後面
+                self.music.extractor.promote(ticket)
+            await asyncio.shield(item.pending)
+        source = item.source
+        return source if self.is_fresh(source) else None
+
+    def schedule(self, guild_id, queue):
+        """佇列有變動 (加歌/換歌/打亂/跳轉) 時重新排程背景解析"""
+        self.cancel(guild_id)
+        if queue:
+            self.tasks[guild_id] = asyncio.get_event_loop().create_task(self._run(queue))
+
+    def cancel(self, guild_id):
+        """清空或離開時取消背景解析"""
+        task = self.tasks.pop(guild_id, None)
+        if task and not task.done():
+            task.cancel()
+
+    def _backing_off(self, item):
+        return item.prefetch_failed and time.monotonic() - item.prefetch_failed < self.retry_after
+
+    async def _resolve(self, item):
+        """實際解析一首歌，結果直接寫回佇列項目 (失敗只記下時間，不往外丟例外)"""
+        ticket = self.tickets[item] = ExtractTicket()
+        ticket.bind()
+        try:
+            try:
+                source = await self.music.get_item_source(item, PRIORITY_PREFETCH)
+            except Exception as e:
+                print(f"⚠️ 預先解析失敗 ({item.label}): {e}")
+                source = None
+            if source:
+                item.prefetch_failed = 0.0
+                item.source = source
+                # 長度寫回項目，佇列的時間索引會跟著更新
+                item.duration = source.get('duration') or item.duration
+                if self.lyrics:
+                    # 標題的取法和 announce_track 一樣，之後播放時才對得上快取
+                    asyncio.get_event_loop().create_task(
+                        self.lyrics.precompute(item.clean_title or source['title'], source['title'])
+                    )
+            else:
+                item.prefetch_failed = time.monotonic()
+        finally:
+            item.pending = None
+            self.tickets.pop(item, None)
+
+    async def _run(self, queue):
+        while queue:
+            window = queue[:self.depth]
+            for item in window:
+                if self.is_fresh(item.source) or self._backing_off(item):
+                    continue
+                pending = item.pending
+                if not pending:
+                    pending = item.pending = asyncio.get_event_loop().create_task(self._resolve(item))
+                # 用 shield 包起來：佇列被打亂或跳轉而重新排程時，解析到一半的工作不會被丟掉
+                try:
+                    await asyncio.shield(pending)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"⚠️ 預先解析任務出錯: {e}")
+
+            # 睡到最早快過期的那一首 (或失敗的歌可以重試的時候)，再回來重新解析；
+            # 還在退避的歌就算手上的網址已經過期也等到 retry_after，不要每秒醒來空轉
+            wakes = []
+            for i in window:
+                if self._backing_off(i):
+                    wakes.append(i.prefetch_failed + self.retry_after - time.monotonic())
+                elif self.is_fresh(i.source) and i.source.get('expire'):
+                    wakes.append(i.source['expire'] - self.refresh_margin - time.time())
+            if not wakes:
+                return
+            await asyncio.sleep(max(1.0, min(wakes)))
@@ -0,0 +1,94 @@
+import os
+import queue
+import sqlite3
+import asyncio
+import threading
+
+# 💾 所有快取 / 狀態檔案的存放位置 (Docker 可掛載成 volume 保留資料)
+DATA_DIR = os.getenv("SPARK_DATA_DIR", "data")
+
+# 有背景寫入執行緒的倉庫，關機時 flush_all 一次寫完
+_stores = []
+
+def flush_all():
+    """把所有倉庫排隊中的寫入寫完 (關機前在執行緒裡呼叫)"""
+    for store in list(_stores):
+        store.flush()
+
+class SQLiteStore:
+    def __init__(self, filename, schema):
+        """🗄️ 共用的 SQLite 小倉庫：一條連線給所有執行緒用，靠鎖保護"""
+        os.makedirs(DATA_DIR, exist_ok=True)
+        self.path = os.path.join(DATA_DIR, filename)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(schema)
+        self.conn.commit()
+        # 不需要等結果的寫入交給背景執行緒 (用到才啟動)，不佔用事件迴圈
+        self.writes = None
+        self.writer = None
+
+    def query(self, sql, params=()):
+        """讀取資料，回傳所有列"""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def execute(self, sql, params=()):
+        """寫入單筆並立即 commit"""
+        with self.lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def executemany(self, sql, rows):
+        """批次寫入 (同一個交易)"""
+        with self.lock:
+            self.conn.executemany(sql, rows)
+            self.conn.commit()
+
+    def batch(self, ops):
+        """多組 (sql, rows) 批次寫入放在同一個交易"""
+        with self.lock:
+            for sql, rows in ops:
+                if rows:
+                    self.conn.executemany(sql, rows)
+            self.conn.commit()
+
+    async def aquery(self, sql, params=()):
+        """在執行緒裡讀取 (給事件迴圈上的呼叫端用)"""
+        return await asyncio.to_thread(self.query, sql, params)
+
+    def defer(self, sql, params=()):
+        """寫入單筆，排進背景執行緒就返回"""
+        self.defer_many(sql, [params])
+
+    def defer_many(self, sql, rows):
+        """批次寫入，排進背景執行緒就返回 (同一批排隊中的寫入會合併成一個交易)"""
+        if self.writer is None:
+            self.writes = queue.Queue()
+            self.writer = threading.Thread(target=self._write_loop, name=f"spark-sqlite-{os.path.basename(self.path)}", daemon=True)
+            self.writer.start()
+            _stores.append(self)
+        self.writes.put((sql, rows))
+
+    def flush(self):
+        """等排隊中的寫入全部 commit"""
+        if self.writes is not None:
+            self.writes.join()
+
+    def _write_loop(self):
+        while True:
+            ops = [self.writes.get()]
+            while True:
+                try:
+                    ops.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.batch(ops)
+            except Exception as e:
+                print(f"⚠️ SQLite 背景寫入失敗 ({self.path}): {e}")
+            finally:
+                for _ in ops:
+                    self.writes.task_done()
@@ -0,0 +1,436 @@
+import sys
+import random
+from array import array
+from itertools import islice
+
+class Track:
+    """🎵 佇列裡的一首歌 (用 __slots__ 壓低上萬首歌單的記憶體)"""
+    __slots__ = (
+        'query', 'clean_title', 'title', 'spotify_id',
+        'source', 'played', 'pending', 'prefetch_failed', 'resume_at',
+        '_duration', '_queue', '_slot'
+    )
+
+    def __init__(self, query, clean_title=None, title=None, duration=0, spotify_id=None):
+        self.query = query
+        self.clean_title = clean_title
+        self.title = title
+        self.spotify_id = spotify_id
+        self.source = None           # 解析好的串流資訊 (get_yt_source 的結果)
+        self.played = False
+        self.pending = None          # 預先解析中的 Task
+        self.prefetch_failed = 0.0     # 上次預先解析失敗的時間 (monotonic)，0 = 沒失敗過
+        self.resume_at = 0           # 重開機還原時從第幾秒接著播
+        self._duration = duration or 0
+        self._queue = None           # 目前所在的 TrackQueue
+        self._slot = -1              # 在 TrackQueue 陣列裡的位置 (只是提示，可能過期)
+
+    @classmethod
+    def from_dict(cls, data, clean_title=None):
+        """把引擎回傳的 dict (Spotify 頁面 / 歌單分段) 轉成 Track"""
+        return cls(
+            data['query'],
+            clean_title=clean_title or data.get('clean_title'),
+            title=data.get('title'),
+            duration=data.get('duration'),
+            spotify_id=data.get('spotify_id')
+        )
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @duration.setter
+    def duration(self, value):
+        """長度晚點才知道 (預先解析 / 歌單分段) 時，同步更新所在佇列的時間索引"""
+        value = value or 0
+        if value != self._duration:
+            self._duration = value
+            if self._queue is not None:
+                self._queue._retime(self)
+
+    @property
+    def label(self):
+        """顯示在清單上的名字"""
+        return self.clean_title or self.title or (self.source or {}).get('title') or self.query
+
+    def memory_estimate(self):
+        """這首歌大約佔用的位元組數 (物件本身 + 字串 + 已解析的來源)"""
+        strings = {id(s): s for s in (self.query, self.clean_title, self.title, self.spotify_id) if s}
+        size = sys.getsizeof(self) + sum(map(sys.getsizeof, strings.values()))
+        if self.source:
+            size += sys.getsizeof(self.source) + sum(map(sys.getsizeof, self.source.values()))
+        return size
+
+# Fenwick tree 的三個欄位：歌曲數 / 已知長度總和 / 長度未知的歌曲數
+_COUNT, _TIME, _UNKNOWN = 0, 1, 2
+
+class TrackQueue:
+    def __init__(self, items=()):
+        """📜 每個伺服器的播放佇列
+
+        歌曲放在一個陣列裡，head 指向第一首：
+        - 取出第一首 / 插到最前面 攤還 O(1)：只移動 head，不搬動後面的歌 (比 list 快)
+        - 總長度 / 第 k 首的預計開播時間 O(log n)：Fenwick tree 記錄歌曲長度 (比 list 逐首加總快很多)
+        - 跳到第 k 首 / 刪除任意一首：刪掉的位置留空，靠同一組 Fenwick tree 換算名次，
+          複雜度是 O(log n)，但都是 Python 迴圈，十萬首以內反而比 list 在 C 層搬記憶體慢
+        - 打亂 / 移動 / 中間插入：先把空位壓實再重建欄位，O(n)，比直接用 list 慢一些
+        真正省下的是換歌 (popleft) 與 ETA 計算；其他操作只是維持在可接受的範圍。
+
+        revision 在結構變動 (加歌 / 刪除 / 打亂 / 移動 / 清空) 時加一，popped 累計從前面拿掉的首數：
+        存檔時 revision 沒變就只要記「前面少了幾首」，不用重寫整個佇列。
+        """
+        self._slots = []
+        self.revision = 0
+        self.popped = 0
+        self._reset()
+        self.extend(items)
+
+    def _reset(self):
+        for x in self._slots:
+            if x is not None:
+                x._queue = None
+                x._slot = -1
+        self._slots = []
+        # 每格的值 (head 之前的格子不管，名次與時間都只看前綴和的差值)
+        self._cols = (bytearray(), array('d'), bytearray())
+        self._trees = None  # 用到才建
+        self._head = 0
+        self._len = 0
+
+    def clear(self):
+        self._reset()
+        self.revision += 1
+
+    # --- 基本操作 ---
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for x in islice(self._slots, self._head, None):
+            if x is not None:
+                yield x
+
+    def __reversed__(self):
+        slots = self._slots
+        for i in range(len(slots) - 1, self._head - 1, -1):
+            if slots[i] is not None:
+                yield slots[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            r = range(self._len)[key]
+            if r.step > 0:
+                return list(islice(self, r.start, r.stop, r.step))
+            return [self._slots[self._slot_of(i)] for i in r]
+        return self._slots[self._slot_of(key)]
+
+    def append(self, item):
+        item._queue = self
+        item._slot = len(self._slots)
+        self._slots.append(item)
+        values = (1, item._duration, 0 if item._duration else 1)
+        for col, value in zip(self._cols, values):
+            col.append(value)
+        if self._trees is not None:
+            for tree, value in zip(self._trees, values):
+                _fw_grow(tree, value)
+        self._len += 1
+        self.revision += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def appendleft(self, item):
+        """插到最前面 (上一首)"""
+        if self._head == 0:
+            self._compact(front=max(8, self._len // 4))
+        self._head -= 1
+        h = self._head
+        self._slots[h] = item
+        item._queue = self
+        item._slot = h
+        self._set(h, item)
+        self._len += 1
+        self.revision += 1
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError("pop from an empty queue")
+        self._skip()
+        item = self._slots[self._head]
+        self._slots[self._head] = None
+        item._queue = None
+        item._slot = -1
+        self._head += 1
+        self._len -= 1
+        self.popped += 1
+        if not self._len:
+            self._reset()
+        elif self._head > 1024 and self._head > len(self._slots) // 2:
+            # 前面空出一大半就壓實一次，攤還下來仍是 O(1)
+            self._compact()
+        return item
+
+    def pop(self, index=0):
+        if index == 0:
+            return self.popleft()
+        slot = self._slot_of(index)
+        item = self._slots[slot]
+        self._kill(slot)
+        return item
+
+    def remove(self, item):
+        """依物件本身刪除 (同一首歌被排進兩次時只刪其中一個)"""
+        if self._len and self[0] is item:
+            self.popleft()
+            return
+        self._kill(self._find_slot(item))
+
+    def index(self, item):
+        slot = self._find_slot(item)
+        return self._prefix(_COUNT, slot) - self._prefix(_COUNT, self._head)
+
+    def skip(self, count):
+        """丟掉最前面 count 首 (跳轉到第 count+1 首)"""
+        if count <= 0:
+            return
+        if count >= self._len:
+            self.popped += self._len
+            self._reset()
+            return
+        slot = self._slot_of(count)
+        for x in islice(self._slots, self._head, slot):
+            if x is not None:
+                x._queue = None
+                x._slot = -1
+        self._slots[self._head:slot] = [None] * (slot - self._head)
+        self._head = slot
+        self._len -= count
+        self.popped += count
+
+    def insert(self, index, items):
+        """在第 index 首前面插入一批歌"""
+        items = list(items)
+        if not items:
+            return
+        if index <= 0:
+            for item in reversed(items):
+                self.appendleft(item)
+            return
+        if index >= self._len:
+            self.extend(items)
+            return
+        self._compact()
+        for i, item in enumerate(items, index):
+            item._queue = self
+            item._slot = i
+        self._slots[index:index] = items
+        self._rebuild_cols(0)
+        self._len += len(items)
+        self.revision += 1
+
+    def move(self, src, dst):
+        """把第 src 首移到第 dst 首的位置"""
+        n = self._len
+        if src < 0: src += n
+        if dst < 0: dst += n
+        if not (0 <= src < n and 0 <= dst < n):
+            raise IndexError("queue index out of range")
+        self._compact()
+        item = self._slots.pop(src)
+        self._slots.insert(dst, item)
+        item._slot = dst  # 被擠動的其他歌位置提示會過期，_find_slot 找不到時再掃描
+        for col in self._cols[_TIME:]:
+            value = col.pop(src)
+            col.insert(dst, value)
+        self._trees = None
+        self.revision += 1
+
+    def shuffle(self):
+        self._compact()
+        random.shuffle(self._slots)
+        for i, x in enumerate(self._slots):
+            x._slot = i
+        self._rebuild_cols(0)
+        self.revision += 1
+
+    # --- 時間索引 ---
+    def total_duration(self):
+        """整個佇列的 (已知長度總和秒數, 長度未知的首數)"""
+        end = len(self._slots)
+        return (
+            self._prefix(_TIME, end) - self._prefix(_TIME, self._head),
+            int(self._prefix(_UNKNOWN, end) - self._prefix(_UNKNOWN, self._head))
+        )
+
+    def time_before(self, index):
+        """第 index 首開播前要先播完的 (已知長度總和秒數, 長度未知的首數)"""
+        slot = self._slot_of(index)
+        return (
+            self._prefix(_TIME, slot) - self._prefix(_TIME, self._head),
+            int(self._prefix(_UNKNOWN, slot) - self._prefix(_UNKNOWN, self._head))
+        )
+
+    def _retime(self, item):
+        """Track.duration 被改寫時呼叫"""
+        try:
+            slot = self._find_slot(item)
+        except ValueError:
+            item._queue = None
+            return
+        self._set(slot, item)
+
+    def memory_estimate(self):
+        """整個佇列大約佔用的位元組數 (陣列 + 三個欄位 + 建好的索引 + 每首歌)"""
+        size = sys.getsizeof(self._slots) + sum(map(sys.getsizeof, self._cols))
+        for tree in self._trees or ():
+            size += sys.getsizeof(tree) + sum(map(sys.getsizeof, tree))
+        return size + sum(x.memory_estimate() for x in self)
+
+    # --- 內部：空位與名次 ---
+    def _skip(self):
+        """head 跳過被刪掉的空位"""
+        slots = self._slots
+        while slots[self._head] is None:
+            self._head += 1
+
+    def _slot_of(self, index):
+        """第 index 首 (可負數) 在陣列裡的位置"""
+        n = self._len
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("queue index out of range")
+        if index == 0:
+            self._skip()
+            return self._head
+        if index == n - 1:
+            return len(self._slots) - 1  # 尾端的空位刪除時就收掉了
+        return _fw_search(self._tree(_COUNT), self._prefix(_COUNT, self._head) + index + 1)
+
+    def _find_slot(self, item):
+        slot = item._slot
+        slots = self._slots
+        if self._head <= slot < len(slots) and slots[slot] is item:
+            return slot
+        for i in range(self._head, len(slots)):
+            if slots[i] is item:
+                item._slot = i
+                return i
+        raise ValueError("track not in queue")
+
+    def _set(self, slot, item):
+        """改寫某一格的三個欄位 (item 為 None 代表刪除)"""
+        if item is None:
+            values = (0, 0.0, 0)
+        else:
+            values = (1, item._duration, 0 if item._duration else 1)
+        trees = self._trees
+        for c, (col, value) in enumerate(zip(self._cols, values)):
+            delta = value - col[slot]
+            if delta:
+                col[slot] = value
+                if trees is not None:
+                    _fw_add(trees[c], slot, delta)
+
+    def _kill(self, slot):
+        self.revision += 1
+        item = self._slots[slot]
+        item._queue = None
+        item._slot = -1
+        self._slots[slot] = None
+        self._set(slot, None)
+        self._len -= 1
+        if not self._len:
+            self._reset()
+            return
+        # 尾端的空位直接收掉 (Fenwick tree 砍掉最後一格仍然正確)
+        slots = self._slots
+        while slots[-1] is None:
+            slots.pop()
+            for col in self._cols:
+                col.pop()
+            if self._trees is not None:
+                for tree in self._trees:
+                    tree.pop()
+
+    def _compact(self, front=0):
+        """把 head 之前與中間的空位清掉，前面預留 front 格給 appendleft"""
+        if not front and not self._head and len(self._slots) == self._len:
+            return
+        alive = [x for x in islice(self._slots, self._head, None) if x is not None]
+        self._slots = [None] * front + alive
+        self._head = front
+        for i in range(front, len(self._slots)):
+            self._slots[i]._slot = i
+        self._rebuild_cols(front)
+
+    def _rebuild_cols(self, front):
+        """依目前的陣列重建三個欄位 (前 front 格是空位)"""
+        alive = self._slots[front:]
+        durations = array('d', bytes(8 * front))
+        durations.extend(x._duration for x in alive)
+        self._cols = (
+            bytearray(front) + b'\x01' * len(alive),
+            durations,
+            bytearray(front) + bytearray(0 if x._duration else 1 for x in alive)
+        )
+        self._trees = None
+
+    # --- 內部：Fenwick tree ---
+    def _tree(self, c):
+        if self._trees is None:
+            self._trees = [_fw_build(col) for col in self._cols]
+        return self._trees[c]
+
+    def _prefix(self, c, slot):
+        """第 c 欄前 slot 格的總和"""
+        return _fw_prefix(self._tree(c), slot)
+
+def _fw_build(values):
+    tree = [0]
+    tree.extend(values)
+    n = len(tree)
+    for i in range(1, n):
+        j = i + (i & -i)
+        if j < n:
+            tree[j] += tree[i]
+    return tree
+
+def _fw_grow(tree, value):
+    """陣列尾端多一格時同步延長 tree"""
+    i = len(tree)
+    low = i - (i & -i)
+    j = i - 1
+    while j > low:
+        value += tree[j]
+        j -= j & -j
+    tree.append(value)
+
+def _fw_add(tree, slot, delta):
+    i = slot + 1
+    while i < len(tree):
+        tree[i] += delta
+        i += i & -i
+
+def _fw_prefix(tree, slot):
+    total = 0
+    i = slot
+    while i > 0:
+        total += tree[i]
+        i -= i & -i
+    return total
+
+def _fw_search(tree, k):
+    """前綴和剛好到 k 的那一格"""
+    pos = 0
+    step = 1 << (len(tree) - 1).bit_length() >> 1
+    while step:
+        nxt = pos + step
+        if nxt < len(tree) and tree[nxt] < k:
+            pos = nxt
+            k -= tree[nxt]
+        step >>= 1
+    return pos